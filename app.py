@@ -13,10 +13,15 @@ from flask_migrate import Migrate
 # Import local modules
 from extensions import db, login_manager
 from models import User, MasteredFile
+from utils.jobs import job_queue
+from utils.result_cache import result_cache
+from utils.metrics import job_metrics
+from utils.profiling import profiler
 from routes.auth import auth_bp
 from routes.views import views_bp
 from routes.stripe_routes import stripe_bp
 from routes.api import api_bp
+from routes.admin import admin_bp
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
@@ -43,9 +48,40 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 }
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+# Background jobs: 'local' process pool or 'database' queue served by `flask jobs-worker`
+app.config["JOB_BACKEND"] = os.environ.get("JOB_BACKEND", "local")
+if os.environ.get("JOB_WORKERS"):
+    app.config["JOB_WORKERS"] = int(os.environ["JOB_WORKERS"])
+if os.environ.get("DSP_WORKERS"):
+    app.config["DSP_WORKERS"] = int(os.environ["DSP_WORKERS"])
+
+# Cache of mastered results, keyed by input hash + preset
+app.config["RESULT_CACHE_DIR"] = os.environ.get("RESULT_CACHE_DIR", "result_cache")
+if os.environ.get("RESULT_CACHE_MAX_BYTES"):
+    app.config["RESULT_CACHE_MAX_BYTES"] = int(os.environ["RESULT_CACHE_MAX_BYTES"])
+
+# Per-stage job metrics served at /metrics ('' disables them), optionally behind a bearer token
+app.config["METRICS_FILE"] = os.environ.get("METRICS_FILE", "job_metrics.json")
+app.config["METRICS_TOKEN"] = os.environ.get("METRICS_TOKEN")
+
+# On-demand profiling of the workers (utils.profiling), for the accounts in ADMIN_EMAILS
+app.config["PROFILER_ENABLED"] = os.environ.get("PROFILER_ENABLED", "").lower() in ("1", "true", "yes")
+app.config["PROFILE_DIR"] = os.environ.get("PROFILE_DIR", "profiles")
+app.config["PROFILER_SIGNAL"] = os.environ.get("PROFILER_SIGNAL", "SIGUSR2")
+app.config["ADMIN_EMAILS"] = [email.strip() for email in os.environ.get("ADMIN_EMAILS", "").split(",") if email.strip()]
+
+# Downloads: 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd) lets the proxy send the bytes
+app.config["DOWNLOAD_OFFLOAD"] = os.environ.get("DOWNLOAD_OFFLOAD")
+app.config["DOWNLOAD_ACCEL_PREFIX"] = os.environ.get("DOWNLOAD_ACCEL_PREFIX", "/protected/")
+app.config["USE_X_SENDFILE"] = app.config["DOWNLOAD_OFFLOAD"] == "x-sendfile"
+
 # Initialize extensions
 db.init_app(app)
 migrate = Migrate(app, db)
+job_queue.init_app(app)
+result_cache.init_app(app)
+job_metrics.init_app(app)
+profiler.init_app(app)
 login_manager.init_app(app)
 login_manager.login_view = 'auth.login_page'
 
@@ -170,12 +206,17 @@ def logout():
 # Create database tables
 with app.app_context():
     db.create_all()
+    # Jobs of a previous run cannot be resumed by this process's pool (flask
+    # commands such as db upgrade run beside the web process and leave them)
+    if not os.environ.get("FLASK_RUN_FROM_CLI"):
+        job_queue.fail_orphaned_jobs()
     
     # Enregistrer les blueprints
     app.register_blueprint(views_bp)
     app.register_blueprint(stripe_bp)
     app.register_blueprint(auth_bp)
     app.register_blueprint(api_bp)
+    app.register_blueprint(admin_bp)
 
 if __name__ == '__main__':
     app.run(debug=True, port=5000)
@@ -0,0 +1,171 @@
+"""
+Spectral and dynamics analysis used to suggest a preset
+
+The track is analysed as a stream: the mono mix is cut into overlapping
+Hann-windowed frames whose magnitude spectra are averaged (Welch's method),
+while RMS and peak are accumulated sample by sample. Memory use depends on
+the frame and batch sizes only, so the same analyzer works on a decoded
+AudioBuffer, on the blocks of the streaming mode or on a file read through
+an ffmpeg pipe.
+
+Results are plain dictionaries so they can be stored as JSON next to the
+other per-input data and reused without decoding the file again.
+"""
+import json
+import os
+import tempfile
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from audio_processing.decoder import open_reader
+from audio_processing.dynamics import BLOCK_SIZE
+
+# STFT frame length and hop (50% overlap)
+FRAME_SIZE = 8192
+HOP_SIZE = FRAME_SIZE // 2
+
+# Frames transformed per rfft call
+BATCH_FRAMES = 64
+
+# (name, low Hz, high Hz) of the bands compared by suggest_preset
+BANDS = (
+    ('bass', 0.0, 250.0),
+    ('mid', 250.0, 2000.0),
+    ('high', 2000.0, None),
+)
+
+
+class SpectrumAnalyzer:
+    """
+    Welch-averaged magnitude spectrum, RMS and crest factor of a track
+
+    Feed frames x channels float blocks with add() and call finish() once.
+    """
+
+    def __init__(self, sample_rate, frame_size=FRAME_SIZE, hop_size=HOP_SIZE,
+                 batch_frames=BATCH_FRAMES):
+        self.sample_rate = sample_rate
+        self.frame_size = frame_size
+        self.hop_size = hop_size
+        self.batch_frames = batch_frames
+        self.window = np.hanning(frame_size).astype(np.float32)
+        self.frames = 0
+        self._magnitude = np.zeros(frame_size // 2 + 1, dtype=np.float64)
+        self._spectra = 0
+        self._sum_squares = 0.0
+        self._peak = 0.0
+        self._pending = np.empty(0, dtype=np.float32)
+
+    def _add_frames(self, frames):
+        for start in range(0, len(frames), self.batch_frames):
+            batch = frames[start:start + self.batch_frames] * self.window
+            self._magnitude += np.abs(np.fft.rfft(batch, axis=1)).sum(axis=0)
+            self._spectra += len(batch)
+
+    def add(self, block):
+        if len(block) == 0:
+            return
+        mono = block.mean(axis=1, dtype=np.float32) if block.shape[1] > 1 else block[:, 0]
+        self.frames += len(mono)
+        self._sum_squares += float(np.square(mono, dtype=np.float64).sum())
+        self._peak = max(self._peak, float(np.max(mono)), -float(np.min(mono)))
+
+        signal = np.concatenate([self._pending, mono]) if len(self._pending) else mono
+        if len(signal) < self.frame_size:
+            self._pending = np.array(signal, dtype=np.float32)
+            return
+        frames = sliding_window_view(signal, self.frame_size)[::self.hop_size]
+        self._add_frames(frames)
+        self._pending = np.array(signal[len(frames) * self.hop_size:], dtype=np.float32)
+
+    def finish(self):
+        """
+        Returns:
+            analysis: Dictionary with duration, rms, peak, crest_factor and
+                band_energy (share of the averaged magnitude spectrum per
+                band, the measure the preset heuristic was tuned on)
+        """
+        if self._spectra == 0 and len(self._pending):
+            # Shorter than one frame: analyse it zero-padded
+            frame = np.zeros((1, self.frame_size), dtype=np.float32)
+            frame[0, :len(self._pending)] = self._pending
+            self._add_frames(frame)
+
+        spectrum = self._magnitude / max(1, self._spectra)
+        freqs = np.fft.rfftfreq(self.frame_size, 1.0 / self.sample_rate)
+        total = spectrum.sum()
+        band_energy = {}
+        for name, low, high in BANDS:
+            mask = freqs >= low
+            if high is not None:
+                mask &= freqs < high
+            band_energy[name] = float(spectrum[mask].sum() / total) if total > 0 else 0.0
+
+        rms = np.sqrt(self._sum_squares / self.frames) if self.frames else 0.0
+        return {
+            'sample_rate': self.sample_rate,
+            'duration': self.frames / float(self.sample_rate),
+            'rms': float(rms),
+            'peak': self._peak,
+            'crest_factor': self._peak / rms if rms > 0 else 1.0,
+            'band_energy': band_energy,
+        }
+
+
+def analyze_buffer(buffer):
+    """Analyse a decoded AudioBuffer (read in blocks, the buffer is not modified)"""
+    analyzer = SpectrumAnalyzer(buffer.sample_rate)
+    for start in range(0, buffer.frames, BLOCK_SIZE):
+        analyzer.add(buffer.samples[start:start + BLOCK_SIZE])
+    return analyzer.finish()
+
+
+def analyze_file(file_path):
+    """Analyse an audio file block by block, in bounded memory"""
+    with open_reader(file_path) as reader:
+        analyzer = SpectrumAnalyzer(reader.sample_rate)
+        for block in reader:
+            analyzer.add(block)
+    return analyzer.finish()
+
+
+def suggest_preset(analysis):
+    """
+    Preset name suggested by an analysis
+
+    - Already compressed (low crest factor): trap if bass dominates the
+      highs, lofi otherwise
+    - Bass-heavy: warm
+    - More highs than bass: bright
+    - Otherwise: clean
+    """
+    bands = analysis['band_energy']
+    bass, mid, high = bands['bass'], bands['mid'], bands['high']
+    if analysis['crest_factor'] < 3.0:
+        return 'trap' if bass > high else 'lofi'
+    if bass > mid and bass > high:
+        return 'warm'
+    if high > bass:
+        return 'bright'
+    return 'clean'
+
+
+def load_analysis(path):
+    """Stored analysis, or None when there is none yet"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_analysis(path, analysis):
+    """Store an analysis as JSON, atomically"""
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    with os.fdopen(fd, 'w') as f:
+        json.dump(analysis, f)
+    os.replace(temp_path, path)
+    return path
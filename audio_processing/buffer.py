@@ -0,0 +1,100 @@
+"""
+Float32 audio buffer used between the stages of the processing pipeline
+
+Audio is decoded once into a C-contiguous float32 array shaped
+frames x channels with samples in the [-1.0, 1.0] range. Stages modify that
+array in place and the buffer is converted back to integer PCM only when
+it is exported.
+"""
+import numpy as np
+from pydub import AudioSegment
+
+from audio_processing.decoder import read_audio
+
+# Sample width (in bytes) of the PCM handed to the encoder
+EXPORT_SAMPLE_WIDTH = 2
+
+
+def full_scale(sample_width):
+    """Largest magnitude representable by signed PCM of the given width"""
+    return float(1 << (8 * sample_width - 1))
+
+
+class AudioBuffer:
+    """
+    Decoded audio shared by every stage of process_audio
+
+    Attributes:
+        samples: float32 array shaped frames x channels
+        sample_rate: Sample rate in Hz
+    """
+
+    def __init__(self, samples, sample_rate):
+        samples = np.asarray(samples, dtype=np.float32)
+        if samples.ndim == 1:
+            samples = samples[:, np.newaxis]
+        self.samples = np.ascontiguousarray(samples)
+        self.sample_rate = int(sample_rate)
+
+    @property
+    def channels(self):
+        return self.samples.shape[1]
+
+    @property
+    def frames(self):
+        return self.samples.shape[0]
+
+    @property
+    def duration(self):
+        """Duration in seconds"""
+        return self.frames / float(self.sample_rate)
+
+    @property
+    def nbytes(self):
+        return self.samples.nbytes
+
+    def peak(self):
+        """Absolute peak over all channels"""
+        if self.frames == 0:
+            return 0.0
+        return float(max(np.max(self.samples), -np.min(self.samples)))
+
+    def apply_gain(self, gain_db):
+        """Apply a broadband gain in dB, in place"""
+        if gain_db != 0:
+            self.samples *= np.float32(10 ** (gain_db / 20.0))
+        return self
+
+    @classmethod
+    def from_file(cls, file_path):
+        """
+        Decode an audio file once into a float32 buffer
+
+        The format is sniffed from the file's content (see
+        audio_processing.decoder), so any input ffmpeg reads is accepted.
+        """
+        samples, sample_rate = read_audio(file_path)
+        return cls(samples, sample_rate)
+
+    def to_pcm(self, sample_width=EXPORT_SAMPLE_WIDTH):
+        """Convert to interleaved, clipped, signed integer PCM bytes"""
+        scale = full_scale(sample_width)
+        pcm = np.empty(self.samples.shape, dtype=f'<i{sample_width}')
+        scaled = self.samples * np.float32(scale)
+        np.clip(np.rint(scaled, out=scaled), -scale, scale - 1, out=scaled)
+        pcm[...] = scaled
+        return pcm.tobytes()
+
+    def to_segment(self, sample_width=EXPORT_SAMPLE_WIDTH):
+        """Convert to a pydub AudioSegment for encoding"""
+        return AudioSegment(
+            data=self.to_pcm(sample_width),
+            sample_width=sample_width,
+            frame_rate=self.sample_rate,
+            channels=self.channels,
+        )
+
+    def export(self, output_path, format='mp3', bitrate='320k', tags=None):
+        """Encode the buffer to a file, converting to integer PCM only here"""
+        self.to_segment().export(output_path, format=format, bitrate=bitrate, tags=tags)
+        return output_path
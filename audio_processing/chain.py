@@ -0,0 +1,291 @@
+"""
+Compiled preset chains
+
+A preset dict is validated and compiled once into an immutable
+CompiledPreset: every optional key is resolved to its default, EQ band
+names are parsed to Hz and sorted, and a disabled stage is stored as None.
+The part that depends on the audio format (the EQ's second-order
+sections, whether the width stage applies) is computed by preset_chain and
+cached per (preset, sample_rate, channels), so a job only builds its
+stateful stage objects from ready-made values.
+
+Presets are cached by content rather than identity, so one that was
+pickled to a worker process still hits the cache. Only the processing
+settings count (processing_settings): presets that differ in name or
+description share one entry. Invalid preset data
+raises PresetError; the built-in presets are compiled when
+audio_processing.presets is imported, so a bad entry fails at startup
+instead of in the middle of a job.
+
+The accepted keys and ranges are declared once (NUMBERS, FLAGS and the
+EQ ranges below); compile_preset enforces them and preset_schema() gives
+the same rules as a JSON Schema for clients editing custom presets.
+"""
+import math
+import re
+import threading
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+from audio_processing.eq import compile_eq, parse_band_frequency
+
+# Compiled presets and chains kept per process
+CACHE_SIZE = 256
+
+# Numeric settings: default, minimum, maximum
+NUMBERS = {
+    'target_dBFS': (-1.0, -60.0, 0.0),
+    'target_lufs': (None, -70.0, 0.0),
+    'gain_db': (0.0, -24.0, 24.0),
+    'threshold_db': (-20.0, -80.0, 0.0),
+    'ratio': (4.0, 1.0, 100.0),
+    'attack_ms': (5.0, 0.01, 1000.0),
+    'release_ms': (50.0, 0.01, 5000.0),
+    'stereo_width': (100.0, 0.0, 200.0),  # Percent, 100 leaves the image unchanged
+    'ceiling_db': (-0.3, -20.0, 0.0),
+}
+
+# Stage switches, all on by default
+FLAGS = ('normalize', 'compression', 'eq', 'limiter')
+
+EQ_FREQUENCY_RANGE = (10.0, 30000.0)
+EQ_GAIN_RANGE = (-24.0, 24.0)
+BITRATE_PATTERN = r'^\d{2,3}k$'
+DEFAULT_BITRATE = '320k'
+
+# Every key a preset's processing reads
+SETTINGS_KEYS = tuple(NUMBERS) + FLAGS + ('eq_bands', 'bitrate')
+
+_BITRATE_PATTERN = re.compile(BITRATE_PATTERN)
+
+CompressorSettings = namedtuple('CompressorSettings', 'threshold_db ratio attack_ms release_ms')
+
+CompiledPreset = namedtuple('CompiledPreset', [
+    'bitrate',
+    'normalize',      # Peak normalization to target_dBFS (when no target_lufs)
+    'target_dBFS',
+    'target_lufs',    # Loudness target, or None
+    'gain_db',
+    'compressor',     # CompressorSettings, or None
+    'eq_bands',       # ((frequency in Hz, gain in dB), ...) sorted, or None
+    'stereo_width',   # Side gain relative to mid (1.0 is unchanged)
+    'ceiling_db',     # Limiter ceiling, or None without limiter
+])
+
+PresetChain = namedtuple('PresetChain', [
+    'preset',         # CompiledPreset
+    'sample_rate',
+    'channels',
+    'eq_sos',         # Read-only (sections, 6) array, empty when flat
+    'stereo_width',   # Width factor, or None when it leaves the audio unchanged
+])
+
+
+class PresetError(ValueError):
+    """Invalid preset data"""
+
+
+def _error(preset, message):
+    name = preset.get('name')
+    return PresetError(f"Preset {name!r}: {message}" if name else message)
+
+
+def _number(preset, key, default=None, low=None, high=None, values=None):
+    """Numeric setting of a preset (or of its values mapping, e.g. eq_bands), range checked"""
+    if values is None:
+        default, low, high = NUMBERS[key]
+    value = (preset if values is None else values).get(key, default)
+    if value is None and default is None and values is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or not math.isfinite(value):
+        raise _error(preset, f"{key} must be a number, got {value!r}")
+    if not low <= value <= high:
+        raise _error(preset, f"{key} must be between {low} and {high}, got {value}")
+    return float(value)
+
+
+def _flag(preset, key, default=True):
+    value = preset.get(key, default)
+    if not isinstance(value, bool):
+        raise _error(preset, f"{key} must be true or false, got {value!r}")
+    return value
+
+
+def _eq_bands(preset):
+    bands = preset.get('eq_bands', {})
+    if not isinstance(bands, dict):
+        raise _error(preset, "eq_bands must be a mapping")
+    parsed = []
+    for band in bands:
+        try:
+            frequency = parse_band_frequency(band)
+        except (TypeError, ValueError):
+            raise _error(preset, f"invalid EQ band {band!r}")
+        if not EQ_FREQUENCY_RANGE[0] <= frequency <= EQ_FREQUENCY_RANGE[1]:
+            raise _error(preset, f"EQ band {band!r} out of range")
+        parsed.append((frequency, _number(preset, band, 0.0, *EQ_GAIN_RANGE, values=bands)))
+    return tuple(sorted(parsed))
+
+
+def _compile(preset):
+    bitrate = preset.get('bitrate', DEFAULT_BITRATE)
+    if not isinstance(bitrate, str) or not _BITRATE_PATTERN.match(bitrate):
+        raise _error(preset, f"invalid bitrate {bitrate!r}")
+
+    compressor = None
+    if _flag(preset, 'compression'):
+        compressor = CompressorSettings(
+            _number(preset, 'threshold_db'),
+            _number(preset, 'ratio'),
+            _number(preset, 'attack_ms'),
+            _number(preset, 'release_ms'),
+        )
+
+    eq_bands = _eq_bands(preset)
+    return CompiledPreset(
+        bitrate=bitrate,
+        normalize=_flag(preset, 'normalize'),
+        target_dBFS=_number(preset, 'target_dBFS'),
+        target_lufs=_number(preset, 'target_lufs'),
+        gain_db=_number(preset, 'gain_db'),
+        compressor=compressor,
+        eq_bands=eq_bands if _flag(preset, 'eq') else None,
+        stereo_width=_number(preset, 'stereo_width') / 100.0,
+        ceiling_db=_number(preset, 'ceiling_db') if _flag(preset, 'limiter') else None,
+    )
+
+
+def processing_settings(preset):
+    """Settings of a preset dictionary that its processing reads (SETTINGS_KEYS), without name or description"""
+    return {key: preset[key] for key in SETTINGS_KEYS if key in preset}
+
+
+def _freeze(value):
+    """Hashable copy of a preset value (typed, so 1, 1.0 and True stay distinct)"""
+    if isinstance(value, dict):
+        return tuple(sorted((repr(k), _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return type(value).__name__, value
+
+
+# Least recently used first; web threads compile presets concurrently
+_compiled = OrderedDict()
+_compiled_lock = threading.Lock()
+
+
+def compile_preset(preset):
+    """
+    Validate and compile a preset
+
+    Args:
+        preset: Preset dictionary (see audio_processing.presets), or an
+            already compiled preset
+
+    Returns:
+        CompiledPreset, shared between calls with equal presets
+
+    Raises:
+        PresetError: if a value is missing its expected type or range
+    """
+    if isinstance(preset, CompiledPreset):
+        return preset
+    if not isinstance(preset, dict):
+        raise PresetError(f"A preset must be a mapping, got {type(preset).__name__}")
+    try:
+        key = _freeze(processing_settings(preset))
+        with _compiled_lock:
+            compiled = _compiled.get(key)
+            if compiled is not None:
+                _compiled.move_to_end(key)
+    except TypeError:
+        return _compile(preset)  # Unhashable extra data, compile without caching
+    if compiled is None:
+        compiled = _compile(preset)
+        with _compiled_lock:
+            _compiled[key] = compiled
+            _compiled.move_to_end(key)
+            while len(_compiled) > CACHE_SIZE:
+                _compiled.popitem(last=False)
+    return compiled
+
+
+def validate_settings(settings):
+    """
+    Check user-supplied preset settings (custom presets)
+
+    Stricter than compile_preset: only SETTINGS_KEYS are accepted.
+
+    Args:
+        settings: Mapping of processing settings
+
+    Returns:
+        settings: Copy restricted to the processing keys
+
+    Raises:
+        PresetError: on unknown keys or invalid values
+    """
+    if not isinstance(settings, dict):
+        raise PresetError("Preset settings must be an object")
+    unknown = sorted(set(settings) - set(SETTINGS_KEYS))
+    if unknown:
+        raise PresetError(f"Unknown preset settings: {', '.join(map(str, unknown))}")
+    compile_preset(settings)
+    return dict(settings)
+
+
+def preset_schema():
+    """JSON Schema of the settings validate_settings accepts"""
+    properties = {}
+    for key, (default, low, high) in NUMBERS.items():
+        properties[key] = {'type': 'number', 'minimum': low, 'maximum': high}
+        if default is None:
+            properties[key]['type'] = ['number', 'null']
+        else:
+            properties[key]['default'] = default
+    for key in FLAGS:
+        properties[key] = {'type': 'boolean', 'default': True}
+    properties['bitrate'] = {'type': 'string', 'pattern': BITRATE_PATTERN, 'default': DEFAULT_BITRATE}
+    properties['eq_bands'] = {
+        'type': 'object',
+        'description': f"Gain in dB per band, named like '60Hz' or '10kHz' "
+                       f"({EQ_FREQUENCY_RANGE[0]:g} Hz to {EQ_FREQUENCY_RANGE[1]:g} Hz)",
+        'propertyNames': {'pattern': r'^\s*\d+(\.\d+)?\s*[kK]?[hH][zZ]\s*$'},
+        'additionalProperties': {'type': 'number', 'minimum': EQ_GAIN_RANGE[0], 'maximum': EQ_GAIN_RANGE[1]},
+    }
+    return {
+        '$schema': 'https://json-schema.org/draft/2020-12/schema',
+        'title': 'Masterify preset settings',
+        'type': 'object',
+        'properties': properties,
+        'additionalProperties': False,
+    }
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _chain(compiled, sample_rate, channels):
+    sos = compile_eq(dict(compiled.eq_bands or ()), sample_rate)
+    sos.flags.writeable = False
+    width = compiled.stereo_width
+    return PresetChain(
+        preset=compiled,
+        sample_rate=sample_rate,
+        channels=channels,
+        eq_sos=sos,
+        stereo_width=width if width != 1.0 and channels == 2 else None,
+    )
+
+
+def preset_chain(preset, sample_rate, channels):
+    """
+    Compiled preset with its sample-rate dependent coefficients
+
+    Args:
+        preset: Preset dictionary or CompiledPreset
+        sample_rate: Sample rate of the audio
+        channels: Channel count of the audio
+
+    Returns:
+        PresetChain, cached per (preset, sample_rate, channels)
+    """
+    return _chain(compile_preset(preset), int(sample_rate), int(channels))
@@ -0,0 +1,256 @@
+"""
+Audio decoding shared by the in-memory, streaming and analysis paths
+
+The container of an input is recognised from its first bytes (sniff_format),
+not from its file name. Supported WAV files are read from a memory mapping
+(see audio_processing.wavfile); everything else (MP3, FLAC, AIFF, M4A/AAC,
+Ogg) is decoded by an ffmpeg subprocess writing float32 PCM to a pipe that
+is read straight into NumPy arrays, with no intermediate WAV file and no
+round trip through integer samples. ffmpeg is told the container it is in,
+so it does not probe the file again; a file whose header is not recognised
+is left to ffmpeg's own probing and only rejected if ffmpeg cannot decode it.
+
+Two ways to read an input:
+
+- open_reader: float32 frames x channels blocks, in bounded memory
+- read_audio: the whole input as one float32 frames x channels array
+"""
+import struct
+import subprocess
+import tempfile
+
+import numpy as np
+from pydub import AudioSegment
+from pydub.exceptions import CouldntDecodeError
+
+from audio_processing.wavfile import UnsupportedWav, WavFile, WavReader, is_wav
+
+# Frames per block of open_reader
+DECODE_BLOCK_FRAMES = 65536
+
+# Bytes read from the pipe at a time by FFmpegReader.read
+READ_CHUNK_BYTES = 1024 * 1024
+
+# Bytes of a file examined by sniff_format
+SNIFF_BYTES = 12
+
+# ffmpeg demuxer of each container sniff_format recognises
+DEMUXERS = {
+    'wav': 'wav',
+    'aiff': 'aiff',
+    'flac': 'flac',
+    'ogg': 'ogg',
+    'm4a': 'mov',
+    'mp3': 'mp3',
+    'aac': 'aac',
+}
+
+# WAVE_FORMAT_IEEE_FLOAT and WAVE_FORMAT_EXTENSIBLE
+_FLOAT_FORMATS = (3, 0xFFFE)
+
+
+def sniff_format(file_path):
+    """
+    Container of an audio file, from its magic bytes
+
+    Returns:
+        'wav', 'aiff', 'flac', 'ogg', 'm4a', 'mp3', 'aac' (ADTS), or None
+        if the header is not recognised (ffmpeg then probes the file itself)
+    """
+    with open(file_path, 'rb') as f:
+        header = f.read(SNIFF_BYTES)
+
+    if header[:4] in (b'RIFF', b'RF64') and header[8:12] == b'WAVE':
+        return 'wav'
+    if header[:4] == b'FORM' and header[8:12] in (b'AIFF', b'AIFC'):
+        return 'aiff'
+    if header[:4] == b'fLaC':
+        return 'flac'
+    if header[:4] == b'OggS':
+        return 'ogg'
+    if header[4:8] == b'ftyp':
+        return 'm4a'
+    if header[:3] == b'ID3':
+        return 'mp3'
+    if len(header) >= 2 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0:
+        # MPEG frame sync: layer bits 00 are AAC in an ADTS stream
+        return 'aac' if header[1] & 0x06 == 0 else 'mp3'
+    return None
+
+
+def _read_exact(stream, size):
+    data = stream.read(size)
+    if len(data) != size:
+        raise CouldntDecodeError("Unexpected end of stream while reading the WAV header")
+    return data
+
+
+class FFmpegReader:
+    """
+    Decode an audio file to float32 blocks through an ffmpeg pipe
+
+    ffmpeg writes a streaming WAV (pcm_f32le) to stdout; the header gives
+    the sample rate and channel count and the rest is read in fixed-size
+    blocks. Use as a context manager and iterate to get frames x channels
+    arrays. The array yielded is reused for the next block.
+
+    start and duration (seconds) restrict decoding to a window: ffmpeg
+    seeks in the input instead of decoding everything before it. container
+    (a sniff_format result) selects ffmpeg's demuxer; without it ffmpeg
+    probes the file.
+    """
+
+    def __init__(self, file_path, block_frames=DECODE_BLOCK_FRAMES, start=None, duration=None,
+                 container=None):
+        self.file_path = file_path
+        self.block_frames = block_frames
+        self.start = start
+        self.duration = duration
+        self.container = container
+        self.sample_rate = None
+        self.channels = None
+        self._process = None
+        self._stderr = None
+
+    def open(self):
+        command = [AudioSegment.converter, '-v', 'error', '-nostdin']
+        if self.start:
+            command.extend(['-ss', f'{self.start:.6f}'])
+        if self.duration is not None:
+            command.extend(['-t', f'{self.duration:.6f}'])
+        if self.container:
+            command.extend(['-f', DEMUXERS[self.container]])
+        command.extend(['-i', self.file_path,
+                        '-vn', '-map_metadata', '-1', '-f', 'wav', '-c:a', 'pcm_f32le', '-'])
+
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=self._stderr)
+        try:
+            self._read_header()
+        except CouldntDecodeError:
+            # ffmpeg's own error, if it failed, says more than the missing header
+            self.close()
+            raise
+        return self
+
+    def _read_header(self):
+        stdout = self._process.stdout
+        riff, _, wave = struct.unpack('<4sI4s', _read_exact(stdout, 12))
+        if riff != b'RIFF' or wave != b'WAVE':
+            raise CouldntDecodeError(f"Decoding failed: {self._errors()}")
+
+        while True:
+            chunk_id, chunk_size = struct.unpack('<4sI', _read_exact(stdout, 8))
+            if chunk_id == b'data':
+                return
+            chunk = _read_exact(stdout, chunk_size + (chunk_size & 1))
+            if chunk_id == b'fmt ':
+                audio_format, channels, sample_rate = struct.unpack('<HHI', chunk[:8])
+                if audio_format not in _FLOAT_FORMATS:
+                    raise CouldntDecodeError(f"Unexpected decoder output format {audio_format}")
+                self.channels = channels
+                self.sample_rate = sample_rate
+
+    def _errors(self):
+        self._stderr.seek(0)
+        return self._stderr.read().decode('utf-8', errors='replace').strip()
+
+    def __iter__(self):
+        block = np.empty((self.block_frames, self.channels), dtype=np.float32)
+        view = memoryview(block).cast('B')
+        frame_bytes = 4 * self.channels
+
+        while True:
+            filled = 0
+            while filled < len(view):
+                count = self._process.stdout.readinto(view[filled:])
+                if not count:
+                    break
+                filled += count
+
+            frames = filled // frame_bytes
+            if frames:
+                yield block[:frames]
+            if filled < len(view):
+                return
+
+    def read(self):
+        """
+        Decode the rest of the input into one frames x channels array
+
+        The pipe is appended to a bytearray that then backs the array, so
+        the decoded samples are not copied into a second buffer.
+        """
+        data = bytearray()
+        stdout = self._process.stdout
+        while True:
+            chunk = stdout.read(READ_CHUNK_BYTES)
+            if not chunk:
+                break
+            data += chunk
+
+        frame_bytes = 4 * self.channels
+        del data[len(data) - len(data) % frame_bytes:]
+        return np.frombuffer(data, dtype='<f4').reshape(-1, self.channels)
+
+    def close(self, check=True):
+        if self._process is None:
+            return
+        self._process.stdout.close()
+        returncode = self._process.wait()
+        errors = self._errors()
+        self._stderr.close()
+        self._process = None
+        if check and returncode != 0:
+            raise CouldntDecodeError(f"Decoding failed. ffmpeg returned error code: {returncode}\n\n{errors}")
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close(check=exc_type is None)
+
+
+def open_reader(file_path, block_frames=DECODE_BLOCK_FRAMES, start=None, duration=None):
+    """
+    Block reader of an audio file
+
+    Supported WAV files are read from a memory mapping, without an ffmpeg
+    process; anything else is decoded through ffmpeg, with the demuxer of
+    the sniffed container (ffmpeg probes files sniff_format does not
+    recognise). Both readers yield float32 frames x channels blocks (see
+    FFmpegReader).
+
+    Raises:
+        CouldntDecodeError: when the reader is opened, if ffmpeg cannot
+            decode the file
+    """
+    container = sniff_format(file_path)
+    if container == 'wav' and is_wav(file_path):
+        return WavReader(file_path, block_frames, start=start, duration=duration)
+    return FFmpegReader(file_path, block_frames, start=start, duration=duration, container=container)
+
+
+def read_audio(file_path):
+    """
+    Decode a whole audio file
+
+    Args:
+        file_path: Path to the audio file
+
+    Returns:
+        (samples, sample_rate): float32 array shaped frames x channels, and
+            the sample rate in Hz
+
+    Raises:
+        CouldntDecodeError: if ffmpeg cannot decode the file
+    """
+    container = sniff_format(file_path)
+    if container == 'wav':
+        try:
+            with WavFile(file_path) as wav:
+                return wav.read(), wav.sample_rate
+        except UnsupportedWav:
+            pass  # ADPCM, A-law...: decoded by ffmpeg
+    with FFmpegReader(file_path, container=container) as reader:
+        return reader.read(), reader.sample_rate
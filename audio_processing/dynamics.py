@@ -0,0 +1,442 @@
+"""
+Dynamics processing engine
+
+The compressor works on float samples in the [-1.0, 1.0] range laid out as
+frames x channels. Gain computation is fully vectorized and the envelope
+follower runs block by block, carrying its state across block boundaries so
+the same object can be fed a whole track or a stream of chunks.
+"""
+from functools import lru_cache
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import lfilter
+
+# Number of frames handled per vectorized step
+BLOCK_SIZE = 65536
+
+# Floor used when converting levels to dB
+MIN_LEVEL_DB = -120.0
+
+
+def time_constant(time_ms, sample_rate):
+    """Convert a time in milliseconds to a one-pole smoothing coefficient"""
+    if time_ms <= 0:
+        return 0.0
+    return float(np.exp(-1.0 / (sample_rate * time_ms / 1000.0)))
+
+
+def amplitude_to_db(levels):
+    """Convert linear amplitudes to dB, floored at MIN_LEVEL_DB"""
+    with np.errstate(divide='ignore'):
+        levels_db = 20.0 * np.log10(levels)
+    return np.maximum(levels_db, MIN_LEVEL_DB)
+
+
+def linked_levels(block):
+    """Absolute peak across channels for each frame of a frames x channels block"""
+    levels = np.abs(block[:, 0])
+    # Channel-wise maximum; much faster than reducing along the short axis
+    for channel in range(1, block.shape[1]):
+        np.maximum(levels, np.abs(block[:, channel]), out=levels)
+    return levels
+
+
+def release_envelope(reduction, coef, state):
+    """
+    Peak-hold with exponential release: y[n] = max(x[n], coef * y[n-1])
+
+    Dividing by coef**n turns the recursion into a running maximum, so the
+    block is evaluated with np.maximum.accumulate in the log domain.
+
+    Args:
+        reduction: Non-negative values shaped frames x detectors
+        coef: Release coefficient from time_constant
+        state: Last envelope value of the previous block, one per detector
+
+    Returns:
+        (envelope, state) where state is to be passed with the next block
+    """
+    if coef == 0.0 or len(reduction) == 0:
+        state = reduction[-1].copy() if len(reduction) else state
+        return reduction, state
+
+    log_coef = reduction.dtype.type(np.log(coef))
+    n = np.arange(len(reduction), dtype=reduction.dtype)[:, np.newaxis]
+    with np.errstate(divide='ignore'):
+        log_reduction = np.log(reduction)
+        log_state = np.log(np.asarray(state, dtype=reduction.dtype))
+
+    decayed = np.maximum.accumulate(log_reduction - n * log_coef, axis=0)
+    carried = log_state + log_coef
+    envelope = np.exp(np.maximum(decayed, carried) + n * log_coef)
+
+    return envelope, envelope[-1].copy()
+
+
+class Compressor:
+    """
+    Feed-forward compressor with a decoupled attack/release envelope follower
+
+    The gain computer maps the detector level to a gain reduction in dB
+    (hard or soft knee). The reduction is then smoothed in two stages: a
+    peak-hold with exponential release, evaluated in closed form with a
+    running maximum, followed by a one-pole attack filter run through
+    scipy's compiled lfilter.
+
+    Args:
+        threshold_db: Level above which gain reduction starts
+        ratio: Compression ratio (e.g. 4.0 for 4:1)
+        attack_ms: Attack time in milliseconds
+        release_ms: Release time in milliseconds
+        sample_rate: Sample rate of the signal in Hz
+        channels: Number of channels of the signal
+        stereo_link: Use one detector for all channels instead of one per channel
+        knee_db: Width of the soft knee in dB (0 for a hard knee)
+        makeup_db: Gain applied after compression
+        block_size: Number of frames processed per vectorized step
+    """
+
+    # Stage name in audio_processing.metrics
+    name = 'compression'
+
+    def __init__(self, threshold_db, ratio, attack_ms, release_ms, sample_rate,
+                 channels=2, stereo_link=True, knee_db=0.0, makeup_db=0.0,
+                 block_size=BLOCK_SIZE):
+        if ratio < 1.0:
+            raise ValueError(f"Compression ratio must be >= 1.0, got {ratio}")
+
+        self.threshold_db = float(threshold_db)
+        self.ratio = float(ratio)
+        self.knee_db = max(0.0, float(knee_db))
+        self.makeup_db = float(makeup_db)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.stereo_link = stereo_link
+        self.block_size = block_size
+
+        self.attack_coef = time_constant(attack_ms, sample_rate)
+        self.release_coef = time_constant(release_ms, sample_rate)
+
+        self.reset()
+
+    @property
+    def detectors(self):
+        """Number of independent envelope followers"""
+        return 1 if self.stereo_link else self.channels
+
+    def reset(self):
+        """Clear the envelope follower state"""
+        self._release_state = np.zeros(self.detectors)
+        self._attack_state = np.zeros(self.detectors)
+
+    def gain_reduction(self, levels_db):
+        """Static gain computer: gain reduction in dB (>= 0) for each level"""
+        slope = 1.0 - 1.0 / self.ratio
+        overshoot = levels_db - self.threshold_db
+
+        if self.knee_db == 0.0:
+            return np.maximum(overshoot, 0.0) * slope
+
+        half_knee = self.knee_db / 2.0
+        reduction = np.where(overshoot > half_knee, overshoot * slope, 0.0)
+        in_knee = np.abs(overshoot) <= half_knee
+        reduction[in_knee] = slope * (overshoot[in_knee] + half_knee) ** 2 / (2.0 * self.knee_db)
+        return reduction
+
+    def _detect(self, block):
+        """Detector level in dB, shaped frames x detectors"""
+        if self.stereo_link:
+            levels = linked_levels(block)[:, np.newaxis]
+        else:
+            levels = np.abs(block)
+        return amplitude_to_db(levels)
+
+    def _release(self, reduction):
+        """Exponential release stage, see release_envelope"""
+        envelope, self._release_state = release_envelope(
+            reduction, self.release_coef, self._release_state
+        )
+        return envelope
+
+    def _attack(self, envelope):
+        """One-pole attack smoothing, run through the compiled lfilter"""
+        if self.attack_coef == 0.0:
+            self._attack_state = envelope[-1].copy()
+            return envelope
+
+        b = np.array([1.0 - self.attack_coef], dtype=envelope.dtype)
+        a = np.array([1.0, -self.attack_coef], dtype=envelope.dtype)
+        zi = (self.attack_coef * self._attack_state)[np.newaxis, :].astype(envelope.dtype)
+        smoothed, zf = lfilter(b, a, envelope, axis=0, zi=zi)
+        self._attack_state = smoothed[-1].copy()
+        return smoothed
+
+    def gain_curve(self, block):
+        """Linear gain for each frame of the block, shaped frames x detectors"""
+        reduction = self.gain_reduction(self._detect(block))
+        envelope = self._attack(self._release(reduction))
+        gain_db = (self.makeup_db - envelope) / 20.0
+        return np.power(gain_db.dtype.type(10.0), gain_db)
+
+    def process(self, samples):
+        """
+        Compress samples in place
+
+        Args:
+            samples: float array shaped frames x channels
+
+        Returns:
+            The same array, compressed
+        """
+        for start in range(0, len(samples), self.block_size):
+            block = samples[start:start + self.block_size]
+            block *= self.gain_curve(block).astype(samples.dtype, copy=False)
+        return samples
+
+
+def compress(samples, sample_rate, threshold_db, ratio, attack_ms, release_ms,
+             stereo_link=True, knee_db=0.0, makeup_db=0.0):
+    """Compress a frames x channels float array in place with a fresh Compressor"""
+    compressor = Compressor(
+        threshold_db, ratio, attack_ms, release_ms, sample_rate,
+        channels=samples.shape[1], stereo_link=stereo_link,
+        knee_db=knee_db, makeup_db=makeup_db,
+    )
+    return compressor.process(samples)
+
+
+def sliding_max(values, window):
+    """
+    Maximum over every window of a 1-D array ('valid' mode), in O(n)
+
+    Van Herk/Gil-Werman algorithm: the array is cut into chunks of the
+    window size, and each window maximum is the max of a suffix maximum of
+    one chunk and a prefix maximum of the next one. Both are running
+    maxima, so the whole computation is vectorized.
+    """
+    count = len(values) - window + 1
+    if count <= 0:
+        return np.empty(0, dtype=values.dtype)
+    if window == 1:
+        return values.copy()
+
+    padding = (-len(values)) % window
+    chunks = np.concatenate([values, np.full(padding, -np.inf, dtype=values.dtype)])
+    chunks = chunks.reshape(-1, window)
+
+    prefix = np.maximum.accumulate(chunks, axis=1).ravel()
+    suffix = np.maximum.accumulate(chunks[:, ::-1], axis=1)[:, ::-1].ravel()
+    return np.maximum(suffix[:count], prefix[window - 1:window - 1 + count])
+
+
+@lru_cache(maxsize=None)
+def polyphase_interpolator(oversample, taps_per_phase):
+    """
+    Read-only (oversample, taps_per_phase + 1) windowed-sinc filter bank
+
+    Designed once per process and shared by every true-peak detector.
+    """
+    from scipy.signal import firwin
+
+    # Odd length so the group delay is a whole number of frames
+    num_taps = oversample * taps_per_phase + 1
+    prototype = firwin(num_taps, 1.0 / oversample) * oversample
+    phases = np.zeros((oversample, taps_per_phase + 1), dtype=np.float32)
+    for phase in range(oversample):
+        coefficients = prototype[phase::oversample]
+        phases[phase, :len(coefficients)] = coefficients
+    phases.flags.writeable = False
+    return phases
+
+
+class TruePeakDetector:
+    """
+    Oversampled (inter-sample) peak detector
+
+    The signal is upsampled with a polyphase windowed-sinc interpolator and
+    the peak of each frame is the largest magnitude among its oversampled
+    points, linked across channels. All phases are computed at once as a
+    matrix product over a sliding window of the input; the last input
+    frames are carried between blocks and the output is delayed by
+    `latency` frames.
+    """
+
+    def __init__(self, channels=2, oversample=4, taps_per_phase=12):
+        self.channels = channels
+        self.oversample = oversample
+        self.taps = taps_per_phase + 1
+        self._phases = polyphase_interpolator(oversample, taps_per_phase)
+        # Odd prototype length, so the group delay is a whole number of frames
+        self.latency = taps_per_phase // 2
+        self.reset()
+
+    def reset(self):
+        self._history = np.zeros((self.taps - 1, self.channels), dtype=np.float32)
+
+    def process(self, block):
+        """True-peak level of each frame, delayed by self.latency frames"""
+        extended = np.concatenate([self._history, block.astype(np.float32, copy=False)])
+        self._history = extended[len(extended) - self.taps + 1:].copy()
+
+        peaks = np.zeros(len(block), dtype=np.float32)
+        for channel in range(self.channels):
+            # windows[n] holds x[n], x[n-1], ..., x[n-taps+1]
+            windows = sliding_window_view(extended[:, channel], self.taps)[:, ::-1]
+            interpolated = self._phases @ windows.T
+            np.maximum(peaks, np.max(np.abs(interpolated), axis=0), out=peaks)
+        return peaks.astype(np.float64)
+
+    def tail(self):
+        """True-peak levels of the `latency` frames still held back, leaving the state unchanged"""
+        history = self._history
+        try:
+            return self.process(np.zeros((self.latency, self.channels), dtype=np.float32))
+        finally:
+            self._history = history
+
+
+class Limiter:
+    """
+    Lookahead brickwall limiter with true-peak detection
+
+    For each frame, the gain reduction needed to keep the oversampled peak
+    under the ceiling is computed, held over the lookahead window with a
+    sliding maximum, released exponentially and finally smoothed with a
+    moving average over the same window. The audio is delayed by the
+    lookahead, so the averaged gain has fully reached every peak's target
+    before the peak itself is output. All stages are O(n) per block and
+    keep their state, so the limiter can also run on a stream of chunks.
+
+    Args:
+        ceiling_db: Maximum true-peak level of the output in dBFS
+        sample_rate: Sample rate of the signal in Hz
+        channels: Number of channels of the signal
+        lookahead_ms: Lookahead (and attack) time in milliseconds
+        release_ms: Release time in milliseconds
+        oversample: Oversampling factor of the true-peak detector
+    """
+
+    name = 'limiter'
+
+    def __init__(self, ceiling_db, sample_rate, channels=2, lookahead_ms=5.0,
+                 release_ms=50.0, oversample=4, block_size=BLOCK_SIZE):
+        self.ceiling_db = float(ceiling_db)
+        self.ceiling = 10 ** (self.ceiling_db / 20.0)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block_size = block_size
+
+        self.lookahead = max(1, int(round(sample_rate * lookahead_ms / 1000.0)))
+        self.release_ms = float(release_ms)
+        self.release_coef = time_constant(release_ms, sample_rate)
+        self.detector = TruePeakDetector(channels, oversample)
+
+        self.reset()
+
+    @property
+    def latency(self):
+        """Delay between input and output, in frames"""
+        return self.lookahead + self.detector.latency
+
+    def reset(self):
+        self.detector.reset()
+        self._hold_history = np.zeros(self.lookahead)
+        self._smooth_history = np.zeros(self.lookahead)
+        self._release_state = np.zeros(1)
+        self._delay_line = np.zeros((self.latency, self.channels), dtype=np.float32)
+
+    def gain_curve(self, block):
+        """Linear gain for the delayed output frames of this block"""
+        peaks = self.detector.process(block)
+        reduction = amplitude_to_db(peaks / self.ceiling)
+        np.maximum(reduction, 0.0, out=reduction)
+
+        # Hold each reduction over the lookahead window
+        held = sliding_max(np.concatenate([self._hold_history, reduction]), self.lookahead + 1)
+        self._hold_history = reduction[-self.lookahead:] if len(reduction) >= self.lookahead \
+            else np.concatenate([self._hold_history, reduction])[-self.lookahead:]
+
+        released, self._release_state = release_envelope(
+            held[:, np.newaxis], self.release_coef, self._release_state
+        )
+        released = released[:, 0]
+
+        # Moving average over lookahead + 1 frames (linear attack ramp)
+        extended = np.concatenate([self._smooth_history, released])
+        totals = np.concatenate([[0.0], np.cumsum(extended)])
+        smoothed = (totals[self.lookahead + 1:] - totals[:-self.lookahead - 1]) / (self.lookahead + 1)
+        self._smooth_history = extended[-self.lookahead:]
+
+        return np.power(10.0, -smoothed / 20.0)
+
+    def _process_block(self, block):
+        gain = self.gain_curve(block)
+
+        delayed = np.concatenate([self._delay_line, block])
+        self._delay_line = delayed[len(block):].copy()
+
+        block[...] = delayed[:len(block)] * gain[:, np.newaxis]
+        # Guard against the residual error of the interpolator
+        np.clip(block, -self.ceiling, self.ceiling, out=block)
+        return block
+
+    def process(self, samples):
+        """
+        Limit samples in place
+
+        The output is delayed by self.latency frames; call flush at the end
+        of the stream to get the remaining frames.
+        """
+        for start in range(0, len(samples), self.block_size):
+            self._process_block(samples[start:start + self.block_size])
+        return samples
+
+    def flush(self, following=None):
+        """
+        Return the last latency frames of the output
+
+        Args:
+            following: Input frames that come after the processed ones, if
+                any (at most latency frames); silence is used otherwise
+        """
+        tail = np.zeros((self.latency, self.channels), dtype=np.float32)
+        if following is not None:
+            tail[:len(following)] = following[:self.latency]
+        return self._process_block(tail)
+
+    def process_aligned(self, samples, following=None):
+        """
+        Limit samples in place with the latency compensated
+
+        The output stays aligned with the input. `following` is passed to
+        flush, which lets a segment of a longer track be limited exactly
+        as it would be in the middle of the stream.
+        """
+        frames = len(samples)
+        latency = self.latency
+        self.process(samples)
+        tail = self.flush(following)
+
+        if frames <= latency:
+            samples[...] = tail[latency - frames:]
+            return samples
+
+        # Shift the output back by the latency, one block at a time
+        for start in range(0, frames - latency, self.block_size):
+            stop = min(start + self.block_size, frames - latency)
+            samples[start:stop] = samples[start + latency:stop + latency]
+        samples[frames - latency:] = tail
+        return samples
+
+
+def limit(samples, sample_rate, ceiling_db, lookahead_ms=5.0, release_ms=50.0):
+    """
+    Limit a whole frames x channels float array in place
+
+    The limiter's latency is compensated, so the output stays aligned with
+    the input.
+    """
+    limiter = Limiter(ceiling_db, sample_rate, channels=samples.shape[1],
+                      lookahead_ms=lookahead_ms, release_ms=release_ms)
+    return limiter.process_aligned(samples)
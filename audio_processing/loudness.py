@@ -0,0 +1,229 @@
+"""
+EBU R128 / ITU-R BS.1770-4 loudness measurement
+
+The signal is K-weighted (a high shelf and a high-pass, as one second-order
+section cascade run with sosfilt) and reduced to the mean square of every
+channel over consecutive 100 ms steps. All the loudness figures are
+computed from those steps at the end:
+
+- momentary loudness: 400 ms windows (4 steps), 100 ms apart
+- short-term loudness: 3 s windows (30 steps), 100 ms apart
+- integrated loudness: momentary blocks gated at -70 LUFS, then at
+  10 LU under the loudness of the blocks left (BS.1770-4)
+- loudness range: spread between the 10th and 95th percentiles of the
+  short-term values gated at -70 LUFS and 20 LU under their mean
+  (EBU Tech 3342)
+- true peak: 4x oversampled peak (see dynamics.TruePeakDetector)
+
+Only the per-step energies are kept, ten values per channel and second, so
+the meter runs in one pass over a stream of blocks in bounded memory.
+"""
+import numpy as np
+from scipy.signal import sosfilt
+
+from audio_processing.dynamics import BLOCK_SIZE, TruePeakDetector
+
+STEP_SECONDS = 0.1
+MOMENTARY_STEPS = 4
+SHORT_TERM_STEPS = 30
+
+ABSOLUTE_GATE_LUFS = -70.0
+RELATIVE_GATE_LU = -10.0
+LRA_RELATIVE_GATE_LU = -20.0
+
+# BS.1770-4 K-weighting filter parameters (pre-filter shelf and RLB high-pass)
+SHELF_GAIN_DB = 3.999843853973347
+SHELF_Q = 0.7071752369554196
+SHELF_FREQUENCY = 1681.974450955533
+HIGHPASS_Q = 0.5003270373238773
+HIGHPASS_FREQUENCY = 38.13547087602444
+
+
+def k_weighting_sos(sample_rate):
+    """
+    Second-order sections of the K-weighting filter at a sample rate
+
+    Bilinear designs with the analog prototypes of BS.1770 (as derived in
+    libebur128), which reproduce the published 48 kHz coefficients and
+    extend them to any rate.
+    """
+    # High shelf
+    K = np.tan(np.pi * SHELF_FREQUENCY / sample_rate)
+    Vh = 10 ** (SHELF_GAIN_DB / 20.0)
+    Vb = Vh ** 0.4996667741545416
+    a0 = 1.0 + K / SHELF_Q + K * K
+    shelf = [
+        (Vh + Vb * K / SHELF_Q + K * K) / a0,
+        2.0 * (K * K - Vh) / a0,
+        (Vh - Vb * K / SHELF_Q + K * K) / a0,
+        1.0,
+        2.0 * (K * K - 1.0) / a0,
+        (1.0 - K / SHELF_Q + K * K) / a0,
+    ]
+
+    # High-pass with the unity [1, -2, 1] numerator of the standard
+    K = np.tan(np.pi * HIGHPASS_FREQUENCY / sample_rate)
+    a0 = 1.0 + K / HIGHPASS_Q + K * K
+    highpass = [1.0, -2.0, 1.0, 1.0, 2.0 * (K * K - 1.0) / a0, (1.0 - K / HIGHPASS_Q + K * K) / a0]
+
+    return np.array([shelf, highpass], dtype=np.float64)
+
+
+def channel_weights(channels):
+    """BS.1770 channel weights (surround channels of 5.1 count 1.41)"""
+    weights = np.ones(channels)
+    if channels == 6:
+        weights[4:] = 1.41
+    return weights
+
+
+def _to_lufs(power):
+    with np.errstate(divide='ignore'):
+        return -0.691 + 10 * np.log10(power)
+
+
+def _window_power(steps, weights, length):
+    """Weighted mean-square power of every window of `length` steps, 1 step apart"""
+    if len(steps) < length:
+        return np.empty(0)
+    cumulative = np.concatenate([np.zeros((1, steps.shape[1])), np.cumsum(steps, axis=0)])
+    means = (cumulative[length:] - cumulative[:-length]) / length
+    return means @ weights
+
+
+def _none_if_infinite(value):
+    return float(value) if np.isfinite(value) else None
+
+
+class LoudnessMeter:
+    """
+    One-pass loudness meter usable as a processing stage
+
+    process() measures a frames x channels block and returns it untouched,
+    so the meter can sit anywhere in a stage list; result() returns the
+    figures of everything measured since the last reset().
+    """
+
+    def __init__(self, sample_rate, channels=2, true_peak=True, block_size=BLOCK_SIZE):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.block_size = block_size
+        self.step_frames = int(round(STEP_SECONDS * sample_rate))
+        self.sos = k_weighting_sos(sample_rate)
+        self.weights = channel_weights(channels)
+        self._true_peak = TruePeakDetector(channels) if true_peak else None
+        self.reset()
+
+    def reset(self):
+        self._zi = np.zeros((self.channels, len(self.sos), 2))
+        self._steps = []
+        self._partial = np.zeros(self.channels)
+        self._partial_frames = 0
+        self._peak = 0.0
+        if self._true_peak is not None:
+            self._true_peak.reset()
+
+    def _add_squares(self, squares):
+        """Fold K-weighted squares into 100 ms step energies"""
+        offset = 0
+        if self._partial_frames:
+            offset = min(self.step_frames - self._partial_frames, len(squares))
+            self._partial += squares[:offset].sum(axis=0)
+            self._partial_frames += offset
+            if self._partial_frames == self.step_frames:
+                self._steps.append(self._partial[np.newaxis] / self.step_frames)
+                self._partial = np.zeros(self.channels)
+                self._partial_frames = 0
+
+        whole = (len(squares) - offset) // self.step_frames
+        if whole:
+            end = offset + whole * self.step_frames
+            steps = squares[offset:end].reshape(whole, self.step_frames, self.channels)
+            self._steps.append(steps.mean(axis=1))
+            offset = end
+
+        if offset < len(squares):
+            self._partial += squares[offset:].sum(axis=0)
+            self._partial_frames += len(squares) - offset
+
+    def process(self, samples):
+        for start in range(0, len(samples), self.block_size):
+            block = samples[start:start + self.block_size]
+            squares = np.empty(block.shape)
+            for channel in range(self.channels):
+                filtered, self._zi[channel] = sosfilt(
+                    self.sos, block[:, channel].astype(np.float64), zi=self._zi[channel]
+                )
+                np.square(filtered, out=squares[:, channel])
+            self._add_squares(squares)
+
+            if self._true_peak is not None:
+                self._peak = max(self._peak, float(np.max(self._true_peak.process(block))))
+        return samples
+
+    def _step_energies(self):
+        if not self._steps:
+            return np.empty((0, self.channels))
+        return np.concatenate(self._steps)
+
+    def momentary(self):
+        """Momentary loudness (LUFS) every 100 ms"""
+        return _to_lufs(_window_power(self._step_energies(), self.weights, MOMENTARY_STEPS))
+
+    def short_term(self):
+        """Short-term loudness (LUFS) every 100 ms"""
+        return _to_lufs(_window_power(self._step_energies(), self.weights, SHORT_TERM_STEPS))
+
+    def integrated(self):
+        """Gated integrated loudness in LUFS (-inf when everything is gated)"""
+        power = _window_power(self._step_energies(), self.weights, MOMENTARY_STEPS)
+        power = power[_to_lufs(power) > ABSOLUTE_GATE_LUFS]
+        if len(power) == 0:
+            return -np.inf
+        relative_gate = _to_lufs(power.mean()) + RELATIVE_GATE_LU
+        power = power[_to_lufs(power) > relative_gate]
+        return float(_to_lufs(power.mean()))
+
+    def loudness_range(self):
+        """Loudness range (LU) of the short-term values"""
+        power = _window_power(self._step_energies(), self.weights, SHORT_TERM_STEPS)
+        power = power[_to_lufs(power) > ABSOLUTE_GATE_LUFS]
+        if len(power) == 0:
+            return 0.0
+        relative_gate = _to_lufs(power.mean()) + LRA_RELATIVE_GATE_LU
+        loudness = _to_lufs(power[_to_lufs(power) > relative_gate])
+        low, high = np.percentile(loudness, [10, 95])
+        return float(high - low)
+
+    def true_peak(self):
+        """Highest true peak in dBTP (-inf for silence); reading it does not change the meter"""
+        peak = self._peak
+        if self._true_peak is not None:
+            # Frames still held back by the interpolator
+            peak = max(peak, float(np.max(self._true_peak.tail())))
+        with np.errstate(divide='ignore'):
+            return float(20 * np.log10(peak))
+
+    def result(self):
+        """
+        Returns:
+            loudness: Dictionary with integrated_lufs, loudness_range,
+                true_peak_db, max_momentary_lufs and max_short_term_lufs;
+                values that cannot be measured (silence, too short) are None
+        """
+        momentary = self.momentary()
+        short_term = self.short_term()
+        return {
+            'integrated_lufs': _none_if_infinite(self.integrated()),
+            'loudness_range': self.loudness_range(),
+            'true_peak_db': _none_if_infinite(self.true_peak()) if self._true_peak is not None else None,
+            'max_momentary_lufs': _none_if_infinite(momentary.max()) if len(momentary) else None,
+            'max_short_term_lufs': _none_if_infinite(short_term.max()) if len(short_term) else None,
+        }
+
+
+def measure_loudness(samples, sample_rate, true_peak=True):
+    """Loudness figures of a whole frames x channels float buffer"""
+    meter = LoudnessMeter(sample_rate, channels=samples.shape[1], true_peak=true_peak)
+    meter.process(samples)
+    return meter.result()
@@ -0,0 +1,191 @@
+"""
+Multi-core execution of the processing stages
+
+The float32 buffer is moved into a shared memory block that worker
+processes map directly, so no PCM is pickled. Work is split where it is
+independent:
+
+- EQ runs one channel per worker (exact).
+- Stereo width runs on frame segments (exact, the stage is memoryless).
+- Compression and limiting run on frame segments. Each segment first runs
+  the stage over a warm-up excerpt taken just before it, long enough for
+  the envelope state to converge to what the serial path would have; the
+  limiter also receives the frames that follow its segment for its
+  lookahead. The result matches the serial path within float rounding.
+
+The warm-up and lookahead excerpts are copied by the parent before any
+worker starts, so a segment never reads frames that another worker is
+already overwriting.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import shared_memory, util
+
+import numpy as np
+
+from audio_processing.dynamics import Compressor, Limiter
+from audio_processing.eq import Equalizer
+from audio_processing.stereo import StereoWidth
+
+# Warm-up length, in time constants of the slowest envelope
+WARMUP_TIME_CONSTANTS = 20
+
+# Segments shorter than this are not worth a round-trip to a worker
+MIN_SEGMENT_FRAMES = 1 << 17
+
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def get_executor(workers):
+    """Process pool shared by every job of this process"""
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers < workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context('spawn')
+            )
+            _executor_workers = workers
+            # A multiprocessing finalizer rather than atexit: when this runs
+            # inside a job worker, atexit hooks are skipped and the exiting
+            # worker would wait forever on the idle pool processes. It must
+            # run before the finalizers of the pool's own queues (priority 10)
+            util.Finalize(_executor, _executor.shutdown, exitpriority=20)
+        return _executor
+
+
+def _attach(name, shape):
+    """Map a shared buffer created by the parent process"""
+    # Pool workers share the parent's resource tracker, which unlinks the
+    # block only if the parent dies without cleaning up
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=np.float32, buffer=block.buf)
+
+
+def _run_on_view(name, shape, stage, start, stop, channel=None, warmup=None, following=None):
+    """Worker entry point: run a stage in place on part of the shared buffer"""
+    block, samples = _attach(name, shape)
+    view = samples[start:stop]
+    if channel is not None:
+        view = view[:, channel:channel + 1]
+
+    try:
+        if warmup is not None and len(warmup):
+            stage.process(warmup)
+
+        if isinstance(stage, Limiter):
+            stage.process_aligned(view, following)
+        else:
+            stage.process(view)
+    finally:
+        # Views must be released before the mapping can be closed
+        del samples, view
+        block.close()
+
+
+def split_frames(frames, workers, min_frames=MIN_SEGMENT_FRAMES):
+    """(start, stop) of up to `workers` contiguous segments"""
+    count = max(1, min(workers, frames // max(1, min_frames)))
+    bounds = np.linspace(0, frames, count + 1).astype(int)
+    return [(int(bounds[i]), int(bounds[i + 1])) for i in range(count)]
+
+
+class ParallelStages:
+    """
+    Stage runner bound to a buffer living in shared memory
+
+    Created by shared_stages; every method blocks until all workers are done.
+    """
+
+    def __init__(self, buffer, shared, executor, workers):
+        self.buffer = buffer
+        self.shared = shared
+        self.executor = executor
+        self.workers = workers
+
+    def _submit_all(self, tasks):
+        futures = [self.executor.submit(_run_on_view, self.shared.name, self.buffer.samples.shape, *task[0], **task[1])
+                   for task in tasks]
+        for future in futures:
+            future.result()
+
+    def _segment_tasks(self, make_stage, warmup_frames, lookahead_frames=0):
+        samples = self.buffer.samples
+        tasks = []
+        for start, stop in split_frames(len(samples), self.workers):
+            warmup = samples[max(0, start - warmup_frames):start].copy()
+            following = samples[stop:stop + lookahead_frames].copy() if lookahead_frames else None
+            tasks.append(((make_stage(), start, stop), {'warmup': warmup, 'following': following}))
+        return tasks
+
+    def _warmup_frames(self, *times_ms):
+        return int(WARMUP_TIME_CONSTANTS * max(times_ms) * self.buffer.sample_rate / 1000.0)
+
+    def compress(self, threshold_db, ratio, attack_ms, release_ms, stereo_link=True):
+        channels = self.buffer.channels
+        sample_rate = self.buffer.sample_rate
+        self._submit_all(self._segment_tasks(
+            lambda: Compressor(threshold_db, ratio, attack_ms, release_ms, sample_rate,
+                               channels=channels, stereo_link=stereo_link),
+            self._warmup_frames(attack_ms, release_ms),
+        ))
+
+    def equalize(self, sos):
+        if len(sos) == 0:
+            return
+        frames = self.buffer.frames
+        self._submit_all([
+            ((Equalizer(sos, channels=1), 0, frames), {'channel': channel})
+            for channel in range(self.buffer.channels)
+        ])
+
+    def stereo_width(self, width):
+        stage = StereoWidth(width)
+        if stage.is_identity or self.buffer.channels != 2:
+            return
+        self._submit_all([
+            ((stage, start, stop), {}) for start, stop in split_frames(self.buffer.frames, self.workers)
+        ])
+
+    def limit(self, ceiling_db):
+        sample_rate = self.buffer.sample_rate
+        channels = self.buffer.channels
+        probe = Limiter(ceiling_db, sample_rate, channels=channels)
+        # Release convergence plus the hold and smoothing windows
+        warmup = self._warmup_frames(probe.release_ms) + 2 * probe.latency
+        self._submit_all(self._segment_tasks(
+            lambda: Limiter(ceiling_db, sample_rate, channels=channels),
+            warmup, lookahead_frames=probe.latency,
+        ))
+
+
+@contextmanager
+def shared_stages(buffer, workers):
+    """
+    Run stages of process_audio on several cores
+
+    Moves the buffer's samples into shared memory for the duration of the
+    block and yields a ParallelStages, or None when workers <= 1. The
+    samples are moved back to ordinary memory on exit.
+    """
+    if not workers or workers <= 1 or buffer.frames == 0:
+        yield None
+        return
+
+    shared = shared_memory.SharedMemory(create=True, size=buffer.samples.nbytes)
+    original = buffer.samples
+    try:
+        buffer.samples = np.ndarray(original.shape, dtype=np.float32, buffer=shared.buf)
+        buffer.samples[...] = original
+        del original
+        yield ParallelStages(buffer, shared, get_executor(workers), workers)
+    finally:
+        # Views must be released before the mapping can be closed
+        buffer.samples = np.array(buffer.samples)
+        shared.close()
+        shared.unlink()
@@ -0,0 +1,209 @@
+"""
+Multi-resolution waveform peak files
+
+Peaks are computed once, while a track is processed, and stored next to the
+output as a small binary file (in the spirit of audiowaveform's .dat
+files). The file holds several zoom levels; level 0 has one min/max pair
+per BASE_SAMPLES_PER_PIXEL frames and each following level halves the
+resolution. A waveform of any size is served from the coarsest level that
+still has enough points, without decoding the audio.
+
+Layout (little-endian):
+
+    header  '<4sHHIQH'  magic, version, bits (16), sample rate, frames, level count
+    levels  '<II'       samples per pixel, length          (once per level)
+    data    int16       length x 2 (min, max) per level, in level order
+
+Values are the mono mix (mean of the channels) scaled to int16.
+"""
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+from audio_processing.decoder import open_reader
+
+PEAKS_SUFFIX = '.peaks'
+PEAKS_MAGIC = b'MPKS'
+PEAKS_VERSION = 1
+
+# Frames per min/max pair of the finest level
+BASE_SAMPLES_PER_PIXEL = 256
+
+# Coarser levels are added until a level is shorter than this
+MIN_LEVEL_LENGTH = 64
+
+_HEADER = struct.Struct('<4sHHIQH')
+_LEVEL = struct.Struct('<II')
+_SCALE = 32767.0
+
+
+def peaks_path_for(audio_path):
+    """Path of the peak file stored alongside an audio file"""
+    return audio_path + PEAKS_SUFFIX
+
+
+def _downsample(level):
+    """Halve the resolution of a (length, 2) min/max level"""
+    starts = np.arange(0, len(level), 2)
+    return np.stack([
+        np.minimum.reduceat(level[:, 0], starts),
+        np.maximum.reduceat(level[:, 1], starts),
+    ], axis=1)
+
+
+class Peaks:
+    """
+    Min/max peaks of a track at several resolutions
+
+    Attributes:
+        sample_rate: Sample rate of the track
+        frames: Length of the track in frames
+        levels: List of (samples_per_pixel, int16 array shaped length x 2)
+    """
+
+    def __init__(self, sample_rate, frames, levels):
+        self.sample_rate = int(sample_rate)
+        self.frames = int(frames)
+        self.levels = levels
+
+    def level_for(self, num_points):
+        """Coarsest level with at least num_points pairs (the finest if none has)"""
+        for samples_per_pixel, data in reversed(self.levels):
+            if len(data) >= num_points:
+                return samples_per_pixel, data
+        return self.levels[0]
+
+    def waveform(self, num_points=1000):
+        """
+        Absolute peak per point, in the 0-1 range
+
+        Args:
+            num_points: Number of points wanted; fewer are returned when the
+                track is shorter than num_points pairs of the finest level
+
+        Returns:
+            waveform: List of floats
+        """
+        _, data = self.level_for(num_points)
+        if len(data) == 0:
+            return []
+        magnitude = np.maximum(-data[:, 0].astype(np.int32), data[:, 1])
+        if len(data) > num_points:
+            edges = np.linspace(0, len(data), num_points + 1).astype(np.int64)[:-1]
+            magnitude = np.maximum.reduceat(magnitude, edges)
+        return (magnitude / _SCALE).tolist()
+
+    def save(self, path):
+        """Write the peak file atomically"""
+        directory = os.path.dirname(path) or '.'
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(_HEADER.pack(PEAKS_MAGIC, PEAKS_VERSION, 16, self.sample_rate,
+                                     self.frames, len(self.levels)))
+                for samples_per_pixel, data in self.levels:
+                    f.write(_LEVEL.pack(samples_per_pixel, len(data)))
+                for _, data in self.levels:
+                    f.write(np.ascontiguousarray(data, dtype='<i2').tobytes())
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return path
+
+    @classmethod
+    def load(cls, path):
+        """Map a peak file; level data is only read from disk when used"""
+        with open(path, 'rb') as f:
+            magic, version, bits, sample_rate, frames, count = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != PEAKS_MAGIC or version != PEAKS_VERSION or bits != 16:
+                raise ValueError(f"Unsupported peak file: {path}")
+            layout = [_LEVEL.unpack(f.read(_LEVEL.size)) for _ in range(count)]
+
+        offset = _HEADER.size + count * _LEVEL.size
+        levels = []
+        for samples_per_pixel, length in layout:
+            if length:
+                data = np.memmap(path, dtype='<i2', mode='r', offset=offset, shape=(length, 2))
+            else:
+                data = np.empty((0, 2), dtype='<i2')
+            levels.append((samples_per_pixel, data))
+            offset += length * 4
+        return cls(sample_rate, frames, levels)
+
+
+class PeakBuilder:
+    """
+    Accumulates the peaks of a track fed block by block
+
+    Blocks are frames x channels float arrays in [-1.0, 1.0]; their size
+    does not need to be a multiple of the bucket size.
+    """
+
+    def __init__(self, sample_rate, samples_per_pixel=BASE_SAMPLES_PER_PIXEL):
+        self.sample_rate = sample_rate
+        self.samples_per_pixel = samples_per_pixel
+        self.frames = 0
+        self._chunks = []
+        self._pending = np.empty(0, dtype=np.float32)
+
+    def _add_buckets(self, mono):
+        buckets = mono.reshape(-1, self.samples_per_pixel)
+        self._chunks.append(np.stack([buckets.min(axis=1), buckets.max(axis=1)], axis=1))
+
+    def add(self, block):
+        if len(block) == 0:
+            return
+        self.frames += len(block)
+        mono = block.mean(axis=1, dtype=np.float32) if block.shape[1] > 1 else block[:, 0]
+        if len(self._pending):
+            mono = np.concatenate([self._pending, mono])
+
+        whole = len(mono) - len(mono) % self.samples_per_pixel
+        if whole:
+            self._add_buckets(mono[:whole])
+        self._pending = np.array(mono[whole:], dtype=np.float32)
+
+    def finish(self):
+        """Peaks of everything added so far"""
+        chunks = list(self._chunks)
+        if len(self._pending):
+            chunks.append(np.array([[self._pending.min(), self._pending.max()]], dtype=np.float32))
+        base = np.concatenate(chunks) if chunks else np.empty((0, 2), dtype=np.float32)
+        base = np.clip(np.rint(base * _SCALE), -_SCALE, _SCALE).astype(np.int16)
+
+        levels = [(self.samples_per_pixel, base)]
+        while len(levels[-1][1]) >= 2 * MIN_LEVEL_LENGTH:
+            samples_per_pixel, data = levels[-1]
+            levels.append((samples_per_pixel * 2, _downsample(data)))
+        return Peaks(self.sample_rate, self.frames, levels)
+
+
+def compute_peaks(samples, sample_rate):
+    """Peaks of a whole frames x channels float buffer"""
+    builder = PeakBuilder(sample_rate)
+    builder.add(samples)
+    return builder.finish()
+
+
+def load_peaks(audio_path):
+    """
+    Peaks of an audio file, from its peak file
+
+    Files processed before peak files existed are read once, block by
+    block, and their peak file is written for the next request.
+    """
+    path = peaks_path_for(audio_path)
+    if os.path.exists(path):
+        return Peaks.load(path)
+
+    with open_reader(audio_path) as reader:
+        builder = PeakBuilder(reader.sample_rate)
+        for block in reader:
+            builder.add(block)
+    peaks = builder.finish()
+    peaks.save(path)
+    return peaks
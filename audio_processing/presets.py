@@ -1,6 +1,9 @@
+import logging
 import random
-import numpy as np
-from pydub import AudioSegment
+from audio_processing.analysis import analyze_file, load_analysis, save_analysis, suggest_preset
+from audio_processing.chain import compile_preset, preset_chain
+
+logger = logging.getLogger(__name__)
 
 # Preset definitions for audio mastering
 PRESETS = {
@@ -148,6 +151,28 @@ PRESETS = {
     }
 }
 
+# Formats whose chains are built when the module is imported
+CHAIN_SAMPLE_RATES = (44100, 48000)
+CHAIN_CHANNELS = (1, 2)
+
+def compile_presets():
+    """
+    Validate every preset and build its chains for the common formats
+    
+    Called at import, so bad preset data stops the application (and the
+    job workers) at startup rather than failing a job.
+    
+    Raises:
+        PresetError: if a preset is invalid
+    """
+    for preset in PRESETS.values():
+        compiled = compile_preset(preset)
+        for sample_rate in CHAIN_SAMPLE_RATES:
+            for channels in CHAIN_CHANNELS:
+                preset_chain(compiled, sample_rate, channels)
+
+compile_presets()
+
 def get_preset_by_name(name):
     """Get a preset by its name"""
     return PRESETS.get(name.lower())
@@ -156,7 +181,7 @@ def get_all_presets():
     """Get all available presets"""
     return PRESETS
 
-def analyze_and_suggest_preset(file_path):
+def analyze_and_suggest_preset(file_path, analysis_path=None):
     """
     Analyze audio file and suggest an appropriate preset
     
@@ -164,57 +189,20 @@ def analyze_and_suggest_preset(file_path):
     - Bass presence (suggests trap or warm)
     - Treble presence (suggests clean or bright)
     - Dynamics (suggests lofi if compressed)
+    
+    The analysis itself (see audio_processing.analysis) streams the file
+    through a windowed STFT. When analysis_path is given, a stored analysis
+    is reused and a new one is saved there.
     """
     try:
-        # Load the audio file
-        if file_path.lower().endswith('.mp3'):
-            audio = AudioSegment.from_mp3(file_path)
-        else:  # Assume WAV
-            audio = AudioSegment.from_wav(file_path)
-        
-        # Get audio samples as numpy array
-        samples = np.array(audio.get_array_of_samples())
-        
-        # If stereo, convert to mono for analysis
-        if audio.channels == 2:
-            samples = samples.reshape(-1, 2)
-            samples = samples.mean(axis=1)
-        
-        # Normalize samples for analysis
-        samples = samples / np.max(np.abs(samples))
-        
-        # Split audio into frequency bands using simple FFT
-        fft = np.abs(np.fft.rfft(samples))
-        freq = np.fft.rfftfreq(len(samples), 1.0/audio.frame_rate)
-        
-        # Determine band energy
-        bass_mask = (freq < 250)
-        mid_mask = (freq >= 250) & (freq < 2000)
-        high_mask = (freq >= 2000)
-        
-        bass_energy = np.sum(fft[bass_mask])
-        mid_energy = np.sum(fft[mid_mask])
-        high_energy = np.sum(fft[high_mask])
-        
-        # Calculate dynamics (simplified)
-        rms = np.sqrt(np.mean(samples**2))
-        peak = np.max(np.abs(samples))
-        crest_factor = peak / rms if rms > 0 else 1.0
-        
-        # Determine preset based on analysis
-        if crest_factor < 3.0:  # Already compressed, likely lofi or trap
-            if bass_energy > high_energy:
-                return 'trap'
-            else:
-                return 'lofi'
-        elif bass_energy > mid_energy and bass_energy > high_energy:  # Bass-heavy
-            return 'warm'
-        elif high_energy > bass_energy:  # Bright/detailed
-            return 'bright'
-        else:  # Balanced
-            return 'clean'
+        analysis = load_analysis(analysis_path) if analysis_path else None
+        if analysis is None:
+            analysis = analyze_file(file_path)
+            if analysis_path:
+                save_analysis(analysis_path, analysis)
+        return suggest_preset(analysis)
             
     except Exception as e:
-        print(f"Error analyzing audio: {e}")
+        logger.warning("Could not analyze %s: %s", file_path, e)
         # Default to clean preset if analysis fails
         return 'clean'
@@ -0,0 +1,140 @@
+"""
+Low-latency previews of a preset on a short excerpt
+
+Only the requested window is decoded (ffmpeg seeks in the input, WAV
+inputs are sliced from their memory mapping), plus a
+warm-up excerpt just before it so the compressor envelope and the EQ
+filters are in the state they would have at that point of a full render,
+and a few frames after it for the limiter lookahead. The window is
+rendered with the same stages as the streaming mode and encoded to a
+low-bitrate mp3.
+
+Normalization gains depend on the whole track. For presets that normalize
+(to a peak or a loudness target), its peak and integrated loudness are
+measured once, in a decode-only pass, and can be stored per input
+(levels_path) so later previews of the same file skip that pass. Other
+presets never decode more than the excerpt.
+A loudness target's pre-limiter trim is measured on the excerpt.
+"""
+import os
+
+import numpy as np
+
+from audio_processing.analysis import load_analysis, save_analysis
+from audio_processing.chain import compile_preset
+from audio_processing.decoder import open_reader
+from audio_processing.loudness import measure_loudness
+from audio_processing.parallel import WARMUP_TIME_CONSTANTS
+from audio_processing.streaming import FFmpegWriter, build_stages, measure_input
+
+PREVIEW_FORMAT = 'mp3'
+PREVIEW_BITRATE = '96k'
+
+# Default and longest excerpt, in seconds
+PREVIEW_SECONDS = 15.0
+MAX_PREVIEW_SECONDS = 30.0
+
+# Shortest warm-up, enough for the EQ filters to settle
+MIN_WARMUP_SECONDS = 0.5
+
+# Decoded after the window, more than any limiter latency
+TAIL_SECONDS = 0.05
+
+
+def warmup_seconds(preset):
+    """Audio decoded before the window so the stages reach their steady state"""
+    warmup = MIN_WARMUP_SECONDS
+    compressor = compile_preset(preset).compressor
+    if compressor:
+        slowest_ms = max(compressor.attack_ms, compressor.release_ms)
+        warmup = max(warmup, WARMUP_TIME_CONSTANTS * slowest_ms / 1000.0)
+    return warmup
+
+
+def input_levels(input_path, levels_path=None):
+    """
+    Whole-track peak and integrated loudness used by normalization
+
+    Returns:
+        levels: Dictionary with peak and integrated_lufs (None for silence),
+            read from levels_path when stored there
+    """
+    levels = load_analysis(levels_path) if levels_path else None
+    if levels is None:
+        peak, _, integrated_lufs = measure_input(input_path, loudness=True)
+        levels = {
+            'peak': peak,
+            'integrated_lufs': integrated_lufs if np.isfinite(integrated_lufs) else None,
+        }
+        if levels_path:
+            save_analysis(levels_path, levels)
+    return levels
+
+
+def render_preview(input_path, output_path, preset, start=0.0, duration=PREVIEW_SECONDS,
+                   levels_path=None, bitrate=PREVIEW_BITRATE):
+    """
+    Master an excerpt of a file
+
+    Args:
+        input_path: Path to the input audio file
+        output_path: Path to save the preview clip
+        preset: Dictionary containing processing parameters
+        start: Start of the excerpt in seconds
+        duration: Length of the excerpt in seconds
+        levels_path: Where the input's levels are stored (see input_levels),
+            when the preset normalizes
+        bitrate: Bitrate of the preview clip
+
+    Returns:
+        (duration, loudness): Duration of the clip in seconds and its
+            loudness (see audio_processing.loudness)
+
+    Raises:
+        ValueError: if the excerpt starts after the end of the track
+    """
+    settings = compile_preset(preset)
+    if settings.normalize or settings.target_lufs is not None:
+        levels = input_levels(input_path, levels_path)
+    else:
+        levels = {'peak': None, 'integrated_lufs': None}
+    warmup = min(start, warmup_seconds(preset))
+
+    with open_reader(input_path, start=start - warmup,
+                     duration=warmup + duration + TAIL_SECONDS) as reader:
+        sample_rate, channels = reader.sample_rate, reader.channels
+        blocks = [block.copy() for block in reader]
+    samples = np.concatenate(blocks) if blocks else np.empty((0, channels), dtype=np.float32)
+
+    skip = int(round(warmup * sample_rate))
+    frames = min(int(round(duration * sample_rate)), len(samples) - skip)
+    if frames <= 0:
+        raise ValueError("The preview starts after the end of the track")
+
+    target_lufs = settings.target_lufs
+    trim_db = 0.0
+    if target_lufs is not None and levels['integrated_lufs'] is not None:
+        stages, limiter = build_stages(preset, sample_rate, channels, levels['peak'],
+                                       levels['integrated_lufs'])
+        chain = samples.copy()
+        for stage in stages:
+            if stage is not limiter:
+                stage.process(chain)
+        chain_lufs = measure_loudness(chain, sample_rate, true_peak=False)['integrated_lufs']
+        if chain_lufs is not None:
+            trim_db = target_lufs - chain_lufs
+
+    stages, limiter = build_stages(preset, sample_rate, channels, levels['peak'],
+                                   levels['integrated_lufs'], trim_db)
+    for stage in stages:
+        if stage is limiter:
+            limiter.process_aligned(samples)
+        else:
+            stage.process(samples)
+
+    clip = samples[skip:skip + frames]
+    export_format = os.path.splitext(output_path)[1].lstrip('.').lower() or PREVIEW_FORMAT
+    with FFmpegWriter(output_path, sample_rate, channels, export_format, bitrate,
+                      {"album": "Masterify", "artist": "Masterify Audio"}) as writer:
+        writer.write(clip)
+    return frames / float(sample_rate), measure_loudness(clip, sample_rate)
@@ -1,207 +1,303 @@
 import os
 import numpy as np
-from pydub import AudioSegment
-from pydub.effects import normalize
-from audio_processing.presets import get_preset_by_name
+from audio_processing.buffer import AudioBuffer
+from audio_processing.chain import compile_preset, preset_chain
+from audio_processing.dynamics import compress, limit
+from audio_processing.eq import Equalizer, compile_eq
+from audio_processing.metrics import NO_METRICS
+from audio_processing.stereo import StereoWidth
+from audio_processing.parallel import shared_stages
+from audio_processing.peaks import compute_peaks, load_peaks
+from audio_processing.analysis import analyze_buffer, save_analysis
+from audio_processing.loudness import measure_loudness
+from audio_processing.streaming import MultiWriter, export_outputs, process_audio_streaming
+from audio_processing.preview import render_preview
 
-def process_audio(input_path, output_path, preset):
+# Inputs larger than this are processed in streaming mode by default
+STREAMING_THRESHOLD_BYTES = 50 * 1024 * 1024
+
+def process_audio(input_path, output_path, preset, streaming=None, progress=None, workers=1,
+                  peaks_path=None, analysis_path=None, exports=None, excerpt=None, levels_path=None,
+                  metrics=None):
     """
     Process audio file with the specified preset
     
+    The file is decoded once into a float32 AudioBuffer, every stage works
+    on that buffer in place, and it is converted back to integer PCM only
+    for the final export.
+    
     Args:
         input_path: Path to the input audio file
         output_path: Path to save the processed audio file
         preset: Dictionary containing processing parameters
+        streaming: Process the file block by block with bounded memory
+            (see audio_processing.streaming); None picks streaming for
+            inputs larger than STREAMING_THRESHOLD_BYTES
+        progress: Optional callable receiving the completed fraction (0.0 to 1.0)
+        workers: Number of processes the in-memory stages are split across
+            (see audio_processing.parallel); 1 runs everything in this process
+        peaks_path: Where to write the waveform peak file of the output
+            (see audio_processing.peaks), if given
+        analysis_path: Where to store the analysis of the input (see
+            audio_processing.analysis), if given and not stored yet
+        exports: Extra outputs encoded from the same render, as dictionaries
+            with 'path', 'format' and an optional 'bitrate'
+        excerpt: (start, duration) in seconds to render a low-bitrate
+            preview of that window only (see audio_processing.preview)
+        levels_path: Where the input's whole-track levels are stored for
+            previews, if given
+        metrics: Optional StageMetrics receiving the time, CPU, samples and
+            memory of every stage (see audio_processing.metrics); previews
+            are not instrumented
         
     Returns:
-        duration: Duration of the processed audio in seconds
+        (duration, loudness): Duration of the processed audio in seconds and
+            its loudness figures (see audio_processing.loudness)
     """
-    # Load the audio file
-    if input_path.lower().endswith('.mp3'):
-        audio = AudioSegment.from_mp3(input_path)
-    else:  # Assume WAV
-        audio = AudioSegment.from_wav(input_path)
+    if excerpt is not None:
+        start, duration = excerpt
+        return render_preview(input_path, output_path, preset, start, duration,
+                              levels_path=levels_path)
     
-    # Apply normalization if specified
-    if preset.get('normalize', True):
-        target_dBFS = preset.get('target_dBFS', -1.0)
-        audio = normalize(audio, headroom=target_dBFS)
+    export_format = get_export_format(output_path)
     
-    # Apply gain
-    gain_db = preset.get('gain_db', 0)
-    if gain_db != 0:
-        audio = audio.apply_gain(gain_db)
+    if streaming is None:
+        streaming = os.path.getsize(input_path) > STREAMING_THRESHOLD_BYTES
+    if streaming:
+        return process_audio_streaming(input_path, output_path, preset, export_format,
+                                       progress=progress, peaks_path=peaks_path,
+                                       analysis_path=analysis_path, exports=exports,
+                                       metrics=metrics)
     
-    # Apply compression
-    if preset.get('compression', True):
-        threshold = preset.get('threshold_db', -20)
-        ratio = preset.get('ratio', 4.0)
-        attack = preset.get('attack_ms', 5)
-        release = preset.get('release_ms', 50)
-        
-        audio = apply_compression(audio, threshold, ratio, attack, release)
+    report = progress or (lambda fraction: None)
+    metrics = metrics or NO_METRICS
     
-    # Apply EQ
-    if preset.get('eq', True):
-        eq_bands = preset.get('eq_bands', {})
-        audio = apply_eq(audio, eq_bands)
-        
-    # Apply stereo widening if specified
-    if preset.get('stereo_width', 100) != 100:
-        width = preset.get('stereo_width', 100) / 100.0
-        audio = apply_stereo_width(audio, width)
+    # Decode the audio file once
+    with metrics.stage('decode'):
+        buffer = AudioBuffer.from_file(input_path)
     
-    # Apply limiter
-    if preset.get('limiter', True):
-        ceiling = preset.get('ceiling_db', -0.3)
-        audio = apply_limiter(audio, ceiling)
+    # Analyse the input while it is decoded, for later preset suggestions
+    if analysis_path and not os.path.exists(analysis_path):
+        with metrics.stage('analysis', buffer.samples.size):
+            save_analysis(analysis_path, analyze_buffer(buffer))
+    report(0.2)
     
-    # Export the processed audio
-    export_format = os.path.splitext(output_path)[1].lower().replace('.', '')
-    if not export_format:
-        export_format = 'mp3'
+    return master_buffer(buffer, output_path, preset, progress=report, workers=workers,
+                         peaks_path=peaks_path, exports=exports, metrics=metrics)
+
+def process_audio_multi(input_path, renders, workers=1, analysis_path=None):
+    """
+    Render several presets of one input from a single decode
+    
+    Args:
+        input_path: Path to the input audio file
+        renders: List of dictionaries with output_path and preset, and
+            optionally progress, peaks_path, exports and metrics (as in
+            process_audio); the shared decode is recorded in the metrics of
+            the first render
+        workers: Number of processes the stages are split across
+        analysis_path: Where to store the analysis of the input, if given
+            and not stored yet
         
-    audio.export(
-        output_path,
-        format=export_format,
-        bitrate=preset.get('bitrate', '320k'),
-        tags={"album": "Masterify", "artist": "Masterify Audio"}
-    )
+    Returns:
+        results: One (duration, loudness) tuple per render, or the
+            exception raised by that render
+    """
+    if os.path.getsize(input_path) > STREAMING_THRESHOLD_BYTES:
+        # Too large to keep decoded: every render streams the file itself
+        decoded = None
+    else:
+        metrics = (renders[0].get('metrics') if renders else None) or NO_METRICS
+        with metrics.stage('decode'):
+            decoded = AudioBuffer.from_file(input_path)
+        if analysis_path and not os.path.exists(analysis_path):
+            with metrics.stage('analysis', decoded.samples.size):
+                save_analysis(analysis_path, analyze_buffer(decoded))
     
-    return len(audio) / 1000.0  # Duration in seconds
+    results = []
+    for index, render in enumerate(renders):
+        try:
+            if decoded is None:
+                results.append(process_audio(
+                    input_path, render['output_path'], render['preset'], streaming=True,
+                    progress=render.get('progress'), peaks_path=render.get('peaks_path'),
+                    analysis_path=analysis_path, exports=render.get('exports'),
+                    metrics=render.get('metrics')
+                ))
+                continue
+            # The last render may consume the decoded samples themselves
+            last = index == len(renders) - 1
+            buffer = decoded if last else AudioBuffer(decoded.samples.copy(), decoded.sample_rate)
+            results.append(master_buffer(
+                buffer, render['output_path'], render['preset'], progress=render.get('progress'),
+                workers=workers, peaks_path=render.get('peaks_path'), exports=render.get('exports'),
+                metrics=render.get('metrics')
+            ))
+        except Exception as e:
+            results.append(e)
+    return results
 
-def apply_compression(audio, threshold_db, ratio, attack_ms, release_ms):
-    """Apply dynamic range compression to audio"""
-    # This is a simplified implementation of compression
-    # For production use, more sophisticated algorithms would be used
-    
-    # Get audio samples as numpy array
-    samples = np.array(audio.get_array_of_samples())
-    sample_rate = audio.frame_rate
-    channels = audio.channels
+def master_buffer(buffer, output_path, preset, progress=None, workers=1, peaks_path=None, exports=None,
+                  metrics=None):
+    """
+    Run a preset on a decoded buffer (in place) and export the result
     
-    # Convert to float32 for processing
-    samples = samples.astype(np.float32)
-    if channels == 2:
-        samples = samples.reshape(-1, 2)
+    Returns:
+        (duration, loudness): as process_audio
+    """
+    report = progress or (lambda fraction: None)
+    metrics = metrics or NO_METRICS
+    export_format = get_export_format(output_path)
+    samples = buffer.samples.size
     
-    # Calculate threshold in linear scale
-    threshold = 10 ** (threshold_db / 20.0)
+    # Run the stages, on several cores when workers > 1
+    with shared_stages(buffer, workers) as pool:
+        process_buffer(buffer, preset, progress=report, pool=pool, metrics=metrics)
     
-    # Calculate attack and release rates
-    attack_coef = np.exp(-1.0 / (sample_rate * attack_ms / 1000.0))
-    release_coef = np.exp(-1.0 / (sample_rate * release_ms / 1000.0))
+    # Loudness and waveform peaks, from the final samples while they are at hand
+    with metrics.stage('loudness', samples):
+        loudness = measure_loudness(buffer.samples, buffer.sample_rate)
+    if peaks_path:
+        with metrics.stage('peaks', samples):
+            compute_peaks(buffer.samples, buffer.sample_rate).save(peaks_path)
     
-    # Apply compression
-    for i in range(1, len(samples)):
-        # Detect signal level (simplified)
-        if channels == 2:
-            level = max(abs(samples[i][0]), abs(samples[i][1]))
+    # Export the processed audio
+    tags = {"album": "Masterify", "artist": "Masterify Audio"}
+    with metrics.stage('export', samples):
+        if exports:
+            # One render, one encoder process per format
+            outputs = export_outputs(output_path, export_format, preset, exports)
+            with MultiWriter(outputs, buffer.sample_rate, buffer.channels, tags) as writer:
+                writer.write(buffer.samples)
         else:
-            level = abs(samples[i])
-        
-        # Apply compression if level is above threshold
-        if level > threshold:
-            # Calculate compression gain
-            gain_reduction = (threshold + (level - threshold) / ratio) / level
-            
-            # Apply compression with attack/release
-            if gain_reduction < 1.0:
-                if channels == 2:
-                    samples[i] = samples[i] * gain_reduction
-                else:
-                    samples[i] *= gain_reduction
-    
-    # Convert back to the original format
-    if channels == 2:
-        samples = samples.flatten()
-    
-    samples = samples.astype(np.int16)
-    
-    # Create new audio segment from processed samples
-    processed_audio = audio._spawn(samples)
-    
-    return processed_audio
+            buffer.export(
+                output_path,
+                format=export_format,
+                bitrate=compile_preset(preset).bitrate,
+                tags=tags
+            )
+    report(1.0)
+    
+    return buffer.duration, loudness
 
-def apply_eq(audio, eq_bands):
-    """Apply equalization with specified frequency bands"""
-    # Apply each EQ band
-    for band, gain in eq_bands.items():
-        # Convert band string to frequency (e.g., '100Hz' -> 100)
-        if isinstance(band, str):
-            freq = int(''.join(filter(str.isdigit, band)))
-        else:
-            freq = band
-            
-        # Apply band-specific EQ
-        if gain != 0:
-            audio = audio.low_pass_filter(freq) if gain > 0 else audio.high_pass_filter(freq)
-            audio = audio.apply_gain(gain)
-    
-    return audio
+def get_export_format(output_path):
+    """Export format implied by the output file extension (mp3 by default)"""
+    export_format = os.path.splitext(output_path)[1].lower().replace('.', '')
+    return export_format or 'mp3'
 
-def apply_stereo_width(audio, width):
-    """Apply stereo widening/narrowing effect"""
-    if audio.channels != 2:
-        return audio  # Only applies to stereo audio
+def process_buffer(buffer, preset, progress=None, pool=None, metrics=None):
+    """Run the preset's stages on a decoded buffer, in place"""
+    report = progress or (lambda fraction: None)
+    metrics = metrics or NO_METRICS
+    samples = buffer.samples.size
     
-    # Split into left and right channels
-    left = audio.split_to_mono()[0]
-    right = audio.split_to_mono()[1]
+    # Validated settings and EQ coefficients, cached per preset and format
+    chain = preset_chain(preset, buffer.sample_rate, buffer.channels)
+    settings = chain.preset
     
-    # Calculate mid and side components
-    mid = left.overlay(right)
-    mid = mid.apply_gain(-3)  # -3dB to maintain energy
+    # Apply normalization if specified (loudness target first, else peak)
+    if settings.target_lufs is not None:
+        with metrics.stage('normalize', samples):
+            apply_loudness_normalization(buffer, settings.target_lufs)
+    elif settings.normalize:
+        with metrics.stage('normalize', samples):
+            apply_normalization(buffer, settings.target_dBFS)
     
-    # Create side component by inverting right channel and mixing with left
-    inverted_right = right.invert_phase()
-    side = left.overlay(inverted_right)
-    side = side.apply_gain(-3)  # -3dB to maintain energy
+    # Apply gain
+    if settings.gain_db != 0:
+        with metrics.stage('gain', samples):
+            buffer.apply_gain(settings.gain_db)
     
-    # Apply width factor to side component
-    side = side.apply_gain(width * 6 - 3)  # Scale width factor
+    # Apply compression
+    if settings.compressor:
+        compressor = settings.compressor
+        with metrics.stage('compression', samples):
+            apply_compression(buffer, compressor.threshold_db, compressor.ratio,
+                              compressor.attack_ms, compressor.release_ms, pool=pool)
+    report(0.35)
     
-    # Recombine mid and side to stereo
-    left_new = mid.overlay(side)
-    inverted_side = side.invert_phase()
-    right_new = mid.overlay(inverted_side)
+    # Apply EQ
+    if len(chain.eq_sos):
+        with metrics.stage('eq', samples):
+            apply_eq(buffer, chain.eq_sos, pool=pool)
+    report(0.5)
+        
+    # Apply stereo width (None when it would leave the image untouched)
+    if chain.stereo_width is not None:
+        with metrics.stage('stereo_width', samples):
+            apply_stereo_width(buffer, chain.stereo_width, pool=pool)
+    report(0.55)
     
-    # Create new stereo audio
-    stereo = AudioSegment.from_mono_audiosegments(left_new, right_new)
+    # Bring the chain's output to the loudness target, if any
+    if settings.target_lufs is not None:
+        with metrics.stage('normalize', samples):
+            apply_loudness_normalization(buffer, settings.target_lufs)
     
-    return stereo
+    # Apply limiter
+    if settings.ceiling_db is not None:
+        with metrics.stage('limiter', samples):
+            apply_limiter(buffer, settings.ceiling_db, pool=pool)
+    report(0.7)
+    
+    return buffer
+
+def apply_normalization(buffer, target_dBFS):
+    """Scale the buffer in place so that its peak sits at target_dBFS"""
+    peak = buffer.peak()
+    if peak > 0:
+        buffer.apply_gain(target_dBFS - 20 * np.log10(peak))
+    return buffer
+
+def apply_loudness_normalization(buffer, target_lufs):
+    """Scale the buffer in place so that its integrated loudness is target_lufs"""
+    integrated = measure_loudness(buffer.samples, buffer.sample_rate, true_peak=False)['integrated_lufs']
+    if integrated is not None:
+        buffer.apply_gain(target_lufs - integrated)
+    return buffer
+
+def apply_compression(buffer, threshold_db, ratio, attack_ms, release_ms, stereo_link=True, pool=None):
+    """Apply dynamic range compression to the buffer in place"""
+    if pool is not None:
+        pool.compress(threshold_db, ratio, attack_ms, release_ms, stereo_link=stereo_link)
+        return buffer
+    compress(
+        buffer.samples, buffer.sample_rate, threshold_db, ratio, attack_ms, release_ms,
+        stereo_link=stereo_link,
+    )
+    return buffer
+
+def apply_eq(buffer, eq_bands, pool=None):
+    """
+    Apply the parametric EQ described by eq_bands in one filter pass
+    
+    eq_bands is a band dict, or the second-order sections it compiles to
+    (see audio_processing.chain) when they are already at hand.
+    """
+    sos = eq_bands if isinstance(eq_bands, np.ndarray) else compile_eq(eq_bands, buffer.sample_rate)
+    if len(sos) == 0:
+        return buffer
+    if pool is not None:
+        pool.equalize(sos)
+        return buffer
+    Equalizer(sos, channels=buffer.channels).process(buffer.samples)
+    return buffer
+
+def apply_stereo_width(buffer, width, pool=None):
+    """Apply stereo widening/narrowing as one mid/side matrix product"""
+    if pool is not None:
+        pool.stereo_width(width)
+        return buffer
+    StereoWidth(width).process(buffer.samples)
+    return buffer
 
-def apply_limiter(audio, ceiling_db):
-    """Apply a limiter to prevent clipping"""
-    # Normalize to the ceiling level
-    return normalize(audio, headroom=ceiling_db)
+def apply_limiter(buffer, ceiling_db, pool=None):
+    """Apply a true-peak lookahead limiter with the given ceiling in dBFS"""
+    if pool is not None:
+        pool.limit(ceiling_db)
+        return buffer
+    limit(buffer.samples, buffer.sample_rate, ceiling_db)
+    return buffer
 
 def generate_waveform_data(file_path, num_points=1000):
-    """Generate waveform data for visualization"""
-    # Load the audio file
-    if file_path.lower().endswith('.mp3'):
-        audio = AudioSegment.from_mp3(file_path)
-    else:  # Assume WAV
-        audio = AudioSegment.from_wav(file_path)
-    
-    # Get audio samples as numpy array
-    samples = np.array(audio.get_array_of_samples())
-    
-    # If stereo, convert to mono for visualization
-    if audio.channels == 2:
-        samples = samples.reshape(-1, 2)
-        samples = samples.mean(axis=1)
-    
-    # Reduce the number of points for visualization
-    # by taking the maximum absolute value in each chunk
-    chunk_size = max(1, len(samples) // num_points)
-    waveform = []
-    
-    for i in range(0, len(samples), chunk_size):
-        chunk = samples[i:i+chunk_size]
-        if len(chunk) > 0:
-            # Find max absolute value in chunk
-            max_val = np.max(np.abs(chunk))
-            waveform.append(float(max_val) / 32768.0)  # Normalize to 0-1 range
-    
-    return waveform
+    """Generate waveform data for visualization, from the file's peak file"""
+    return load_peaks(file_path).waveform(num_points)
@@ -0,0 +1,68 @@
+"""
+Stereo imaging stage
+
+Mid/side encoding, side scaling and decoding collapse into a single 2x2
+matrix, so widening or narrowing is one matrix product per block on the
+frames x channels buffer, with no intermediate mid or side tracks.
+"""
+import numpy as np
+
+from audio_processing.dynamics import BLOCK_SIZE
+
+
+def width_matrix(width):
+    """
+    Left/right mixing matrix for a stereo width factor
+
+    With mid = (L + R) / 2 and side = (L - R) / 2, scaling side by width and
+    decoding back gives L' = a*L + b*R and R' = b*L + a*R, where
+    a = (1 + width) / 2 and b = (1 - width) / 2. A width of 1.0 is the
+    identity, 0.0 folds to mono.
+    """
+    a = (1.0 + width) / 2.0
+    b = (1.0 - width) / 2.0
+    return np.array([[a, b], [b, a]], dtype=np.float32)
+
+
+class StereoWidth:
+    """
+    Mid/side width stage applied in place to frames x 2 buffers
+
+    Args:
+        width: Side gain relative to mid (1.0 leaves the image unchanged)
+    """
+
+    name = 'stereo_width'
+
+    def __init__(self, width, block_size=BLOCK_SIZE):
+        if width < 0:
+            raise ValueError(f"Stereo width must be >= 0, got {width}")
+        self.width = float(width)
+        self.block_size = block_size
+        self._matrix = width_matrix(self.width)
+
+    @property
+    def is_identity(self):
+        return self.width == 1.0
+
+    def reset(self):
+        """The stage is stateless; present for symmetry with the other stages"""
+
+    def process(self, samples):
+        """Apply the width matrix to a frames x channels float array in place"""
+        if self.is_identity or samples.shape[1] != 2:
+            return samples  # Only applies to stereo audio
+
+        matrix = self._matrix.T.astype(samples.dtype, copy=False)
+        scratch = np.empty((min(self.block_size, len(samples)), 2), dtype=samples.dtype)
+        for start in range(0, len(samples), self.block_size):
+            block = samples[start:start + self.block_size]
+            out = scratch[:len(block)]
+            np.matmul(block, matrix, out=out)
+            block[...] = out
+        return samples
+
+
+def stereo_width(samples, width):
+    """Apply a stereo width factor to a frames x channels float array in place"""
+    return StereoWidth(width).process(samples)
@@ -0,0 +1,409 @@
+"""
+Streaming processing mode for long files
+
+The input is decoded by an ffmpeg subprocess into float32 blocks read from a
+pipe (WAV inputs are read from a memory mapping instead, see
+audio_processing.decoder), every stage keeps its filter/envelope state
+between blocks, and the processed blocks are piped into a second ffmpeg
+process that encodes the output. Only a few blocks are alive at any time,
+so memory use does not depend on the length of the track.
+
+Peak and loudness normalization need the peak or integrated loudness of
+the whole track before the first block is processed, so it is measured in
+a first, decode-only pass. A loudness target also needs the loudness left
+by the compressor and EQ, measured in a second pass through those stages,
+to set the gain applied before the limiter.
+"""
+import os
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from pydub import AudioSegment
+from pydub.exceptions import CouldntEncodeError
+
+from audio_processing.analysis import SpectrumAnalyzer, save_analysis
+from audio_processing.chain import compile_preset, preset_chain
+from audio_processing.decoder import open_reader
+from audio_processing.dynamics import Compressor, Limiter
+from audio_processing.eq import Equalizer
+from audio_processing.loudness import LoudnessMeter
+from audio_processing.metrics import NO_METRICS
+from audio_processing.peaks import PeakBuilder
+from audio_processing.stereo import StereoWidth
+
+# Frames read from the decoder per block
+STREAM_BLOCK_FRAMES = 65536
+
+_EXPORT_TAGS = {"album": "Masterify", "artist": "Masterify Audio"}
+
+
+def _encoder_args(export_format, bitrate):
+    """ffmpeg output options for an export format"""
+    if export_format == 'wav':
+        return ['-c:a', 'pcm_s16le']
+    if export_format == 'mp3':
+        return ['-c:a', 'libmp3lame', '-b:a', bitrate]
+    if export_format == 'flac':
+        return ['-c:a', 'flac', '-sample_fmt', 's16']
+    return ['-b:a', bitrate]
+
+
+class FFmpegWriter:
+    """
+    Encode float32 blocks to a file through an ffmpeg pipe
+
+    Blocks written are converted to the output format by ffmpeg as they
+    arrive; nothing is accumulated on the Python side.
+    """
+
+    def __init__(self, output_path, sample_rate, channels, export_format='mp3',
+                 bitrate='320k', tags=None):
+        self.output_path = output_path
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.export_format = export_format
+        self.bitrate = bitrate
+        self.tags = tags or {}
+        self.frames_written = 0
+        self._process = None
+        self._stderr = None
+
+    def open(self):
+        command = [
+            AudioSegment.converter, '-y', '-v', 'error',
+            '-f', 'f32le', '-ar', str(self.sample_rate), '-ac', str(self.channels), '-i', '-',
+        ]
+        for key, value in self.tags.items():
+            command.extend(['-metadata', f'{key}={value}'])
+        command.extend(_encoder_args(self.export_format, self.bitrate))
+        command.extend(['-f', self.export_format, self.output_path])
+
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=self._stderr)
+        return self
+
+    def write(self, block):
+        if len(block) == 0:
+            return
+        data = np.ascontiguousarray(block, dtype='<f4')
+        try:
+            self._process.stdin.write(memoryview(data).cast('B'))
+        except BrokenPipeError:
+            self.close()
+            raise
+        self.frames_written += len(block)
+
+    def close(self, check=True):
+        if self._process is None:
+            return
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = self._process.wait()
+        self._stderr.seek(0)
+        errors = self._stderr.read().decode('utf-8', errors='replace').strip()
+        self._stderr.close()
+        self._process = None
+        if check and returncode != 0:
+            raise CouldntEncodeError(f"Encoding failed. ffmpeg returned error code: {returncode}\n\n{errors}")
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close(check=exc_type is None)
+
+
+class MultiWriter:
+    """
+    Encode the same blocks to several outputs at once
+
+    Each output has its own FFmpegWriter, hence its own ffmpeg process;
+    blocks are handed to all of them from one thread per output so the
+    encoders run in parallel on a single render.
+
+    Args:
+        outputs: List of (output_path, export_format, bitrate)
+    """
+
+    def __init__(self, outputs, sample_rate, channels, tags=None):
+        self.writers = [
+            FFmpegWriter(path, sample_rate, channels, export_format, bitrate, tags)
+            for path, export_format, bitrate in outputs
+        ]
+        self._threads = None
+
+    @property
+    def frames_written(self):
+        return self.writers[0].frames_written
+
+    def open(self):
+        for writer in self.writers:
+            writer.open()
+        if len(self.writers) > 1:
+            self._threads = ThreadPoolExecutor(max_workers=len(self.writers))
+        return self
+
+    def write(self, block):
+        if self._threads is None:
+            return self.writers[0].write(block)
+        data = np.ascontiguousarray(block, dtype='<f4')
+        for future in [self._threads.submit(writer.write, data) for writer in self.writers]:
+            future.result()
+
+    def close(self, check=True):
+        if self._threads is not None:
+            self._threads.shutdown()
+            self._threads = None
+        errors = []
+        for writer in self.writers:
+            try:
+                writer.close(check=check)
+            except CouldntEncodeError as e:
+                errors.append(e)
+        if errors:
+            raise errors[0]
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close(check=exc_type is None)
+
+
+def export_outputs(output_path, export_format, preset, exports=None):
+    """
+    (path, format, bitrate) of every file a render is encoded to
+
+    Args:
+        output_path: Path of the main output
+        export_format: Format of the main output
+        preset: Dictionary containing processing parameters (default bitrate)
+        exports: Optional list of extra outputs, dictionaries with 'path',
+            'format' and an optional 'bitrate'
+    """
+    bitrate = compile_preset(preset).bitrate
+    outputs = [(output_path, export_format, bitrate)]
+    for export in exports or []:
+        outputs.append((export['path'], export['format'], export.get('bitrate') or bitrate))
+    return outputs
+
+
+class Gain:
+    """Broadband gain stage"""
+
+    name = 'gain'
+
+    def __init__(self, gain_db):
+        self.gain_db = float(gain_db)
+        self._gain = np.float32(10 ** (self.gain_db / 20.0))
+
+    def reset(self):
+        pass
+
+    def process(self, samples):
+        if self.gain_db != 0:
+            samples *= self._gain
+        return samples
+
+
+def measure_input(file_path, block_frames=STREAM_BLOCK_FRAMES, loudness=False):
+    """
+    First pass of the streaming mode
+
+    Returns:
+        (peak, frames, integrated_lufs): absolute sample peak, length of the
+            file and, when loudness is set, its integrated loudness (else None)
+    """
+    peak = 0.0
+    frames = 0
+    meter = None
+    with open_reader(file_path, block_frames) as reader:
+        if loudness:
+            meter = LoudnessMeter(reader.sample_rate, reader.channels, true_peak=False)
+        for block in reader:
+            peak = max(peak, float(np.max(block)), -float(np.min(block)))
+            frames += len(block)
+            if meter:
+                meter.process(block)
+    return peak, frames, meter.integrated() if meter else None
+
+
+def build_stages(preset, sample_rate, channels, peak=None, integrated_lufs=None, trim_db=0.0):
+    """
+    Stateful stage objects for a preset, in processing order
+
+    Args:
+        preset: Dictionary containing processing parameters
+        sample_rate: Sample rate of the input
+        channels: Channel count of the input
+        peak: Measured input peak, used when the preset normalizes
+        integrated_lufs: Measured input loudness, used when the preset has
+            a target_lufs
+        trim_db: Gain applied right before the limiter
+
+    Returns:
+        (stages, limiter) where limiter is the final Limiter or None
+    """
+    chain = preset_chain(preset, sample_rate, channels)
+    settings = chain.preset
+    stages = []
+
+    # Normalization and gain collapse into one measured gain
+    gain_db = settings.gain_db
+    if settings.target_lufs is not None:
+        if integrated_lufs is not None and np.isfinite(integrated_lufs):
+            gain_db += settings.target_lufs - integrated_lufs
+    elif settings.normalize and peak:
+        gain_db += settings.target_dBFS - 20 * np.log10(peak)
+    if gain_db != 0:
+        stages.append(Gain(gain_db))
+
+    if settings.compressor:
+        compressor = settings.compressor
+        stages.append(Compressor(
+            compressor.threshold_db, compressor.ratio, compressor.attack_ms, compressor.release_ms,
+            sample_rate, channels=channels,
+        ))
+
+    if len(chain.eq_sos):
+        stages.append(Equalizer(chain.eq_sos, channels=channels))
+
+    if chain.stereo_width is not None:
+        stages.append(StereoWidth(chain.stereo_width))
+
+    if trim_db:
+        stages.append(Gain(trim_db))
+
+    limiter = None
+    if settings.ceiling_db is not None:
+        limiter = Limiter(settings.ceiling_db, sample_rate, channels=channels)
+        stages.append(limiter)
+
+    return stages, limiter
+
+
+def measure_stages(file_path, make_stages, block_frames=STREAM_BLOCK_FRAMES):
+    """
+    Integrated loudness of a file run through stages (output discarded)
+
+    Args:
+        make_stages: Callable taking (sample_rate, channels) and returning
+            the stages to run
+    """
+    with open_reader(file_path, block_frames) as reader:
+        stages = make_stages(reader.sample_rate, reader.channels)
+        meter = LoudnessMeter(reader.sample_rate, reader.channels, true_peak=False)
+        for block in reader:
+            for stage in stages:
+                stage.process(block)
+            meter.process(block)
+    return meter.integrated()
+
+
+def process_audio_streaming(input_path, output_path, preset, export_format='mp3',
+                            block_frames=STREAM_BLOCK_FRAMES, progress=None, peaks_path=None,
+                            analysis_path=None, exports=None, metrics=None):
+    """
+    Process a file block by block with bounded memory
+
+    Args:
+        input_path: Path to the input audio file
+        output_path: Path to save the processed audio file
+        preset: Dictionary containing processing parameters
+        export_format: Container/codec of the output
+        block_frames: Frames per processing block
+        progress: Optional callable receiving the completed fraction (0.0 to 1.0);
+            only reported when the length is known from the normalization pass
+        peaks_path: Where to write the waveform peak file of the output, if given
+        analysis_path: Where to store the analysis of the input, if given and
+            not stored yet
+        exports: Extra outputs encoded from the same render (see export_outputs)
+        metrics: Optional StageMetrics (see audio_processing.metrics); every
+            block is recorded as one call of each stage it goes through
+
+    Returns:
+        (duration, loudness): Duration of the processed audio in seconds and
+            its loudness (see audio_processing.loudness)
+    """
+    settings = compile_preset(preset)
+    metrics = metrics or NO_METRICS
+    peak = integrated_lufs = None
+    total_frames = None
+    by_loudness = settings.target_lufs is not None
+    if by_loudness or settings.normalize:
+        with metrics.stage('measure'):
+            peak, total_frames, integrated_lufs = measure_input(input_path, block_frames, loudness=by_loudness)
+        if progress:
+            progress(0.2)
+
+    trim_db = 0.0
+    if by_loudness and integrated_lufs is not None:
+        def chain_before_limiter(sample_rate, channels):
+            stages, limiter = build_stages(preset, sample_rate, channels, peak, integrated_lufs)
+            return [stage for stage in stages if stage is not limiter]
+
+        with metrics.stage('measure_chain'):
+            chain_lufs = measure_stages(input_path, chain_before_limiter, block_frames)
+        if np.isfinite(chain_lufs):
+            trim_db = settings.target_lufs - chain_lufs
+
+    with open_reader(input_path, block_frames) as reader:
+        stages, limiter = build_stages(preset, reader.sample_rate, reader.channels, peak,
+                                       integrated_lufs, trim_db)
+
+        # The limiter delays its output; drop that many leading frames
+        skip = limiter.latency if limiter else 0
+        peaks = PeakBuilder(reader.sample_rate) if peaks_path else None
+        meter = LoudnessMeter(reader.sample_rate, reader.channels)
+        analyzer = None
+        if analysis_path and not os.path.exists(analysis_path):
+            analyzer = SpectrumAnalyzer(reader.sample_rate)
+
+        outputs = export_outputs(output_path, export_format, preset, exports)
+        with MultiWriter(outputs, reader.sample_rate, reader.channels, _EXPORT_TAGS) as writer:
+            processed = 0
+            for block in metrics.blocks('decode', reader):
+                samples = block.size
+                if analyzer:
+                    with metrics.stage('analysis', samples):
+                        analyzer.add(block)
+                for stage in stages:
+                    with metrics.stage(stage.name, samples):
+                        stage.process(block)
+
+                dropped = min(skip, len(block))
+                output = block[dropped:]
+                with metrics.stage('export', output.size):
+                    writer.write(output)
+                with metrics.stage('loudness', output.size):
+                    meter.process(output)
+                if peaks:
+                    with metrics.stage('peaks', output.size):
+                        peaks.add(output)
+                skip -= dropped
+
+                processed += len(block)
+                if progress and total_frames:
+                    progress(0.2 + 0.8 * min(1.0, processed / total_frames))
+
+            if limiter:
+                # Everything after the limiter has already run on the tail
+                with metrics.stage('limiter'):
+                    tail = limiter.flush()[skip:]
+                with metrics.stage('export', tail.size):
+                    writer.write(tail)
+                meter.process(tail)
+                if peaks:
+                    peaks.add(tail)
+
+        if peaks:
+            with metrics.stage('peaks'):
+                peaks.finish().save(peaks_path)
+        if analyzer:
+            with metrics.stage('analysis'):
+                save_analysis(analysis_path, analyzer.finish())
+        return writer.frames_written / float(reader.sample_rate), meter.result()
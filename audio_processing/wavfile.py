@@ -0,0 +1,213 @@
+"""
+Memory-mapped WAV input
+
+The RIFF header is parsed by hand and the PCM data is exposed as a
+np.memmap view shaped frames x channels, so opening a file costs a few
+small reads whatever its size; pages are only read when the samples are.
+Conversion to float32 happens once per block (or once for the whole file
+for the in-memory mode) straight from the mapping, without the bytes
+object and array.array copies of pydub.
+
+Supported: PCM 8/16/24/32-bit and IEEE float 32/64-bit, in plain,
+WAVE_FORMAT_EXTENSIBLE and RF64 files. Anything else (ADPCM, A-law...)
+raises UnsupportedWav so callers can fall back to ffmpeg.
+"""
+import os
+import struct
+
+import numpy as np
+
+WAVE_FORMAT_PCM = 1
+WAVE_FORMAT_IEEE_FLOAT = 3
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Frames converted per block by WavReader
+READ_BLOCK_FRAMES = 65536
+
+# RIFF and data sizes of streamed or RF64 files
+_UNKNOWN_SIZE = 0xFFFFFFFF
+
+
+class UnsupportedWav(ValueError):
+    """Not a WAV file, or an encoding the memmap reader does not handle"""
+
+
+def _sample_dtype(format_tag, bits):
+    """numpy dtype of one stored sample, and the scale to [-1.0, 1.0]"""
+    if format_tag == WAVE_FORMAT_PCM:
+        if bits == 8:
+            return np.dtype('u1'), 1.0 / 128
+        if bits == 16:
+            return np.dtype('<i2'), 1.0 / 32768
+        if bits == 24:
+            return np.dtype('u1'), 1.0 / 2 ** 31  # 3 bytes per sample, widened to int32
+        if bits == 32:
+            return np.dtype('<i4'), 1.0 / 2 ** 31
+    if format_tag == WAVE_FORMAT_IEEE_FLOAT and bits in (32, 64):
+        return np.dtype(f'<f{bits // 8}'), 1.0
+    raise UnsupportedWav(f"Unsupported WAV encoding: format {format_tag}, {bits} bits")
+
+
+class WavFile:
+    """
+    WAV file mapped in memory
+
+    Attributes:
+        sample_rate: Sample rate in Hz
+        channels: Number of channels
+        bits: Bits per stored sample
+        frames: Length in frames
+        data: np.memmap of the raw samples, frames x channels (frames x
+            channels x 3 bytes for 24-bit)
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        with open(file_path, 'rb') as f:
+            offset, size, fmt = self._parse(f, os.fstat(f.fileno()).st_size)
+
+        format_tag, self.channels, self.sample_rate, _, block_align, self.bits = fmt
+        self._dtype, self._scale = _sample_dtype(format_tag, self.bits)
+        if self.channels < 1 or block_align != self.channels * self.bits // 8:
+            raise UnsupportedWav(f"Inconsistent WAV header in {file_path}")
+
+        self.frames = size // block_align
+        shape = (self.frames, self.channels, 3) if self.bits == 24 else (self.frames, self.channels)
+        if self.frames:
+            self.data = np.memmap(file_path, dtype=self._dtype, mode='r', offset=offset, shape=shape)
+        else:
+            self.data = np.empty(shape, dtype=self._dtype)
+
+    @staticmethod
+    def _parse(f, file_size):
+        """(data offset, data size, fmt fields) of a RIFF/RF64 WAVE file"""
+        header = f.read(12)
+        if len(header) < 12 or header[:4] not in (b'RIFF', b'RF64') or header[8:12] != b'WAVE':
+            raise UnsupportedWav("Not a WAV file")
+
+        fmt = None
+        ds64_data_size = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                raise UnsupportedWav("No data chunk in WAV file")
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk)
+
+            if chunk_id == b'data':
+                offset = f.tell()
+                if ds64_data_size is not None and chunk_size == _UNKNOWN_SIZE:
+                    chunk_size = ds64_data_size
+                # Streamed files leave the size unset or too large
+                size = min(chunk_size, file_size - offset)
+                if fmt is None:
+                    raise UnsupportedWav("WAV data before its fmt chunk")
+                return offset, size, fmt
+
+            body = f.read(chunk_size + (chunk_size & 1))
+            if chunk_id == b'fmt ':
+                if len(body) < 16:
+                    raise UnsupportedWav("Truncated fmt chunk")
+                fmt = list(struct.unpack('<HHIIHH', body[:16]))
+                if fmt[0] == WAVE_FORMAT_EXTENSIBLE:
+                    if len(body) < 40:
+                        raise UnsupportedWav("Truncated WAVE_FORMAT_EXTENSIBLE chunk")
+                    # The sub-format GUID starts with the actual format tag
+                    fmt[0] = struct.unpack('<H', body[24:26])[0]
+            elif chunk_id == b'ds64' and len(body) >= 24:
+                ds64_data_size = struct.unpack('<Q', body[8:16])[0]
+
+    @property
+    def duration(self):
+        return self.frames / float(self.sample_rate)
+
+    def read(self, start=0, stop=None, out=None):
+        """
+        Frames [start, stop) as float32, frames x channels
+
+        Args:
+            out: Optional float32 array to convert into (at least stop -
+                start frames); a new array is returned otherwise
+        """
+        stop = self.frames if stop is None else min(stop, self.frames)
+        start = min(max(0, start), stop)
+        raw = self.data[start:stop]
+        frames = stop - start
+        samples = np.empty((frames, self.channels), dtype=np.float32) if out is None else out[:frames]
+
+        if self.bits == 24:
+            # Little-endian 3-byte samples in the top bytes of an int32
+            wide = np.zeros((frames, self.channels, 4), dtype=np.uint8)
+            wide[..., 1:] = raw
+            raw = wide.view('<i4')[..., 0]
+        if self.bits == 8:
+            np.subtract(raw, np.float32(128), out=samples, casting='unsafe')
+        else:
+            np.copyto(samples, raw, casting='unsafe')
+        if self._scale != 1.0:
+            samples *= np.float32(self._scale)
+        return samples
+
+    def close(self):
+        # The mapping is released with the last view of it
+        self.data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+
+def is_wav(file_path):
+    """Whether a file is a WAV the memmap reader supports"""
+    try:
+        WavFile(file_path).close()
+    except (UnsupportedWav, OSError, struct.error):
+        return False
+    return True
+
+
+class WavReader:
+    """
+    Float32 blocks of a WAV file, with the interface of decoder.FFmpegReader
+
+    Blocks are converted from the mapping into one reused array; start and
+    duration (seconds) restrict reading to a window.
+    """
+
+    def __init__(self, file_path, block_frames=READ_BLOCK_FRAMES, start=None, duration=None):
+        self.file_path = file_path
+        self.block_frames = block_frames
+        self.start = start
+        self.duration = duration
+        self.sample_rate = None
+        self.channels = None
+        self._wav = None
+
+    def open(self):
+        self._wav = WavFile(self.file_path)
+        self.sample_rate = self._wav.sample_rate
+        self.channels = self._wav.channels
+        return self
+
+    def __iter__(self):
+        wav = self._wav
+        first = int(round((self.start or 0.0) * wav.sample_rate))
+        last = wav.frames
+        if self.duration is not None:
+            last = min(last, first + int(round(self.duration * wav.sample_rate)))
+
+        block = np.empty((self.block_frames, wav.channels), dtype=np.float32)
+        for start in range(first, last, self.block_frames):
+            yield wav.read(start, min(start + self.block_frames, last), out=block)
+
+    def close(self, check=True):
+        if self._wav is not None:
+            self._wav.close()
+            self._wav = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
@@ -0,0 +1,52 @@
+"""
+Limiter benchmark
+
+Measures the throughput of the true-peak lookahead limiter, in samples
+per second, on synthetic stereo tracks of several lengths.
+
+Usage:
+    python -m benchmarks.bench_limiter [--seconds 30 240] [--ceiling -0.3]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from audio_processing.dynamics import limit
+
+SAMPLE_RATE = 44100
+
+
+def synth_track(seconds, sample_rate=SAMPLE_RATE, seed=0):
+    """Deterministic stereo test signal that regularly exceeds full scale"""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sample_rate)
+    t = np.arange(n) / sample_rate
+    kicks = 1.5 * np.sin(2 * np.pi * 55 * t) * np.exp(-8 * (t % 0.5))
+    noise = 0.2 * rng.standard_normal((n, 2))
+    return (kicks[:, np.newaxis] + noise).astype(np.float32)
+
+
+def run(lengths, ceiling_db):
+    ceiling = 10 ** (ceiling_db / 20.0)
+    for seconds in lengths:
+        samples = synth_track(seconds)
+        start = time.perf_counter()
+        limit(samples, SAMPLE_RATE, ceiling_db)
+        elapsed = time.perf_counter() - start
+
+        throughput = samples.size / elapsed
+        print(f"{seconds:6.0f} s: {elapsed:7.3f} s  {throughput / 1e6:6.1f} M samples/s  "
+              f"({seconds / elapsed:.0f}x realtime, peak {np.abs(samples).max():.4f} <= {ceiling:.4f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, nargs='+', default=[30.0, 240.0])
+    parser.add_argument('--ceiling', type=float, default=-0.3)
+    args = parser.parse_args()
+    run(args.seconds, args.ceiling)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Parallel stages benchmark
+
+Runs every preset's in-memory chain serially and through the shared-memory
+process pool, reports the speedup and checks that the parallel output
+stays within TOLERANCE of the serial one.
+
+Usage:
+    python -m benchmarks.bench_parallel [--seconds 600] [--workers 4]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from audio_processing.buffer import AudioBuffer
+from audio_processing.parallel import get_executor, shared_stages
+from audio_processing.presets import PRESETS
+from audio_processing.processor import process_buffer
+
+SAMPLE_RATE = 44100
+
+# Largest accepted sample difference between the serial and parallel paths
+TOLERANCE = 1e-4
+
+
+def synth_track(seconds, sample_rate=SAMPLE_RATE, seed=0):
+    """Deterministic stereo test signal: kicks, a tone and noise"""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sample_rate)
+    t = np.arange(n) / sample_rate
+    kicks = 0.9 * np.sin(2 * np.pi * 55 * t) * np.exp(-8 * (t % 0.5))
+    tone = 0.2 * np.sin(2 * np.pi * 440 * t)
+    noise = 0.1 * rng.standard_normal((n, 2))
+    return ((kicks + tone)[:, np.newaxis] + noise).astype(np.float32)
+
+
+def run(seconds, workers):
+    track = synth_track(seconds)
+    # Start the worker processes outside of the timings
+    list(get_executor(workers).map(abs, range(workers)))
+    failures = 0
+
+    print(f"Track: {seconds:.0f} s stereo @ {SAMPLE_RATE} Hz, {workers} workers")
+    for name, preset in PRESETS.items():
+        serial = AudioBuffer(track.copy(), SAMPLE_RATE)
+        start = time.perf_counter()
+        process_buffer(serial, preset)
+        serial_time = time.perf_counter() - start
+
+        parallel = AudioBuffer(track.copy(), SAMPLE_RATE)
+        start = time.perf_counter()
+        with shared_stages(parallel, workers) as pool:
+            process_buffer(parallel, preset, pool=pool)
+        parallel_time = time.perf_counter() - start
+
+        error = float(np.max(np.abs(serial.samples - parallel.samples)))
+        status = 'ok' if error <= TOLERANCE else 'FAIL'
+        failures += status != 'ok'
+        print(f"  {name:<8} serial {serial_time:7.3f} s  parallel {parallel_time:7.3f} s  "
+              f"x{serial_time / parallel_time:4.1f}  max error {error:.2e} {status}")
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=600.0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+    sys.exit(1 if run(args.seconds, args.workers) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+"""
+Audio processing benchmark suite
+
+Synthesizes deterministic test signals (a logarithmic sine sweep, pink
+noise and drum-like transients) at several lengths and channel counts,
+and times on each of them:
+
+    stage/<name>      apply_compression, apply_eq, apply_stereo_width and
+                      apply_limiter with the parameters of --stage-preset
+    chain/<preset>    the whole in-memory chain (process_buffer) of every
+                      preset in PRESETS
+    file/process      process_audio from a WAV file to a WAV file
+    file/waveform     generate_waveform_data of a file without a peak file
+    file/analyze      analyze_and_suggest_preset
+
+Every case is run --repeat times on a fresh copy of its input; the best
+time gives the throughput in samples (frames x channels) per second. Peak
+RSS is reset before each case on Linux (/proc/self/clear_refs), so it is
+the high-water mark of that case alone; elsewhere it is the process-wide
+maximum.
+
+Results can be written as JSON (--output) and compared with an earlier
+run (--compare); the exit status is 1 when a case present in both lost
+more than --threshold of its throughput.
+
+Usage:
+    python -m benchmarks.bench_suite [--seconds 10 60] [--channels 1 2]
+        [--signals sweep pink drums] [--repeat 3] [--filter chain/]
+        [--output results.json] [--compare baseline.json] [--threshold 0.1]
+    python -m benchmarks.bench_suite --results results.json --compare baseline.json
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+import scipy
+
+from audio_processing.buffer import AudioBuffer
+from audio_processing.peaks import peaks_path_for
+from audio_processing.presets import PRESETS, analyze_and_suggest_preset
+from audio_processing.processor import (
+    apply_compression, apply_eq, apply_limiter, apply_stereo_width,
+    generate_waveform_data, process_audio, process_buffer,
+)
+
+SAMPLE_RATE = 44100
+
+# Version of the results file layout
+RESULTS_VERSION = 1
+
+# Default largest accepted throughput loss against a baseline (10 %)
+THRESHOLD = 0.10
+
+
+def sine_sweep(frames, channels, sample_rate=SAMPLE_RATE, seed=0):
+    """Logarithmic 20 Hz - 20 kHz sweep, one per second, the channels slightly detuned"""
+    t = (np.arange(frames) % sample_rate) / sample_rate
+    low, high = 20.0, 20000.0
+    k = np.log(high / low)
+    columns = []
+    for channel in range(channels):
+        start = low * (1 + 0.01 * channel)
+        columns.append(0.5 * np.sin(2 * np.pi * start / k * (np.exp(k * t) - 1)))
+    return np.stack(columns, axis=1).astype(np.float32)
+
+
+def pink_noise(frames, channels, sample_rate=SAMPLE_RATE, seed=0):
+    """Gaussian noise shaped to 1/f in the frequency domain, -10 dBFS RMS"""
+    rng = np.random.default_rng(seed)
+    spectrum = np.fft.rfft(rng.standard_normal((frames, channels)), axis=0)
+    scale = np.ones(len(spectrum))
+    scale[1:] = 1 / np.sqrt(np.arange(1, len(spectrum)))
+    scale[0] = 0.0
+    noise = np.fft.irfft(spectrum * scale[:, np.newaxis], n=frames, axis=0)
+    rms = np.sqrt(np.mean(noise ** 2)) or 1.0
+    return (noise * (10 ** (-10 / 20.0) / rms)).astype(np.float32)
+
+
+def drums(frames, channels, sample_rate=SAMPLE_RATE, seed=0):
+    """Kicks, snares and hats at 120 BPM: sharp transients over silence"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(frames) / sample_rate
+    beat = 0.5
+    kick = np.sin(2 * np.pi * 50 * t * (1 + 2 * np.exp(-30 * (t % beat)))) * np.exp(-10 * (t % beat))
+    snare_phase = (t + beat) % (2 * beat)
+    snare = rng.standard_normal(frames) * np.exp(-20 * snare_phase) * 0.6
+    hats = rng.standard_normal(frames) * np.exp(-80 * (t % (beat / 2))) * 0.2
+    mono = 0.9 * kick + snare + hats
+    pan = np.linspace(0.8, 1.2, channels) if channels > 1 else np.ones(1)
+    return (mono[:, np.newaxis] * pan * 0.8).astype(np.float32)
+
+
+SIGNALS = {
+    'sweep': sine_sweep,
+    'pink': pink_noise,
+    'drums': drums,
+}
+
+
+def reset_peak_rss():
+    """Restart the peak RSS measurement (Linux only, no-op elsewhere)"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak / (1024.0 ** 2 if sys.platform == 'darwin' else 1024.0)
+
+
+def buffer_cases(stage_preset, channels):
+    """(name, callable taking an AudioBuffer) for the stage and chain cases"""
+    p = PRESETS[stage_preset]
+    cases = [
+        ('stage/compression', lambda buffer: apply_compression(
+            buffer, p['threshold_db'], p['ratio'], p['attack_ms'], p['release_ms'])),
+        ('stage/eq', lambda buffer: apply_eq(buffer, p['eq_bands'])),
+    ]
+    if channels == 2:
+        cases.append(('stage/stereo_width', lambda buffer: apply_stereo_width(
+            buffer, p['stereo_width'] / 100.0)))
+    cases.append(('stage/limiter', lambda buffer: apply_limiter(buffer, p['ceiling_db'])))
+    for name, preset in PRESETS.items():
+        cases.append((f'chain/{name}', lambda buffer, preset=preset: process_buffer(buffer, preset)))
+    return cases
+
+
+FILE_CASES = ('file/process', 'file/waveform', 'file/analyze')
+
+
+def file_cases(stage_preset, input_path, directory):
+    """(name, prepare, run) for the cases working on files; prepare returns run's arguments"""
+    preset = PRESETS[stage_preset]
+    output_path = os.path.join(directory, 'output.wav')
+    mastered_path = os.path.join(directory, 'mastered.wav')
+    process_audio(input_path, mastered_path, preset, streaming=False)
+
+    def drop_peaks():
+        if os.path.exists(peaks_path_for(mastered_path)):
+            os.remove(peaks_path_for(mastered_path))
+        return ()
+
+    return [
+        ('file/process', lambda: (),
+         lambda: process_audio(input_path, output_path, preset, streaming=False)),
+        ('file/waveform', drop_peaks, lambda: generate_waveform_data(mastered_path)),
+        ('file/analyze', lambda: (), lambda: analyze_and_suggest_preset(input_path)),
+    ]
+
+
+def time_case(prepare, run, repeat):
+    """Best and mean wall time of run() over repeat runs, and the peak RSS"""
+    times = []
+    reset_peak_rss()
+    for _ in range(repeat):
+        args = prepare()
+        start = time.perf_counter()
+        run(*args)
+        times.append(time.perf_counter() - start)
+    return min(times), sum(times) / len(times), peak_rss_mb()
+
+
+def run(seconds_list, channels_list, signal_names, repeat, stage_preset, name_filter=None):
+    """Run every selected case and return the list of result dictionaries"""
+    results = []
+    directory = tempfile.mkdtemp(prefix='masterify-bench-')
+    try:
+        for seconds in seconds_list:
+            frames = int(seconds * SAMPLE_RATE)
+            for channels in channels_list:
+                for signal in signal_names:
+                    samples = SIGNALS[signal](frames, channels)
+                    print(f"{signal} {seconds:g} s, {channels} ch @ {SAMPLE_RATE} Hz")
+
+                    cases = [
+                        (name, lambda: (AudioBuffer(samples.copy(), SAMPLE_RATE),), function)
+                        for name, function in buffer_cases(stage_preset, channels)
+                    ]
+                    if not name_filter or any(name_filter in name for name in FILE_CASES):
+                        input_path = os.path.join(directory, f'{signal}-{seconds:g}s-{channels}ch.wav')
+                        AudioBuffer(samples, SAMPLE_RATE).export(input_path, format='wav')
+                        cases += file_cases(stage_preset, input_path, directory)
+
+                    for name, prepare, function in cases:
+                        if name_filter and name_filter not in name:
+                            continue
+                        best, mean, rss = time_case(prepare, function, repeat)
+                        result = {
+                            'case': name,
+                            'signal': signal,
+                            'seconds': seconds,
+                            'channels': channels,
+                            'frames': frames,
+                            'best_s': best,
+                            'mean_s': mean,
+                            'samples_per_s': frames * channels / best,
+                            'peak_rss_mb': rss,
+                        }
+                        results.append(result)
+                        print(f"  {name:<20} {best:8.3f} s  {result['samples_per_s'] / 1e6:8.2f} M samples/s"
+                              f"  peak RSS {rss:7.1f} MiB")
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def result_key(result):
+    return f"{result['case']} [{result['signal']}, {result['seconds']:g} s, {result['channels']} ch]"
+
+
+def machine_info():
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'scipy': scipy.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def save_results(path, results, config):
+    with open(path, 'w') as f:
+        json.dump({
+            'version': RESULTS_VERSION,
+            'created': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'machine': machine_info(),
+            'config': config,
+            'results': results,
+        }, f, indent=2)
+
+
+def load_results(path):
+    with open(path) as f:
+        data = json.load(f)
+    if data.get('version') != RESULTS_VERSION:
+        raise ValueError(f"{path}: unsupported results version {data.get('version')}")
+    return data['results']
+
+
+def compare(results, baseline, threshold=THRESHOLD):
+    """
+    Compare the throughput of two runs
+
+    Args:
+        results: Result dictionaries of the current run
+        baseline: Result dictionaries of the reference run
+        threshold: Largest accepted relative throughput loss
+
+    Returns:
+        regressions: Keys of the cases slower than the baseline by more
+            than threshold (cases missing from either run are skipped)
+    """
+    reference = {result_key(result): result for result in baseline}
+    regressions = []
+    print(f"\nComparison with the baseline (threshold {threshold:.0%})")
+    for result in results:
+        key = result_key(result)
+        if key not in reference:
+            continue
+        ratio = result['samples_per_s'] / reference[key]['samples_per_s']
+        status = 'ok'
+        if ratio < 1 - threshold:
+            status = 'REGRESSION'
+            regressions.append(key)
+        print(f"  {key:<50} x{ratio:5.2f}  {status}")
+    print(f"{len(regressions)} regression(s)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, nargs='+', default=[10.0, 60.0])
+    parser.add_argument('--channels', type=int, nargs='+', default=[1, 2])
+    parser.add_argument('--signals', nargs='+', choices=sorted(SIGNALS), default=list(SIGNALS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--stage-preset', choices=sorted(PRESETS), default='clean')
+    parser.add_argument('--filter', help="Only run cases whose name contains this text")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--results', help="Compare an existing results file instead of running")
+    parser.add_argument('--compare', help="Baseline results file to compare with")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD)
+    args = parser.parse_args()
+
+    if args.results:
+        results = load_results(args.results)
+    else:
+        results = run(args.seconds, args.channels, args.signals, args.repeat,
+                      args.stage_preset, args.filter)
+        if args.output:
+            save_results(args.output, results, {
+                'seconds': args.seconds,
+                'channels': args.channels,
+                'signals': args.signals,
+                'repeat': args.repeat,
+                'stage_preset': args.stage_preset,
+                'filter': args.filter,
+            })
+
+    if args.compare:
+        regressions = compare(results, load_results(args.compare), args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
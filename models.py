@@ -1,3 +1,5 @@
+import json
+import uuid
 from datetime import datetime
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -23,15 +25,11 @@ class User(UserMixin, db.Model):
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
     
-    def use_credit(self):
-        if self.credits > 0:
-            self.credits -= 1
-            return True
-        return False
-    
     def add_credits(self, amount):
+        # Evaluated by the database (credits = credits + n), so it cannot
+        # overwrite a concurrent reservation or refund (see utils.credits)
         if amount > 0:
-            self.credits += amount
+            self.credits = User.credits + amount
 
 class MasteredFile(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -44,6 +42,240 @@ class MasteredFile(db.Model):
     file_size = db.Column(db.Integer)  # Size in bytes
     duration = db.Column(db.Float)  # Duration in seconds
     download_count = db.Column(db.Integer, default=0)
+    # Loudness of the output, measured while processing (EBU R128)
+    integrated_lufs = db.Column(db.Float)
+    loudness_range = db.Column(db.Float)  # LU
+    true_peak_db = db.Column(db.Float)  # dBTP
+    max_momentary_lufs = db.Column(db.Float)
+    max_short_term_lufs = db.Column(db.Float)
+    
+    LOUDNESS_FIELDS = ('integrated_lufs', 'loudness_range', 'true_peak_db',
+                       'max_momentary_lufs', 'max_short_term_lufs')
+    
+    @classmethod
+    def record_downloads(cls, file_ids):
+        """Add one download to each file in one UPDATE, without reading the rows"""
+        db.session.execute(
+            db.update(cls)
+            .where(cls.id.in_(list(file_ids)))
+            .values(download_count=db.func.coalesce(cls.download_count, 0) + 1)
+        )
+    
+    def set_loudness(self, loudness):
+        for field in self.LOUDNESS_FIELDS:
+            setattr(self, field, (loudness or {}).get(field))
+    
+    @property
+    def loudness(self):
+        return {field: getattr(self, field) for field in self.LOUDNESS_FIELDS}
+
+class MasteredFileExport(db.Model):
+    """Extra format of a MasteredFile, encoded from the same render"""
+    id = db.Column(db.Integer, primary_key=True)
+    mastered_file_id = db.Column(db.Integer, db.ForeignKey('mastered_file.id'), nullable=False, index=True)
+    format = db.Column(db.String(10), nullable=False)  # 'mp3', 'wav', 'flac'
+    bitrate = db.Column(db.String(10))
+    processed_filename = db.Column(db.String(255), nullable=False)
+    file_path = db.Column(db.String(512), nullable=False)
+    file_size = db.Column(db.Integer)  # Size in bytes
+    mastered_file = db.relationship('MasteredFile', backref=db.backref('exports', lazy=True))
+    
+    def to_dict(self):
+        return {
+            'format': self.format,
+            'bitrate': self.bitrate,
+            'processed_filename': self.processed_filename,
+            'file_size': self.file_size,
+        }
+
+class ProcessingJob(db.Model):
+    """A mastering job run in the background by utils.jobs"""
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # 'queued', 'running', 'succeeded', 'failed'
+    progress = db.Column(db.Float, nullable=False, default=0.0)  # 0.0 to 1.0
+    original_filename = db.Column(db.String(255))
+    input_path = db.Column(db.String(512), nullable=False)
+    input_hash = db.Column(db.String(64), nullable=True)  # SHA-256 of the input file
+    output_path = db.Column(db.String(512), nullable=False)
+    processed_filename = db.Column(db.String(255), nullable=False)
+    preset_used = db.Column(db.String(50), nullable=False)
+    error = db.Column(db.Text)
+    cache_key = db.Column(db.String(64), nullable=True)  # utils.result_cache key of the expected output
+    exports_json = db.Column(db.Text, nullable=True)  # Extra formats encoded from the same render
+    preset_json = db.Column(db.Text, nullable=True)  # Settings of a custom preset at submission
+    stage_metrics_json = db.Column(db.Text, nullable=True)  # Per-stage figures of the render (audio_processing.metrics)
+    batch_id = db.Column(db.String(32), db.ForeignKey('processing_batch.id'), nullable=True, index=True)
+    credits_reserved = db.Column(db.Integer, nullable=False, default=0)  # Taken at submission, refunded on failure
+    idempotency_key = db.Column(db.String(64), nullable=True)  # Idempotency-Key header of the request
+    profile = db.Column(db.Boolean, nullable=False, default=False)  # Render run under cProfile (utils.profiling)
+    mastered_file_id = db.Column(db.Integer, db.ForeignKey('mastered_file.id'), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    mastered_file = db.relationship('MasteredFile', lazy=True)
+    user = db.relationship('User', backref=db.backref('jobs', lazy=True))
+    
+    __table_args__ = (db.UniqueConstraint('user_id', 'idempotency_key'),)
+    
+    @property
+    def exports(self):
+        """Extra outputs: dictionaries with format, bitrate, path, processed_filename, cache_key"""
+        return json.loads(self.exports_json) if self.exports_json else []
+    
+    @exports.setter
+    def exports(self, exports):
+        self.exports_json = json.dumps(exports) if exports else None
+    
+    @property
+    def preset_settings(self):
+        """Snapshot of the custom preset the job runs with, or None for a built-in preset"""
+        return json.loads(self.preset_json) if self.preset_json else None
+    
+    @preset_settings.setter
+    def preset_settings(self, settings):
+        self.preset_json = json.dumps(settings) if settings else None
+    
+    @property
+    def stage_metrics(self):
+        """{stage: {calls, wall_s, cpu_s, samples, peak_bytes}} of the render, or None"""
+        return json.loads(self.stage_metrics_json) if self.stage_metrics_json else None
+    
+    @stage_metrics.setter
+    def stage_metrics(self, stages):
+        self.stage_metrics_json = json.dumps(stages) if stages else None
+    
+    @property
+    def is_finished(self):
+        return self.status in ('succeeded', 'failed')
+    
+    def to_dict(self):
+        data = {
+            'job_id': self.id,
+            'status': self.status,
+            'progress': round(self.progress or 0.0, 3),
+            'preset': self.preset_used,
+            'original_filename': self.original_filename,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+        if self.status == 'succeeded':
+            data['file_id'] = self.mastered_file_id
+            data['processed_filename'] = self.processed_filename
+            if self.mastered_file is not None:
+                data['loudness'] = self.mastered_file.loudness
+                data['exports'] = [export.to_dict() for export in self.mastered_file.exports]
+        if self.status == 'failed':
+            data['message'] = self.error
+        return data
+
+class Upload(db.Model):
+    """A resumable upload into the upload folder (see utils.uploads)"""
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    original_filename = db.Column(db.String(255), nullable=False)
+    stored_filename = db.Column(db.String(255), nullable=False, unique=True)  # Name in the upload folder
+    length = db.Column(db.BigInteger, nullable=False)  # Size in bytes
+    offset = db.Column(db.BigInteger, nullable=False, default=0)  # Bytes received so far
+    sha256 = db.Column(db.String(64), nullable=True)  # Digest of the file, once complete
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    
+    @property
+    def is_complete(self):
+        return self.completed_at is not None
+    
+    def to_dict(self):
+        data = {
+            'upload_id': self.id,
+            'original_filename': self.original_filename,
+            'length': self.length,
+            'offset': self.offset,
+            'complete': self.is_complete,
+        }
+        if self.is_complete:
+            data['filename'] = self.stored_filename
+            data['sha256'] = self.sha256
+        return data
+
+class ProcessingBatch(db.Model):
+    """A group of ProcessingJobs submitted together, billed together by utils.jobs"""
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, finished
+    credits_used = db.Column(db.Integer, nullable=False, default=0)
+    idempotency_key = db.Column(db.String(64), nullable=True)  # Idempotency-Key header of the request
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    jobs = db.relationship('ProcessingJob', backref='batch', lazy=True,
+                           order_by='ProcessingJob.created_at')
+    user = db.relationship('User', backref=db.backref('batches', lazy=True))
+    
+    __table_args__ = (db.UniqueConstraint('user_id', 'idempotency_key'),)
+    
+    @property
+    def progress(self):
+        """Mean progress of the batch's jobs"""
+        if not self.jobs:
+            return 1.0
+        return sum(1.0 if job.is_finished else (job.progress or 0.0) for job in self.jobs) / len(self.jobs)
+    
+    def to_dict(self):
+        statuses = [job.status for job in self.jobs]
+        return {
+            'batch_id': self.id,
+            'status': self.status,
+            'progress': round(self.progress, 3),
+            'total': len(statuses),
+            'succeeded': statuses.count('succeeded'),
+            'failed': statuses.count('failed'),
+            'credits_used': self.credits_used,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'jobs': [job.to_dict() for job in self.jobs],
+        }
+
+class Preset(db.Model):
+    """A user's own processing chain (settings validated by audio_processing.chain)"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    name = db.Column(db.String(50), nullable=False)
+    description = db.Column(db.String(255))
+    settings_json = db.Column(db.Text, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=1)  # Bumped when the settings change (cache key)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    user = db.relationship('User', backref=db.backref('presets', lazy=True))
+    
+    __table_args__ = (db.UniqueConstraint('user_id', 'name'),)
+    
+    # Prefix of the name jobs refer to custom presets by ('custom-12')
+    REFERENCE_PREFIX = 'custom-'
+    
+    @property
+    def reference(self):
+        return f'{self.REFERENCE_PREFIX}{self.id}'
+    
+    @property
+    def settings(self):
+        return json.loads(self.settings_json)
+    
+    @settings.setter
+    def settings(self, settings):
+        settings_json = json.dumps(settings, sort_keys=True)
+        if self.settings_json is not None and settings_json != self.settings_json:
+            self.version = (self.version or 1) + 1
+        self.settings_json = settings_json
     
-    def increment_download(self):
-        self.download_count += 1
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'preset': self.reference,
+            'name': self.name,
+            'description': self.description,
+            'settings': self.settings,
+            'version': self.version,
+            'custom': True,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'updated_at': self.updated_at.isoformat() if self.updated_at else None,
+        }
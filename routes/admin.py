@@ -0,0 +1,92 @@
+"""
+Outils d'administration : profilage des workers et des jobs (voir utils.profiling)
+"""
+import os
+from functools import wraps
+
+from flask import Blueprint, jsonify, send_file
+from flask_login import login_required, current_user
+
+from extensions import db
+from models import ProcessingJob
+from utils.profiling import PROFILE_SUFFIX, job_profile_path, profiler
+
+admin_bp = Blueprint('admin', __name__, url_prefix='/api/admin')
+
+
+def admin_required(view):
+    """Réservé aux comptes listés dans ADMIN_EMAILS (404 pour les autres)"""
+    @wraps(view)
+    @login_required
+    def wrapper(*args, **kwargs):
+        if not profiler.enabled or not profiler.is_admin(current_user):
+            return jsonify({'success': False, 'message': 'Not found'}), 404
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def sampler_status():
+    sampler = profiler.sampler
+    return {
+        'success': True,
+        'pid': os.getpid(),
+        'running': sampler.running,
+        'interval': sampler.interval,
+        'started_at': sampler.started_at if sampler.running else None,
+        'samples': sampler.samples,
+    }
+
+
+@admin_bp.route('/profiler')
+@admin_required
+def get_profiler():
+    # État de l'échantillonneur du worker qui répond à la requête
+    return jsonify(sampler_status())
+
+
+@admin_bp.route('/profiler/start', methods=['POST'])
+@admin_required
+def start_profiler():
+    started = profiler.start_sampler()
+    data = sampler_status()
+    data['started'] = started
+    return jsonify(data)
+
+
+@admin_bp.route('/profiler/stop', methods=['POST'])
+@admin_required
+def stop_profiler():
+    name = profiler.stop_sampler()
+    if name is None:
+        return jsonify({'success': False, 'pid': os.getpid(), 'message': 'Sampler not running in this worker'}), 409
+    data = sampler_status()
+    data['profile'] = name
+    return jsonify(data)
+
+
+@admin_bp.route('/profiles')
+@admin_required
+def list_profiles():
+    # Fichiers de tous les workers (PROFILE_DIR est partagé)
+    return jsonify({'success': True, 'profiles': profiler.list_profiles()})
+
+
+@admin_bp.route('/profiles/<name>')
+@admin_required
+def download_profile(name):
+    path = profiler.profile_path(name)
+    if path is None:
+        return jsonify({'success': False, 'message': 'Profile not found'}), 404
+    return send_file(os.path.abspath(path), mimetype='text/plain', as_attachment=True, download_name=name)
+
+
+@admin_bp.route('/jobs/<job_id>/profile')
+@admin_required
+def download_job_profile(job_id):
+    # Écrit par le worker à côté de la sortie du job, une fois le rendu terminé
+    job = db.session.get(ProcessingJob, job_id)
+    path = job_profile_path(job.output_path) if job is not None and job.profile else None
+    if path is None or not os.path.isfile(path):
+        return jsonify({'success': False, 'message': 'Profile not found'}), 404
+    return send_file(os.path.abspath(path), mimetype='text/plain', as_attachment=True,
+                     download_name=f'job-{job.id}{PROFILE_SUFFIX}')
@@ -1,70 +1,670 @@
-from flask import Blueprint, request, jsonify, send_file, current_app
+from flask import Blueprint, Response, request, jsonify, send_file, current_app, url_for, stream_with_context
+from urllib.parse import quote
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
 from flask_login import login_required, current_user
+import hashlib
+import hmac
+import io
+import mimetypes
 import os
+import re
+import tempfile
+import uuid
 from datetime import datetime
-from models import db, MasteredFile
-from audio_processing.processor import process_audio, generate_waveform_data
-from audio_processing.presets import get_preset_by_name
+from models import db, MasteredFile, Preset, ProcessingBatch, ProcessingJob, Upload
+from audio_processing.chain import PresetError, preset_schema, validate_settings
+from audio_processing.processor import get_export_format, process_audio
+from audio_processing.preview import PREVIEW_BITRATE, PREVIEW_FORMAT, PREVIEW_SECONDS, MAX_PREVIEW_SECONDS
+from audio_processing.peaks import load_peaks, peaks_path_for
+from audio_processing.presets import get_all_presets, analyze_and_suggest_preset
+from utils.jobs import job_queue, create_batch, create_job, finalize_job
+from utils.credits import reserve_credits
+from utils.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, job_metrics
+from utils.presets import MAX_PRESETS_PER_USER, can_edit_presets, resolve_preset
+from utils.profiling import profiler
+from utils.result_cache import result_cache
+from utils.file_management import allowed_file, file_digest, stream_zip
+from utils.uploads import (ChecksumMismatch, UploadLocked, append_chunk, forget, parse_checksum,
+                           parse_metadata, part_path)
 
 api_bp = Blueprint('api', __name__)
 
 UPLOAD_FOLDER = 'temp_uploads'
 PROCESSED_FOLDER = 'attached_assets'
 
+# Resumable uploads (see utils.uploads)
+ALLOWED_EXTENSIONS = {'mp3', 'wav', 'flac', 'aif', 'aiff', 'm4a'}
+MAX_UPLOAD_BYTES = 2 * 1024 ** 3
+MAX_CHUNK_BYTES = 64 * 1024 ** 2
+TUS_VERSION = '1.0.0'
+
+# Largest number of (file, preset) renders in one batch
+BATCH_MAX_ITEMS = 50
+
+# Formats a render can be exported to besides the main output
+EXPORT_FORMATS = ('mp3', 'wav', 'flac')
+
+# Idempotency-Key: printable ASCII, no longer than the column that stores it
+IDEMPOTENCY_KEY = re.compile(r'[!-~]{1,64}')
+
+def mastered_filename(prefix, filename):
+    """Name of the main output of an input: same format if it can be exported to, mp3 otherwise"""
+    base, extension = os.path.splitext(filename)
+    if extension.lstrip('.').lower() not in EXPORT_FORMATS:
+        extension = '.mp3'
+    return f"{prefix}{base}{extension}"
+
+def send_download(file_path, download_name):
+    """
+    Send a processed file as an attachment, with Range support
+
+    With DOWNLOAD_OFFLOAD = 'x-accel-redirect' the bytes are left to the
+    front proxy (nginx internal location DOWNLOAD_ACCEL_PREFIX aliased to
+    the processed folder). With 'x-sendfile', USE_X_SENDFILE makes
+    send_file hand the path to the proxy instead.
+    """
+    if current_app.config.get('DOWNLOAD_OFFLOAD') == 'x-accel-redirect':
+        relative = os.path.relpath(file_path, PROCESSED_FOLDER).replace(os.sep, '/')
+        response = Response(mimetype=mimetypes.guess_type(download_name)[0] or 'application/octet-stream')
+        response.headers['X-Accel-Redirect'] = current_app.config.get('DOWNLOAD_ACCEL_PREFIX', '/protected/') \
+            .rstrip('/') + '/' + quote(relative)
+        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(download_name)}"
+        return response
+    return send_file(file_path, as_attachment=True, download_name=download_name, conditional=True)
+
+def is_new_download():
+    """False for Range requests that resume or seek (only the first byte range counts)"""
+    return request.range is None or not request.range.ranges or request.range.ranges[0][0] == 0
+
+def idempotency_key_error():
+    """400 response for a malformed Idempotency-Key header, or None"""
+    key = request.headers.get('Idempotency-Key')
+    if key and not IDEMPOTENCY_KEY.fullmatch(key):
+        return jsonify({'success': False, 'message': 'Invalid Idempotency-Key (1-64 printable ASCII characters)'}), 400
+    return None
+
+def replayed_job(job):
+    """Answer to a request repeated with the Idempotency-Key of an existing job"""
+    data = job.to_dict()
+    data['success'] = job.status != 'failed'
+    data['replayed'] = True
+    data['status_url'] = url_for('api.get_job', job_id=job.id)
+    data['credits_remaining'] = current_user.credits
+    return jsonify(data)
+
+def replayed_batch(batch):
+    """Answer to a request repeated with the Idempotency-Key of an existing batch"""
+    data = batch.to_dict()
+    data['success'] = True
+    data['replayed'] = True
+    data['status_url'] = url_for('api.get_batch', batch_id=batch.id)
+    data['download_url'] = url_for('api.download_batch', batch_id=batch.id)
+    data['credits_remaining'] = current_user.credits
+    return jsonify(data)
+
+def input_digest(filename, input_path):
+    """SHA-256 of an uploaded input, computed during a resumable upload when there was one"""
+    upload = Upload.query.filter_by(stored_filename=filename).first()
+    if upload is not None and upload.sha256:
+        return upload.sha256
+    return file_digest(input_path)
+
+def tus_response(response, upload=None):
+    """Add the tus protocol headers (and the upload's offset) to a response"""
+    response.headers['Tus-Resumable'] = TUS_VERSION
+    response.headers['Cache-Control'] = 'no-store'
+    if upload is not None:
+        response.headers['Upload-Offset'] = str(upload.offset)
+        response.headers['Upload-Length'] = str(upload.length)
+    return response
+
+def parse_exports(requested, output_path, processed_filename):
+    """
+    Extra outputs requested with a job
+
+    Args:
+        requested: List of format names or of dictionaries with 'format' and
+            an optional 'bitrate'
+        output_path: Path of the main output, whose format is skipped
+        processed_filename: Download name of the main output
+
+    Returns:
+        exports: List of dictionaries with format, bitrate, path and
+            processed_filename, or None if a format is not supported
+    """
+    main_format = get_export_format(output_path)
+    output_base = os.path.splitext(output_path)[0]
+    filename_base = os.path.splitext(processed_filename)[0]
+    exports = []
+    for item in requested or []:
+        if not isinstance(item, dict):
+            item = {'format': item}
+        export_format = str(item.get('format', '')).lower()
+        if export_format not in EXPORT_FORMATS:
+            return None
+        if export_format == main_format or any(e['format'] == export_format for e in exports):
+            continue
+        exports.append({
+            'format': export_format,
+            'bitrate': item.get('bitrate'),
+            'path': f'{output_base}.{export_format}',
+            'processed_filename': f'{filename_base}.{export_format}',
+        })
+    return exports
+
 @api_bp.route('/api/process', methods=['POST'])
 @login_required
 def process_track():
     data = request.get_json()
     filename = data.get('filename')
-    original_filename = data.get('original_filename')
+    original_filename = data.get('original_filename') or filename
     preset_name = data.get('preset')
+    requested_exports = data.get('exports') or []
     if not filename or not preset_name:
         return jsonify({'success': False, 'message': 'Missing filename or preset'}), 400
 
+    # Requête rejouée (même Idempotency-Key) : on renvoie le job existant, sans nouveau débit
+    error = idempotency_key_error()
+    if error:
+        return error
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key:
+        existing = ProcessingJob.query.filter_by(user_id=current_user.id, idempotency_key=idempotency_key).first()
+        if existing is not None:
+            return replayed_job(existing)
+
     # Chemins
     input_path = os.path.join(UPLOAD_FOLDER, filename)
-    processed_filename = f"mastered_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_{filename}"
+    processed_filename = mastered_filename(f"mastered_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}_", filename)
     output_path = os.path.join(PROCESSED_FOLDER, processed_filename)
 
-    # Récupère le preset
-    preset = get_preset_by_name(preset_name)
-    if not preset:
+    # Récupère le preset (intégré, ou 'custom-<id>' de l'utilisateur)
+    resolved = resolve_preset(preset_name, current_user)
+    if not resolved:
         return jsonify({'success': False, 'message': 'Invalid preset'}), 400
+    preset = resolved.settings
 
-    # Gestion crédits (illimités pour Studio)
-    if (current_user.plan != 'studio') and (current_user.credits <= 0):
+    # Formats supplémentaires encodés depuis le même rendu (un seul crédit)
+    exports = parse_exports(requested_exports, output_path, processed_filename) \
+        if isinstance(requested_exports, list) else None
+    if exports is None:
+        return jsonify({'success': False, 'message': f'Exports must be among {", ".join(EXPORT_FORMATS)}'}), 400
+
+    # Même fichier + même preset : résultat déjà calculé
+    input_hash = cache_key = None
+    if os.path.exists(input_path):
+        input_hash = input_digest(filename, input_path)
+        cache_key = result_cache.key_for(input_hash, preset, get_export_format(output_path))
+        for export in exports:
+            export['cache_key'] = result_cache.key_for(input_hash, preset, export['format'],
+                                                       export['bitrate'])
+
+    # Crédit réservé atomiquement (illimités pour Studio), rendu si le job échoue
+    reserved = reserve_credits(current_user)
+    if reserved is None:
+        db.session.rollback()
         return jsonify({'success': False, 'message': 'Not enough credits.'}), 403
+    try:
+        job = create_job(current_user, input_path, output_path, processed_filename,
+                         preset_name, original_filename=original_filename, cache_key=cache_key,
+                         input_hash=input_hash, exports=exports, credits_reserved=reserved,
+                         idempotency_key=idempotency_key,
+                         preset_settings=preset if resolved.custom else None,
+                         profile=profiler.wants_profile())
+    except IntegrityError:
+        # Même clé soumise en parallèle : la réservation est annulée avec l'insertion
+        db.session.rollback()
+        if not idempotency_key:
+            raise
+        return replayed_job(ProcessingJob.query.filter_by(
+            user_id=current_user.id, idempotency_key=idempotency_key).first_or_404())
+    # Sortie principale et exports : tous en cache, ou un seul rendu complet
+    cached = result_cache.fetch_all([(cache_key, output_path)] +
+                                    [(export.get('cache_key'), export['path']) for export in exports])
+    if cached is not None:
+        finalize_job(job.id, duration=cached[0].get('duration'), loudness=cached[0].get('loudness'))
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'cached': True,
+            'file_id': job.mastered_file_id,
+            'processed_filename': processed_filename,
+            'credits_remaining': current_user.credits,
+            'status_url': url_for('api.get_job', job_id=job.id)
+        })
 
-    # Traitement audio
+    # Traitement audio en arrière-plan
     try:
-        duration = process_audio(input_path, output_path, preset)
+        job_queue.enqueue(job, preset)
     except Exception as e:
+        finalize_job(job.id, error=e)
         return jsonify({'success': False, 'message': f'Processing error: {str(e)}'}), 500
 
-    # Décrémente crédits si pas Studio
-    if current_user.plan != 'studio':
-        current_user.credits -= 1
-    
-    # Sauvegarde en base
-    mastered = MasteredFile(
-        user_id=current_user.id,
-        original_filename=original_filename,
-        processed_filename=processed_filename,
-        preset_used=preset_name,
-        created_at=datetime.utcnow(),
-        file_path=output_path,
-        file_size=os.path.getsize(output_path),
-        duration=duration
-    )
-    db.session.add(mastered)
+    data = {
+        'success': True,
+        'job_id': job.id,
+        'status': job.status,
+        'status_url': url_for('api.get_job', job_id=job.id)
+    }
+    if job.profile:
+        data['profile_url'] = url_for('admin.download_job_profile', job_id=job.id)
+    return jsonify(data), 202
+
+@api_bp.route('/api/uploads', methods=['OPTIONS'])
+def upload_options():
+    response = tus_response(Response(status=204))
+    response.headers['Tus-Version'] = TUS_VERSION
+    response.headers['Tus-Extension'] = 'creation,checksum,termination'
+    response.headers['Tus-Max-Size'] = str(MAX_UPLOAD_BYTES)
+    response.headers['Tus-Checksum-Algorithm'] = 'sha256'
+    return response
+
+@api_bp.route('/api/uploads', methods=['POST'])
+@login_required
+def create_upload():
+    # Longueur et nom : en-têtes tus (Upload-Length, Upload-Metadata) ou JSON
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename') or parse_metadata(request.headers.get('Upload-Metadata')).get('filename')
+    length = data.get('length', request.headers.get('Upload-Length'))
+    try:
+        length = int(length)
+    except (TypeError, ValueError):
+        return tus_response(jsonify({'success': False, 'message': 'Missing upload length'})), 400
+    if not filename or not allowed_file(filename, ALLOWED_EXTENSIONS):
+        return tus_response(jsonify({'success': False, 'message': 'Invalid file type'})), 400
+    if length <= 0 or length > MAX_UPLOAD_BYTES:
+        return tus_response(jsonify({'success': False, 'message': 'File too large'})), 413
+
+    upload = Upload(user_id=current_user.id, original_filename=filename, length=length)
+    upload.id = uuid.uuid4().hex
+    safe_name = secure_filename(filename)
+    if not allowed_file(safe_name, ALLOWED_EXTENSIONS):
+        safe_name = f"audio.{filename.rsplit('.', 1)[1].lower()}"
+    upload.stored_filename = f"{upload.id}_{safe_name}"
+    os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+    open(part_path(upload, UPLOAD_FOLDER), 'wb').close()
+    db.session.add(upload)
     db.session.commit()
 
+    response = jsonify({'success': True, **upload.to_dict()})
+    response.headers['Location'] = url_for('api.upload_status', upload_id=upload.id)
+    return tus_response(response, upload), 201
+
+def get_upload(upload_id):
+    upload = db.session.get(Upload, upload_id)
+    if upload is None or upload.user_id != current_user.id:
+        return None
+    return upload
+
+@api_bp.route('/api/uploads/<upload_id>', methods=['HEAD', 'GET'])
+@login_required
+def upload_status(upload_id):
+    upload = get_upload(upload_id)
+    if upload is None:
+        return tus_response(jsonify({'success': False, 'message': 'Upload not found'})), 404
+    return tus_response(jsonify({'success': True, **upload.to_dict()}), upload)
+
+@api_bp.route('/api/uploads/<upload_id>', methods=['PATCH'])
+@login_required
+def upload_chunk(upload_id):
+    upload = get_upload(upload_id)
+    if upload is None:
+        return tus_response(jsonify({'success': False, 'message': 'Upload not found'})), 404
+    if upload.is_complete:
+        return tus_response(jsonify({'success': False, 'message': 'Upload already complete'}), upload), 409
+    if request.headers.get('Upload-Offset', type=int) != upload.offset:
+        return tus_response(jsonify({'success': False, 'message': 'Offset mismatch'}), upload), 409
+    length = request.content_length
+    if length is None:
+        return tus_response(jsonify({'success': False, 'message': 'Missing Content-Length'}), upload), 411
+    if length > MAX_CHUNK_BYTES or upload.offset + length > upload.length:
+        return tus_response(jsonify({'success': False, 'message': 'Chunk too large'}), upload), 413
+    try:
+        checksum = parse_checksum(request.headers.get('Upload-Checksum'))
+    except ValueError as e:
+        return tus_response(jsonify({'success': False, 'message': str(e)}), upload), 400
+
+    # Écrit le morceau au fil de la lecture, jamais le corps entier en mémoire
+    try:
+        offset, sha256 = append_chunk(upload, UPLOAD_FOLDER, request.stream, length, checksum)
+    except UploadLocked:
+        return tus_response(jsonify({'success': False, 'message': 'Upload in progress'}), upload), 423
+    except ChecksumMismatch:
+        return tus_response(jsonify({'success': False, 'message': 'Checksum mismatch'}), upload), 460
+
+    upload.offset = offset
+    if sha256 is not None:
+        os.replace(part_path(upload, UPLOAD_FOLDER), os.path.join(UPLOAD_FOLDER, upload.stored_filename))
+        upload.sha256 = sha256
+        upload.completed_at = datetime.utcnow()
+    db.session.commit()
+    return tus_response(Response(status=204), upload)
+
+@api_bp.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def delete_upload(upload_id):
+    upload = get_upload(upload_id)
+    if upload is None:
+        return tus_response(jsonify({'success': False, 'message': 'Upload not found'})), 404
+    for path in (part_path(upload, UPLOAD_FOLDER), os.path.join(UPLOAD_FOLDER, upload.stored_filename)):
+        if os.path.exists(path):
+            os.remove(path)
+    forget(upload.id)
+    db.session.delete(upload)
+    db.session.commit()
+    return tus_response(Response(status=204))
+
+@api_bp.route('/api/batch', methods=['POST'])
+@login_required
+def process_batch():
+    data = request.get_json()
+    requested = data.get('items')
+    if not isinstance(requested, list) or not requested:
+        return jsonify({'success': False, 'message': 'Missing items'}), 400
+    if len(requested) > BATCH_MAX_ITEMS:
+        return jsonify({'success': False, 'message': f'At most {BATCH_MAX_ITEMS} items per batch'}), 400
+    error = idempotency_key_error()
+    if error:
+        return error
+    idempotency_key = request.headers.get('Idempotency-Key')
+    if idempotency_key:
+        existing = ProcessingBatch.query.filter_by(user_id=current_user.id, idempotency_key=idempotency_key).first()
+        if existing is not None:
+            return replayed_batch(existing)
+
+    timestamp = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    items, presets, digests = [], {}, {}
+    for entry in requested:
+        filename = entry.get('filename') if isinstance(entry, dict) else None
+        preset_name = entry.get('preset') if isinstance(entry, dict) else None
+        if not filename or not preset_name:
+            return jsonify({'success': False, 'message': 'Missing filename or preset'}), 400
+        resolved = resolve_preset(preset_name, current_user)
+        if not resolved:
+            return jsonify({'success': False, 'message': f'Invalid preset: {preset_name}'}), 400
+        preset = resolved.settings
+        input_path = os.path.join(UPLOAD_FOLDER, filename)
+        if not os.path.exists(input_path):
+            return jsonify({'success': False, 'message': f'File not found: {filename}'}), 404
+
+        # Un nom par (fichier, preset) : le même titre peut sortir en plusieurs presets
+        processed_filename = mastered_filename(f"mastered_{timestamp}_{preset_name.lower()}_", filename)
+        if any(item['processed_filename'] == processed_filename for item in items):
+            return jsonify({'success': False, 'message': f'Duplicate item: {filename} / {preset_name}'}), 400
+        output_path = os.path.join(PROCESSED_FOLDER, processed_filename)
+        if filename not in digests:
+            digests[filename] = input_digest(filename, input_path)
+        presets[preset_name] = preset
+        items.append({
+            'input_path': input_path,
+            'output_path': output_path,
+            'processed_filename': processed_filename,
+            'preset_name': preset_name,
+            'original_filename': entry.get('original_filename') or filename,
+            'input_hash': digests[filename],
+            'cache_key': result_cache.key_for(digests[filename], preset, get_export_format(output_path)),
+            'preset_settings': preset if resolved.custom else None,
+        })
+
+    # Un crédit par rendu, réservés ensemble avec le lot
+    reserved = reserve_credits(current_user, len(items))
+    if reserved is None:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Not enough credits.'}), 403
+    try:
+        batch = create_batch(current_user, items, credits_per_job=1 if reserved else 0,
+                             idempotency_key=idempotency_key)
+    except IntegrityError:
+        db.session.rollback()
+        if not idempotency_key:
+            raise
+        return replayed_batch(ProcessingBatch.query.filter_by(
+            user_id=current_user.id, idempotency_key=idempotency_key).first_or_404())
+    for job in list(batch.jobs):
+        cached = result_cache.fetch(job.cache_key, job.output_path)
+        if cached is not None:
+            finalize_job(job.id, duration=cached.get('duration'), loudness=cached.get('loudness'))
+
+    try:
+        job_queue.enqueue_batch(batch, presets)
+    except Exception as e:
+        for job in batch.jobs:
+            if not job.is_finished:
+                finalize_job(job.id, error=e)
+        return jsonify({'success': False, 'message': f'Processing error: {str(e)}'}), 500
+
     return jsonify({
         'success': True,
-        'file_id': mastered.id,
-        'processed_filename': processed_filename,
-        'credits_remaining': current_user.credits
-    })
+        'batch_id': batch.id,
+        'status': batch.status,
+        'status_url': url_for('api.get_batch', batch_id=batch.id),
+        'download_url': url_for('api.download_batch', batch_id=batch.id)
+    }), 202
+
+@api_bp.route('/api/batch/<batch_id>')
+@login_required
+def get_batch(batch_id):
+    batch = db.session.get(ProcessingBatch, batch_id)
+    if batch is None or batch.user_id != current_user.id:
+        return jsonify({'success': False, 'message': 'Batch not found'}), 404
+    data = batch.to_dict()
+    data['success'] = True
+    data['credits_remaining'] = current_user.credits
+    return jsonify(data)
+
+@api_bp.route('/api/batch/<batch_id>/download')
+@login_required
+def download_batch(batch_id):
+    batch = db.session.get(ProcessingBatch, batch_id)
+    if batch is None or batch.user_id != current_user.id:
+        return jsonify({'success': False, 'message': 'Batch not found'}), 404
+    if batch.status != 'finished':
+        return jsonify({'success': False, 'message': 'Batch still processing'}), 409
+
+    files, file_ids = [], []
+    for job in batch.jobs:
+        if job.mastered_file is None:
+            continue
+        file_ids.append(job.mastered_file.id)
+        files.append((job.mastered_file.file_path, job.mastered_file.processed_filename))
+        files.extend((export.file_path, export.processed_filename) for export in job.mastered_file.exports)
+    if file_ids:
+        MasteredFile.record_downloads(file_ids)
+        db.session.commit()
+
+    # Archive produite au fil de l'envoi, sans fichier temporaire
+    response = Response(stream_with_context(stream_zip(files)), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename=masterify_{batch.id}.zip'
+    return response
+
+@api_bp.route('/api/preview', methods=['POST'])
+@login_required
+def preview_track():
+    data = request.get_json()
+    filename = data.get('filename')
+    preset_name = data.get('preset')
+    if not filename or not preset_name:
+        return jsonify({'success': False, 'message': 'Missing filename or preset'}), 400
+    input_path = os.path.join(UPLOAD_FOLDER, filename)
+    if not os.path.exists(input_path):
+        return jsonify({'success': False, 'message': 'File not found'}), 404
+    resolved = resolve_preset(preset_name, current_user)
+    if not resolved:
+        return jsonify({'success': False, 'message': 'Invalid preset'}), 400
+    preset = resolved.settings
+    try:
+        start = max(0.0, float(data.get('start', 0.0)))
+        duration = min(max(float(data.get('duration', PREVIEW_SECONDS)), 0.1), MAX_PREVIEW_SECONDS)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid preview window'}), 400
+
+    # Extrait gratuit, gardé par (fichier, preset, fenêtre) : changer de preset est instantané
+    input_hash = input_digest(filename, input_path)
+    cache_key = result_cache.key_for(input_hash, preset, PREVIEW_FORMAT, PREVIEW_BITRATE,
+                                     window=(start, duration))
+    cached_path = result_cache.lookup(cache_key, PREVIEW_FORMAT)
+    if cached_path is not None:
+        response = send_file(cached_path, mimetype='audio/mpeg', max_age=3600)
+    else:
+        fd, preview_path = tempfile.mkstemp(suffix=f'.{PREVIEW_FORMAT}')
+        os.close(fd)
+        try:
+            process_audio(input_path, preview_path, preset, excerpt=(start, duration),
+                          levels_path=result_cache.levels_path(input_hash))
+            result_cache.store(cache_key, preview_path)
+            with open(preview_path, 'rb') as f:
+                clip = f.read()
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        except Exception as e:
+            return jsonify({'success': False, 'message': f'Preview error: {str(e)}'}), 500
+        finally:
+            os.remove(preview_path)
+        response = send_file(io.BytesIO(clip), mimetype='audio/mpeg', max_age=3600)
+    response.cache_control.public = False
+    response.cache_control.private = True
+    return response
+
+def get_own_preset(preset_id):
+    preset = db.session.get(Preset, preset_id)
+    if preset is None or preset.user_id != current_user.id:
+        return None
+    return preset
+
+def read_preset_fields(data, preset=None):
+    """Checked (name, description, settings) of a create/update request, or an error message"""
+    name = data.get('name', preset.name if preset else None)
+    description = data.get('description', preset.description if preset else None)
+    settings = data.get('settings', preset.settings if preset else None)
+    if not isinstance(name, str) or not name.strip() or len(name.strip()) > 50:
+        return None, 'Name must be 1 to 50 characters'
+    if description is not None and (not isinstance(description, str) or len(description) > 255):
+        return None, 'Description must be at most 255 characters'
+    try:
+        settings = validate_settings(settings)
+    except PresetError as e:
+        return None, str(e)
+    return (name.strip(), description, settings), None
+
+@api_bp.route('/api/presets')
+@login_required
+def list_presets():
+    presets = [
+        {'preset': key, 'name': p['name'], 'description': p['description'], 'custom': False}
+        for key, p in get_all_presets().items()
+    ]
+    own = Preset.query.filter_by(user_id=current_user.id).order_by(Preset.name).all()
+    presets.extend(preset.to_dict() for preset in own)
+    return jsonify({'success': True, 'presets': presets, 'can_edit': can_edit_presets(current_user)})
+
+@api_bp.route('/api/presets/schema')
+def get_preset_schema():
+    # Mêmes règles que la validation côté serveur (audio_processing.chain)
+    return jsonify(preset_schema())
+
+@api_bp.route('/api/presets', methods=['POST'])
+@login_required
+def create_preset():
+    if not can_edit_presets(current_user):
+        return jsonify({'success': False, 'message': 'Custom presets require a Pro or Studio plan'}), 403
+    fields, error = read_preset_fields(request.get_json(silent=True) or {})
+    if error:
+        return jsonify({'success': False, 'message': error}), 400
+    if Preset.query.filter_by(user_id=current_user.id).count() >= MAX_PRESETS_PER_USER:
+        return jsonify({'success': False, 'message': f'At most {MAX_PRESETS_PER_USER} custom presets'}), 400
+
+    name, description, settings = fields
+    preset = Preset(user_id=current_user.id, name=name, description=description)
+    preset.settings = settings
+    db.session.add(preset)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'A preset named {name!r} already exists'}), 409
+    return jsonify({'success': True, 'preset': preset.to_dict()}), 201
+
+@api_bp.route('/api/presets/<int:preset_id>')
+@login_required
+def get_preset(preset_id):
+    preset = get_own_preset(preset_id)
+    if preset is None:
+        return jsonify({'success': False, 'message': 'Preset not found'}), 404
+    return jsonify({'success': True, 'preset': preset.to_dict()})
+
+@api_bp.route('/api/presets/<int:preset_id>', methods=['PUT', 'PATCH'])
+@login_required
+def update_preset(preset_id):
+    if not can_edit_presets(current_user):
+        return jsonify({'success': False, 'message': 'Custom presets require a Pro or Studio plan'}), 403
+    preset = get_own_preset(preset_id)
+    if preset is None:
+        return jsonify({'success': False, 'message': 'Preset not found'}), 404
+    # PATCH garde les champs absents, PUT remplace aussi les réglages
+    data = request.get_json(silent=True) or {}
+    if request.method == 'PUT' and 'settings' not in data:
+        return jsonify({'success': False, 'message': 'Missing settings'}), 400
+    fields, error = read_preset_fields(data, preset)
+    if error:
+        return jsonify({'success': False, 'message': error}), 400
+
+    name, description, settings = fields
+    # Nouvelle version si les réglages changent : l'ancienne entrée du cache n'est plus lue
+    preset.settings = settings
+    preset.name, preset.description = name, description
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': f'A preset named {name!r} already exists'}), 409
+    return jsonify({'success': True, 'preset': preset.to_dict()})
+
+@api_bp.route('/api/presets/<int:preset_id>', methods=['DELETE'])
+@login_required
+def delete_preset(preset_id):
+    preset = get_own_preset(preset_id)
+    if preset is None:
+        return jsonify({'success': False, 'message': 'Preset not found'}), 404
+    # Les jobs en attente gardent leur copie des réglages
+    db.session.delete(preset)
+    db.session.commit()
+    return jsonify({'success': True})
+
+@api_bp.route('/api/analyze', methods=['POST'])
+@login_required
+def analyze_track():
+    data = request.get_json()
+    filename = data.get('filename')
+    if not filename:
+        return jsonify({'success': False, 'message': 'Missing filename'}), 400
+    input_path = os.path.join(UPLOAD_FOLDER, filename)
+    if not os.path.exists(input_path):
+        return jsonify({'success': False, 'message': 'File not found'}), 404
+
+    # Analyse conservée par hash du fichier : une seconde suggestion ne coûte rien
+    analysis_path = result_cache.analysis_path(input_digest(filename, input_path))
+    suggested = analyze_and_suggest_preset(input_path, analysis_path)
+    return jsonify({'success': True, 'suggested_preset': suggested})
+
+@api_bp.route('/api/jobs')
+@login_required
+def list_jobs():
+    jobs = ProcessingJob.query.filter_by(user_id=current_user.id) \
+        .order_by(ProcessingJob.created_at.desc()).limit(50).all()
+    return jsonify({'success': True, 'jobs': [job.to_dict() for job in jobs]})
+
+@api_bp.route('/api/jobs/<job_id>')
+@login_required
+def get_job(job_id):
+    job = db.session.get(ProcessingJob, job_id)
+    if job is None or job.user_id != current_user.id:
+        return jsonify({'success': False, 'message': 'Job not found'}), 404
+    data = job.to_dict()
+    data['success'] = job.status != 'failed'
+    data['credits_remaining'] = current_user.credits
+    return jsonify(data)
 
 @api_bp.route('/api/download/<int:file_id>')
 @login_required
@@ -72,9 +672,19 @@ def download_file(file_id):
     mastered = MasteredFile.query.get_or_404(file_id)
     if mastered.user_id != current_user.id:
         return jsonify({'success': False, 'message': 'Unauthorized'}), 403
-    mastered.increment_download()
-    db.session.commit()
-    return send_file(mastered.file_path, as_attachment=True, download_name=mastered.processed_filename)
+    # ?format=wav : un des formats exportés avec le fichier
+    file_path, download_name = mastered.file_path, mastered.processed_filename
+    export_format = request.args.get('format')
+    if export_format and export_format != get_export_format(file_path):
+        export = next((e for e in mastered.exports if e.format == export_format), None)
+        if export is None:
+            return jsonify({'success': False, 'message': 'Format not available'}), 404
+        file_path, download_name = export.file_path, export.processed_filename
+    # Compteur incrémenté en SQL (pas de lecture-écriture), une fois par téléchargement
+    if is_new_download():
+        MasteredFile.record_downloads([mastered.id])
+        db.session.commit()
+    return send_download(file_path, download_name)
 
 @api_bp.route('/api/waveform/<filename>')
 @login_required
@@ -82,5 +692,31 @@ def get_waveform(filename):
     file_path = os.path.join(PROCESSED_FOLDER, filename)
     if not os.path.exists(file_path):
         return jsonify({'success': False, 'message': 'File not found'}), 404
-    waveform = generate_waveform_data(file_path, num_points=200)
-    return jsonify({'success': True, 'waveform': waveform}) 
\ No newline at end of file
+    num_points = min(max(request.args.get('num_points', 200, type=int), 1), 10000)
+
+    # ETag tiré du fichier de peaks (chemin, date, taille) : un 304 ne lit rien
+    peaks_path = peaks_path_for(file_path)
+    if not os.path.exists(peaks_path):
+        load_peaks(file_path)  # Fichier traité avant les peaks : construit une fois
+    stat = os.stat(peaks_path)
+    path_tag = hashlib.sha1(peaks_path.encode('utf-8')).hexdigest()[:12]
+    etag = f'{path_tag}-{stat.st_mtime_ns:x}-{stat.st_size:x}-{num_points}'
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+    else:
+        response = jsonify({'success': True, 'waveform': load_peaks(file_path).waveform(num_points)})
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.max_age = 86400
+    return response
+
+@api_bp.route('/metrics')
+def metrics():
+    # Format texte Prometheus ; jeton Bearer exigé si METRICS_TOKEN est défini
+    if not job_metrics.enabled:
+        return jsonify({'success': False, 'message': 'Metrics disabled'}), 404
+    if job_metrics.token:
+        expected = f'Bearer {job_metrics.token}'
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+            return jsonify({'success': False, 'message': 'Unauthorized'}), 401
+    return Response(job_metrics.render(), content_type=METRICS_CONTENT_TYPE)
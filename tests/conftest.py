@@ -0,0 +1,59 @@
+"""
+Shared fixtures
+
+The Flask app is created when app.py is imported, from the environment, so
+the database, the result cache and the metrics file are pointed at a
+temporary directory before the first import.
+"""
+import os
+import tempfile
+
+import pytest
+
+_RUNTIME_DIR = tempfile.mkdtemp(prefix='masterify-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_RUNTIME_DIR, 'test.db')}"
+os.environ['RESULT_CACHE_DIR'] = os.path.join(_RUNTIME_DIR, 'result_cache')
+os.environ['METRICS_FILE'] = ''
+os.environ['PROFILER_ENABLED'] = ''
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app as flask_app
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return flask_app
+
+
+@pytest.fixture
+def db(app):
+    """Empty tables, inside an app context"""
+    from extensions import db as database
+    with app.app_context():
+        database.drop_all()
+        database.create_all()
+        yield database
+        database.session.remove()
+
+
+@pytest.fixture
+def make_user(db):
+    from models import User
+
+    def make(email='user@example.com', credits=3, plan='free'):
+        user = User(username=email.split('@')[0], email=email, credits=credits, plan=plan)
+        user.set_password('secret')
+        db.session.add(user)
+        db.session.commit()
+        return user
+    return make
+
+
+@pytest.fixture
+def client(app, db, make_user, tmp_path, monkeypatch):
+    """Test client logged in as a user, running in a temporary working directory"""
+    monkeypatch.chdir(tmp_path)
+    make_user()
+    test_client = app.test_client()
+    response = test_client.post('/auth/login', json={'email': 'user@example.com', 'password': 'secret'})
+    assert response.status_code == 200
+    return test_client
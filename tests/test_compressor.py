@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from audio_processing.dynamics import Compressor, compress, time_constant
+
+SAMPLE_RATE = 44100
+
+
+def bursts(frames=20000, channels=2, seed=0):
+    """Noise with loud and quiet sections, so the envelope attacks and releases"""
+    rng = np.random.default_rng(seed)
+    samples = rng.uniform(-1.0, 1.0, (frames, channels))
+    envelope = np.where((np.arange(frames) // 2500) % 2 == 0, 0.9, 0.05)
+    return samples * envelope[:, np.newaxis]
+
+
+def reference_compress(samples, threshold_db, ratio, attack_ms, release_ms, stereo_link=True,
+                       makeup_db=0.0):
+    """Textbook per-sample compressor: peak-hold with release, then one-pole attack"""
+    attack = time_constant(attack_ms, SAMPLE_RATE)
+    release = time_constant(release_ms, SAMPLE_RATE)
+    slope = 1.0 - 1.0 / ratio
+    detectors = 1 if stereo_link else samples.shape[1]
+    held = np.zeros(detectors)
+    smoothed = np.zeros(detectors)
+    out = np.empty_like(samples)
+    for n, frame in enumerate(samples):
+        levels = np.array([np.max(np.abs(frame))]) if stereo_link else np.abs(frame)
+        with np.errstate(divide='ignore'):
+            levels_db = np.maximum(20 * np.log10(levels), -120.0)
+        reduction = np.maximum(levels_db - threshold_db, 0.0) * slope
+        held = np.maximum(reduction, release * held)
+        smoothed = (1 - attack) * held + attack * smoothed
+        out[n] = frame * 10 ** ((makeup_db - smoothed) / 20)
+    return out
+
+
+@pytest.mark.parametrize('stereo_link', [True, False])
+def test_compressor_matches_per_sample_reference(stereo_link):
+    samples = bursts()
+    expected = reference_compress(samples, -18.0, 4.0, 5.0, 80.0, stereo_link=stereo_link, makeup_db=2.0)
+
+    # Small blocks: the envelope state has to carry over block boundaries
+    compressor = Compressor(-18.0, 4.0, 5.0, 80.0, SAMPLE_RATE, channels=2, stereo_link=stereo_link,
+                            makeup_db=2.0, block_size=1000)
+    actual = compressor.process(samples.copy())
+
+    np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-12)
+
+
+def test_compressor_float32_close_to_reference():
+    samples = bursts()
+    expected = reference_compress(samples, -12.0, 8.0, 1.0, 50.0)
+    actual = compress(samples.astype(np.float32), SAMPLE_RATE, -12.0, 8.0, 1.0, 50.0)
+
+    assert actual.dtype == np.float32
+    np.testing.assert_allclose(actual, expected, atol=1e-5)
+
+
+def test_compressor_leaves_signal_below_threshold_untouched():
+    samples = bursts() * 0.01
+    np.testing.assert_allclose(compress(samples.copy(), SAMPLE_RATE, -10.0, 4.0, 5.0, 50.0), samples)
+
+
+def test_compressor_rejects_expansion_ratio():
+    with pytest.raises(ValueError):
+        Compressor(-10.0, 0.5, 5.0, 50.0, SAMPLE_RATE)
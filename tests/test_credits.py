@@ -0,0 +1,56 @@
+import threading
+
+from models import User
+from utils.credits import refund_credits, reserve_credits
+
+
+def test_reserve_and_refund(db, make_user):
+    user = make_user(credits=3)
+
+    assert reserve_credits(user, 2) == 2
+    assert reserve_credits(user, 2) is None
+    db.session.commit()
+    assert user.credits == 1
+
+    refund_credits(user.id, 2)
+    db.session.commit()
+    assert user.credits == 3
+
+
+def test_studio_plan_is_not_charged(db, make_user):
+    user = make_user(credits=0, plan='studio')
+    assert reserve_credits(user, 5) == 0
+    assert user.credits == 0
+
+
+def test_concurrent_reservations_never_overdraw(app, db, make_user):
+    user_id = make_user(credits=3).id
+    requests = 10
+    barrier = threading.Barrier(requests)
+    results = []
+    errors = []
+
+    def reserve():
+        # One app context, so one session and connection, per request
+        with app.app_context():
+            try:
+                user = db.session.get(User, user_id)
+                barrier.wait()
+                reserved = reserve_credits(user)
+                db.session.commit()
+                results.append(reserved)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=reserve) for _ in range(requests)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert sorted(results, key=lambda r: r is None) == [1, 1, 1] + [None] * 7
+    db.session.expire_all()
+    assert db.session.get(User, user_id).credits == 0
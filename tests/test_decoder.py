@@ -0,0 +1,47 @@
+import subprocess
+
+import numpy as np
+import pytest
+from pydub import AudioSegment
+from pydub.exceptions import CouldntDecodeError
+
+from audio_processing.decoder import open_reader, read_audio, sniff_format
+
+
+def encode(tmp_path, name, *args):
+    """One second of a 440 Hz stereo tone encoded by ffmpeg"""
+    path = str(tmp_path / name)
+    subprocess.run([AudioSegment.converter, '-v', 'error', '-f', 'lavfi', '-i', 'sine=frequency=440:duration=1',
+                    '-ac', '2', '-ar', '44100', *args, path], check=True)
+    return path
+
+
+def test_sniffed_containers(tmp_path):
+    assert sniff_format(encode(tmp_path, 'tone.flac')) == 'flac'
+    assert sniff_format(encode(tmp_path, 'tone.aiff')) == 'aiff'
+    assert sniff_format(encode(tmp_path, 'tone.wav')) == 'wav'
+
+
+def test_unrecognised_container_is_probed_by_ffmpeg(tmp_path):
+    # Sun audio: not in sniff_format's list, but ffmpeg decodes it
+    path = encode(tmp_path, 'tone.au')
+    assert sniff_format(path) is None
+
+    samples, sample_rate = read_audio(path)
+    expected, _ = read_audio(encode(tmp_path, 'tone.wav'))
+    assert sample_rate == 44100
+    np.testing.assert_allclose(samples, expected, atol=1e-4)
+
+    with open_reader(path, block_frames=10000) as reader:
+        assert sum(len(block) for block in reader) == 44100
+
+
+def test_undecodable_file_raises(tmp_path):
+    path = tmp_path / 'noise.mp3'
+    path.write_bytes(b'not audio at all' * 64)
+
+    with pytest.raises(CouldntDecodeError):
+        read_audio(str(path))
+    with pytest.raises(CouldntDecodeError):
+        with open_reader(str(path)) as reader:
+            list(reader)
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from scipy.signal import sosfreqz
+
+from audio_processing.eq import (Equalizer, compile_eq, high_shelf, low_shelf, parse_band_frequency,
+                                 peaking)
+
+SAMPLE_RATE = 48000
+
+
+def response_db(section, frequencies):
+    """Magnitude response in dB of second-order sections at frequencies in Hz"""
+    _, response = sosfreqz(np.atleast_2d(section), worN=np.asarray(frequencies, dtype=float), fs=SAMPLE_RATE)
+    return 20 * np.log10(np.abs(response))
+
+
+@pytest.mark.parametrize('gain_db', [6.0, -4.5])
+def test_peaking_gain_at_center_and_flat_far_away(gain_db):
+    section = peaking(1000, gain_db, SAMPLE_RATE)
+    center, dc, nyquist = response_db(section, [1000, 0, SAMPLE_RATE / 2])
+
+    assert center == pytest.approx(gain_db, abs=1e-9)
+    assert dc == pytest.approx(0.0, abs=1e-9)
+    assert nyquist == pytest.approx(0.0, abs=1e-9)
+
+
+@pytest.mark.parametrize('gain_db', [3.0, -6.0])
+def test_low_shelf_gain_below_half_gain_at_corner(gain_db):
+    section = low_shelf(200, gain_db, SAMPLE_RATE)
+    dc, corner, nyquist = response_db(section, [0, 200, SAMPLE_RATE / 2])
+
+    assert dc == pytest.approx(gain_db, abs=1e-9)
+    assert corner == pytest.approx(gain_db / 2, abs=1e-9)
+    assert nyquist == pytest.approx(0.0, abs=1e-6)
+
+
+@pytest.mark.parametrize('gain_db', [2.0, -3.0])
+def test_high_shelf_gain_above_half_gain_at_corner(gain_db):
+    section = high_shelf(8000, gain_db, SAMPLE_RATE)
+    dc, corner, nyquist = response_db(section, [0, 8000, SAMPLE_RATE / 2])
+
+    assert dc == pytest.approx(0.0, abs=1e-9)
+    assert corner == pytest.approx(gain_db / 2, abs=1e-9)
+    assert nyquist == pytest.approx(gain_db, abs=1e-9)
+
+
+def test_sections_are_normalized():
+    for section in (peaking(1000, 3.0, SAMPLE_RATE), low_shelf(100, 3.0, SAMPLE_RATE),
+                    high_shelf(10000, 3.0, SAMPLE_RATE)):
+        assert section[3] == 1.0
+
+
+def test_compile_eq_band_layout():
+    sos = compile_eq({'10kHz': 2.0, '60Hz': 3.0, '1kHz': 0, '400Hz': -1.0}, SAMPLE_RATE)
+
+    # Sorted by frequency, zero gains skipped: low shelf, peaking, high shelf
+    expected = [low_shelf(60, 3.0, SAMPLE_RATE), peaking(400, -1.0, SAMPLE_RATE),
+                high_shelf(10000, 2.0, SAMPLE_RATE)]
+    np.testing.assert_allclose(sos, expected)
+
+
+def test_compile_eq_keeps_air_band_below_nyquist():
+    sos = compile_eq({'100Hz': 0.0, '30kHz': 2.0}, 44100)
+    np.testing.assert_allclose(sos, [high_shelf(0.45 * 44100, 2.0, 44100)])
+
+
+def test_compile_eq_flat():
+    assert compile_eq({'100Hz': 0, '1kHz': 0.0}, SAMPLE_RATE).shape == (0, 6)
+    assert Equalizer.from_bands({'100Hz': 0}, SAMPLE_RATE).is_flat
+
+
+@pytest.mark.parametrize('band, frequency', [('100Hz', 100.0), ('10kHz', 10000.0), (' 2.5 khz ', 2500.0),
+                                             (440, 440.0)])
+def test_parse_band_frequency(band, frequency):
+    assert parse_band_frequency(band) == frequency
+
+
+def test_parse_band_frequency_rejects_garbage():
+    with pytest.raises(ValueError):
+        parse_band_frequency('loud')
+
+
+def test_equalizer_in_chunks_matches_one_pass():
+    rng = np.random.default_rng(1)
+    samples = rng.standard_normal((10000, 2)).astype(np.float32)
+    bands = {'60Hz': 3.0, '1kHz': -2.0, '12kHz': 4.0}
+
+    whole = Equalizer.from_bands(bands, SAMPLE_RATE).process(samples.copy())
+    chunked = samples.copy()
+    equalizer = Equalizer(compile_eq(bands, SAMPLE_RATE), block_size=777)
+    equalizer.process(chunked)
+
+    np.testing.assert_allclose(chunked, whole, atol=1e-6)
@@ -0,0 +1,90 @@
+import pytest
+
+from models import MasteredFile, ProcessingJob
+from utils.credits import reserve_credits
+from utils.jobs import create_job, finalize_job, job_queue
+
+
+@pytest.fixture
+def user(make_user):
+    return make_user(credits=3)
+
+
+@pytest.fixture
+def job(db, user, tmp_path):
+    """A queued job holding one reserved credit"""
+    reserved = reserve_credits(user)
+    return create_job(user, str(tmp_path / 'input.wav'), str(tmp_path / 'output.wav'), 'mastered_input.wav',
+                      'Balanced', original_filename='input.wav', credits_reserved=reserved)
+
+
+def test_failed_job_is_refunded(db, user, job):
+    assert user.credits == 2
+
+    finalize_job(job.id, error='decoder crashed')
+
+    assert job.status == 'failed'
+    assert job.error == 'Processing error: decoder crashed'
+    assert job.credits_reserved == 0
+    assert user.credits == 3
+
+
+def test_failure_reported_twice_is_refunded_once(db, user, job):
+    finalize_job(job.id, error='first')
+    finalize_job(job.id, error='second')
+
+    assert job.error == 'Processing error: first'
+    assert user.credits == 3
+
+
+def test_missing_output_fails_and_refunds(db, user, job):
+    finalize_job(job.id, duration=1.0)
+
+    assert job.status == 'failed'
+    assert 'Missing output' in job.error
+    assert user.credits == 3
+    assert MasteredFile.query.count() == 0
+
+
+def test_success_keeps_the_credit(db, user, job, tmp_path):
+    (tmp_path / 'output.wav').write_bytes(b'RIFF' + bytes(100))
+
+    finalize_job(job.id, duration=1.0)
+
+    assert job.status == 'succeeded'
+    assert job.credits_reserved == 1
+    assert user.credits == 2
+    assert job.mastered_file.file_size == 104
+    # A late failure report does not undo the result or refund it
+    finalize_job(job.id, error='late')
+    assert db.session.get(ProcessingJob, job.id).status == 'succeeded'
+    assert user.credits == 2
+
+
+def test_result_that_cannot_be_recorded_fails_the_job(db, user, tmp_path):
+    (tmp_path / 'output.wav').write_bytes(b'RIFF' + bytes(100))
+    # MasteredFile.original_filename is required
+    job = create_job(user, str(tmp_path / 'input.wav'), str(tmp_path / 'output.wav'), 'mastered_input.wav',
+                     'Balanced', credits_reserved=reserve_credits(user))
+
+    job_queue._record(job.id, duration=1.0)
+
+    job = db.session.get(ProcessingJob, job.id)
+    assert job.status == 'failed'
+    assert job.credits_reserved == 0
+    assert user.credits == 3
+    assert MasteredFile.query.count() == 0
+
+
+def test_jobs_left_by_a_restart_are_failed_and_refunded(db, user, job):
+    running = create_job(user, job.input_path, job.output_path, job.processed_filename, 'Balanced',
+                         original_filename='input.wav', credits_reserved=reserve_credits(user))
+    running.status = 'running'
+    db.session.commit()
+    assert user.credits == 1
+
+    assert job_queue.fail_orphaned_jobs() == 2
+
+    assert {job.status, running.status} == {'failed'}
+    assert user.credits == 3
+    assert job_queue.fail_orphaned_jobs() == 0
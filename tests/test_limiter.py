@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from scipy.signal import butter, resample_poly, sosfilt
+
+from audio_processing.dynamics import Limiter, TruePeakDetector, limit
+
+SAMPLE_RATE = 44100
+
+
+def bursts(frames=20000, channels=2, seed=0):
+    """Noise with loud and quiet sections, so the envelope attacks and releases"""
+    rng = np.random.default_rng(seed)
+    samples = rng.uniform(-1.0, 1.0, (frames, channels))
+    envelope = np.where((np.arange(frames) // 2500) % 2 == 0, 0.9, 0.05)
+    return samples * envelope[:, np.newaxis]
+
+
+def sine(frequency, level_db, seconds=1.0, channels=2):
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    tone = 10 ** (level_db / 20) * np.sin(2 * np.pi * frequency * t)
+    return np.repeat(tone[:, np.newaxis], channels, axis=1).astype(np.float32)
+
+
+@pytest.mark.parametrize('ceiling_db', [-1.0, -3.0])
+def test_limiter_keeps_true_peak_under_ceiling(ceiling_db):
+    # Hot noise band-limited to 16 kHz plus a sine at fs/8, whose inter-sample peaks exceed its samples
+    noise = sosfilt(butter(8, 16000, fs=SAMPLE_RATE, output='sos'), bursts(SAMPLE_RATE) * 8.0, axis=0)
+    samples = (noise + sine(SAMPLE_RATE / 8 + 7, 6.0)).astype(np.float32)
+    limited = limit(samples, SAMPLE_RATE, ceiling_db)
+
+    assert np.max(np.abs(limited)) <= 10 ** (ceiling_db / 20) + 1e-7
+    # True peak measured independently, with a long 4x interpolation filter
+    true_peak_db = 20 * np.log10(np.max(np.abs(resample_poly(limited, 4, 1, axis=0))))
+    assert true_peak_db <= ceiling_db + 0.05
+
+
+def test_limiter_ceiling_on_full_band_noise():
+    # Content up to Nyquist: the sample peak and the BS.1770 (48-tap) true peak stay under the ceiling
+    limited = limit((bursts(SAMPLE_RATE) * 4.0).astype(np.float32), SAMPLE_RATE, -1.0)
+
+    assert np.max(np.abs(limited)) <= 10 ** (-1.0 / 20) + 1e-7
+    detector = TruePeakDetector(channels=2)
+    peak = max(np.max(detector.process(limited)), np.max(detector.tail()))
+    assert 20 * np.log10(peak) <= -1.0 + 0.01
+
+
+def test_limiter_is_transparent_below_ceiling():
+    samples = sine(1000, -12.0)
+    limited = limit(samples.copy(), SAMPLE_RATE, -1.0)
+    np.testing.assert_allclose(limited, samples, atol=1e-6)
+
+
+def test_limiter_streamed_in_chunks_matches_whole_track():
+    samples = (bursts(30000) * 3.0).astype(np.float32)
+    whole = limit(samples.copy(), SAMPLE_RATE, -1.0)
+
+    limiter = Limiter(-1.0, SAMPLE_RATE, channels=2)
+    streamed = samples.copy()
+    for start in range(0, len(streamed), 4096):
+        limiter.process(streamed[start:start + 4096])
+    streamed = np.concatenate([streamed, limiter.flush()])[limiter.latency:]
+
+    np.testing.assert_allclose(streamed, whole, atol=1e-6)
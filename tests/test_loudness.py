@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from audio_processing.loudness import LoudnessMeter, measure_loudness
+
+
+def sine_997(level_db, sample_rate, seconds=20.0, channels=(0, 1)):
+    """997 Hz sine at a peak level in dBFS on the given channels of a stereo buffer"""
+    t = np.arange(int(sample_rate * seconds)) / sample_rate
+    samples = np.zeros((len(t), 2), dtype=np.float32)
+    for channel in channels:
+        samples[:, channel] = 10 ** (level_db / 20) * np.sin(2 * np.pi * 997 * t)
+    return samples
+
+
+@pytest.mark.parametrize('sample_rate', [44100, 48000])
+def test_stereo_sine_at_minus_23_dbfs_reads_minus_23_lufs(sample_rate):
+    # EBU Tech 3341, test 1
+    result = measure_loudness(sine_997(-23.0, sample_rate), sample_rate)
+
+    assert result['integrated_lufs'] == pytest.approx(-23.0, abs=0.1)
+    assert result['max_momentary_lufs'] == pytest.approx(-23.0, abs=0.1)
+    assert result['max_short_term_lufs'] == pytest.approx(-23.0, abs=0.1)
+    assert result['loudness_range'] == pytest.approx(0.0, abs=0.1)
+
+
+def test_full_scale_sine_on_one_channel_reads_minus_3_01_lufs():
+    # ITU-R BS.1770: a 0 dBFS 997 Hz sine on one channel is -3.01 LKFS
+    result = measure_loudness(sine_997(0.0, 48000, channels=(0,)), 48000)
+    assert result['integrated_lufs'] == pytest.approx(-3.01, abs=0.05)
+
+
+def test_true_peak_of_sine():
+    result = measure_loudness(sine_997(-6.0, 48000, seconds=2.0), 48000)
+    assert result['true_peak_db'] == pytest.approx(-6.0, abs=0.05)
+
+
+def test_silence_has_no_loudness():
+    result = measure_loudness(np.zeros((48000 * 2, 2), dtype=np.float32), 48000)
+
+    assert result['integrated_lufs'] is None
+    assert result['true_peak_db'] is None
+
+
+def test_meter_fed_in_chunks_matches_whole_buffer():
+    samples = sine_997(-18.0, 48000, seconds=10.0)
+    meter = LoudnessMeter(48000, channels=2, block_size=10000)
+    for start in range(0, len(samples), 12345):
+        meter.process(samples[start:start + 12345])
+
+    whole = measure_loudness(samples, 48000)
+    assert meter.result() == pytest.approx(whole)
+
+
+def test_reading_the_meter_has_no_side_effects():
+    samples = sine_997(-18.0, 48000, seconds=5.0)
+    meter = LoudnessMeter(48000, channels=2)
+    meter.process(samples[:100000])
+    first = meter.result()
+    assert meter.result() == first
+
+    meter.process(samples[100000:])
+    assert meter.result() == pytest.approx(measure_loudness(samples, 48000))
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+from audio_processing.buffer import AudioBuffer
+from audio_processing.decoder import read_audio
+from audio_processing.dynamics import Compressor, compress, limit
+from audio_processing.parallel import WARMUP_TIME_CONSTANTS, shared_stages, split_frames
+from audio_processing.presets import PRESETS
+from audio_processing.processor import process_audio
+
+SAMPLE_RATE = 44100
+WORKERS = 3
+# Parallel output matches the serial chain within this, at any frame
+TOLERANCE = 1e-4
+
+
+def music_like(seconds=10.0, seed=0):
+    """Stereo noise with loud and quiet passages of 0.7 s, loud across segment boundaries"""
+    rng = np.random.default_rng(seed)
+    frames = int(SAMPLE_RATE * seconds)
+    samples = rng.uniform(-1.0, 1.0, (frames, 2))
+    envelope = np.where((np.arange(frames) // int(0.7 * SAMPLE_RATE)) % 3 == 2, 0.05, 0.9)
+    return (samples * envelope[:, np.newaxis]).astype(np.float32)
+
+
+def boundaries(frames):
+    segments = split_frames(frames, WORKERS)
+    assert len(segments) == WORKERS  # Otherwise nothing runs in parallel
+    return [start for start, _ in segments[1:]]
+
+
+def run_parallel(samples, stage):
+    buffer = AudioBuffer(samples.copy(), SAMPLE_RATE)
+    with shared_stages(buffer, WORKERS) as pool:
+        stage(pool)
+    return buffer.samples
+
+
+def test_process_audio_with_workers_matches_serial(tmp_path):
+    input_path = str(tmp_path / 'input.wav')
+    wavfile.write(input_path, SAMPLE_RATE, music_like() * 0.5)
+
+    outputs = {}
+    for workers in (1, WORKERS):
+        output_path = str(tmp_path / f'output_{workers}.wav')
+        process_audio(input_path, output_path, PRESETS['clean'], streaming=False, workers=workers)
+        outputs[workers], _ = read_audio(output_path)
+
+    assert outputs[1].shape == outputs[WORKERS].shape
+    assert np.max(np.abs(outputs[WORKERS] - outputs[1])) <= TOLERANCE
+
+
+@pytest.mark.parametrize('release_ms', [50.0, 200.0])
+def test_compressor_segments_warm_up_at_boundaries(release_ms):
+    samples = music_like()
+    serial = compress(samples.copy(), SAMPLE_RATE, -20.0, 4.0, 5.0, release_ms)
+    parallel = run_parallel(samples, lambda pool: pool.compress(-20.0, 4.0, 5.0, release_ms))
+
+    assert np.max(np.abs(parallel - serial)) <= TOLERANCE
+    warmup = int(WARMUP_TIME_CONSTANTS * release_ms * SAMPLE_RATE / 1000.0)
+    for start in boundaries(len(samples)):
+        window = slice(start, start + warmup)
+        assert np.max(np.abs(parallel[window] - serial[window])) <= TOLERANCE
+        # Without the warm-up, a segment would start with no gain reduction
+        cold = Compressor(-20.0, 4.0, 5.0, release_ms, SAMPLE_RATE, channels=2).process(samples[window].copy())
+        assert np.max(np.abs(cold - serial[window])) > 100 * TOLERANCE
+
+
+def test_limiter_segments_warm_up_at_boundaries():
+    samples = music_like() * 4.0
+    serial = limit(samples.copy(), SAMPLE_RATE, -1.0)
+    parallel = run_parallel(samples, lambda pool: pool.limit(-1.0))
+
+    assert np.max(np.abs(parallel - serial)) <= TOLERANCE
+    for start in boundaries(len(samples)):
+        window = slice(start - SAMPLE_RATE // 10, start + SAMPLE_RATE // 10)
+        assert np.max(np.abs(parallel[window] - serial[window])) <= TOLERANCE
@@ -0,0 +1,34 @@
+from audio_processing.chain import compile_preset
+from audio_processing.presets import PRESETS
+from models import User
+from utils.presets import resolve_preset
+from utils.result_cache import result_cache
+
+SETTINGS = {'gain_db': 1.5, 'ratio': 3.0, 'ceiling_db': -1.0, 'eq_bands': {'100Hz': 2.0}}
+
+
+def test_name_and_description_do_not_change_the_compiled_preset_or_cache_key(app):
+    renamed = dict(PRESETS['clean'], name='Something else', description='Renamed')
+
+    assert compile_preset(renamed) is compile_preset(PRESETS['clean'])
+    with app.app_context():
+        assert result_cache.key_for('0' * 64, renamed, 'mp3') == result_cache.key_for('0' * 64, PRESETS['clean'], 'mp3')
+        assert result_cache.key_for('0' * 64, dict(renamed, gain_db=2.0), 'mp3') != \
+            result_cache.key_for('0' * 64, renamed, 'mp3')
+
+
+def test_renaming_a_custom_preset_keeps_its_cache_key(client, db):
+    user = User.query.filter_by(email='user@example.com').one()
+    user.plan = 'pro'
+    db.session.commit()
+
+    created = client.post('/api/presets', json={'name': 'Mine', 'settings': SETTINGS}).get_json()['preset']
+    before = resolve_preset(created['preset'], user)
+
+    response = client.patch(f"/api/presets/{created['id']}", json={'name': 'Renamed', 'description': 'New'})
+    assert response.status_code == 200
+    after = resolve_preset(created['preset'], user)
+
+    assert after.settings == before.settings == SETTINGS
+    assert after.compiled is before.compiled
+    assert result_cache.key_for('0' * 64, after.settings, 'wav') == result_cache.key_for('0' * 64, before.settings, 'wav')
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+from audio_processing import preview
+from audio_processing.presets import PRESETS
+
+SAMPLE_RATE = 44100
+
+
+@pytest.fixture
+def input_path(tmp_path):
+    t = np.arange(SAMPLE_RATE * 5) / SAMPLE_RATE
+    tone = 0.3 * np.sin(2 * np.pi * 440 * t).astype(np.float32)
+    path = str(tmp_path / 'input.wav')
+    wavfile.write(path, SAMPLE_RATE, np.stack([tone, tone], axis=1))
+    return path
+
+
+@pytest.fixture
+def measured(monkeypatch):
+    """Files passed to the whole-track measurement"""
+    calls = []
+    measure_input = preview.measure_input
+
+    def measure(file_path, *args, **kwargs):
+        calls.append(file_path)
+        return measure_input(file_path, *args, **kwargs)
+    monkeypatch.setattr(preview, 'measure_input', measure)
+    return calls
+
+
+def test_preset_without_normalization_decodes_only_the_excerpt(tmp_path, input_path, measured):
+    preset = dict(PRESETS['clean'], normalize=False)
+    levels_path = str(tmp_path / 'levels.json')
+
+    duration, _ = preview.render_preview(input_path, str(tmp_path / 'clip.mp3'), preset, start=2.0,
+                                         duration=1.0, levels_path=levels_path)
+
+    assert duration == pytest.approx(1.0)
+    assert measured == []
+
+
+@pytest.mark.parametrize('settings', [{'normalize': True}, {'normalize': False, 'target_lufs': -14.0}])
+def test_normalizing_preset_measures_the_track_once(tmp_path, input_path, measured, settings):
+    preset = dict(PRESETS['clean'], **settings)
+    levels_path = str(tmp_path / 'levels.json')
+
+    for name in ('first.mp3', 'second.mp3'):
+        preview.render_preview(input_path, str(tmp_path / name), preset, start=2.0, duration=1.0,
+                               levels_path=levels_path)
+
+    assert measured == [input_path]
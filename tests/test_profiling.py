@@ -0,0 +1,90 @@
+import os
+
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+from audio_processing.presets import PRESETS
+from models import ProcessingJob
+from utils import jobs
+from utils.profiling import job_profile_path, profile_call, profiler
+
+
+def busy(n):
+    return sum(np.sqrt(np.arange(n)).tolist())
+
+
+def test_profile_call_writes_collapsed_stacks(tmp_path):
+    path = str(tmp_path / 'run.folded')
+
+    assert profile_call(path, busy, 200000) == busy(200000)
+
+    lines = open(path).read().splitlines()
+    assert lines and all(line.rsplit(' ', 1)[1].isdigit() for line in lines)
+    assert any('test_profiling.py:busy' in line for line in lines)
+
+
+def fail_after_work():
+    busy(200000)
+    raise ZeroDivisionError
+
+
+def test_profile_call_writes_stacks_of_a_failed_call(tmp_path):
+    path = str(tmp_path / 'run.folded')
+    with pytest.raises(ZeroDivisionError):
+        profile_call(path, fail_after_work)
+    assert 'test_profiling.py:fail_after_work' in open(path).read()
+
+
+def test_profiled_job_renders_under_cprofile(app, db, make_user, tmp_path):
+    input_path = str(tmp_path / 'input.wav')
+    output_path = str(tmp_path / 'output.wav')
+    wavfile.write(input_path, 44100, np.random.default_rng(0).uniform(-0.5, 0.5, (44100, 2)).astype(np.float32))
+    job = jobs.create_job(make_user(), input_path, output_path, 'output.wav', 'clean', profile=True)
+
+    jobs._init_worker(app.config['SQLALCHEMY_DATABASE_URI'], instrument=False)
+    duration, _, _ = jobs.run_job(job.id, input_path, output_path, PRESETS['clean'], profile=True)
+
+    assert duration == pytest.approx(1.0)
+    stacks = open(job_profile_path(output_path)).read()
+    assert 'processor.py:process_audio' in stacks
+    assert 'dynamics.py' in stacks
+
+
+@pytest.fixture
+def admin(app, client, monkeypatch):
+    monkeypatch.setattr(profiler, 'enabled', True)
+    monkeypatch.setitem(app.config, 'ADMIN_EMAILS', ['user@example.com'])
+    monkeypatch.setattr(jobs.job_queue, 'enqueue', lambda job, preset: job.id)
+    return client
+
+
+def submit(client, **headers):
+    response = client.post('/api/process', json={'filename': 'track.wav', 'preset': 'clean'}, headers=headers)
+    assert response.status_code == 202
+    return response.get_json()
+
+
+def test_x_profile_marks_the_job_for_profiling(admin, db):
+    data = submit(admin, **{'X-Profile': '1'})
+    job = db.session.get(ProcessingJob, data['job_id'])
+
+    assert job.profile
+    assert admin.get(data['profile_url']).status_code == 404  # Not rendered yet
+
+    os.makedirs(os.path.dirname(job.output_path), exist_ok=True)
+    with open(job_profile_path(job.output_path), 'w') as f:
+        f.write('a;b 10\n')
+    response = admin.get(data['profile_url'])
+    assert response.status_code == 200
+    assert response.data == b'a;b 10\n'
+
+
+def test_jobs_are_not_profiled_without_the_header_or_for_other_users(admin, app, db, monkeypatch):
+    data = submit(admin)
+    assert not db.session.get(ProcessingJob, data['job_id']).profile
+    assert 'profile_url' not in data
+
+    monkeypatch.setitem(app.config, 'ADMIN_EMAILS', [])
+    data = submit(admin, **{'X-Profile': '1'})
+    assert not db.session.get(ProcessingJob, data['job_id']).profile
@@ -0,0 +1,142 @@
+import base64
+import hashlib
+import io
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from utils.uploads import ChecksumMismatch, append_chunk, forget, parse_checksum, part_path
+
+DATA = bytes(range(256)) * 40
+
+
+@pytest.fixture
+def upload(tmp_path):
+    upload = SimpleNamespace(id='u1', offset=0, length=len(DATA), stored_filename='u1_track.wav')
+    open(part_path(upload, tmp_path), 'wb').close()
+    yield upload
+    forget(upload.id)
+
+
+def send(upload, folder, chunk, checksum=None):
+    """Append a chunk and move the upload's offset, as the PATCH route does"""
+    offset, sha256 = append_chunk(upload, folder, io.BytesIO(chunk), len(chunk), checksum)
+    upload.offset = offset
+    return sha256
+
+
+def sha256_header(chunk):
+    return f'sha256 {base64.b64encode(hashlib.sha256(chunk).digest()).decode()}'
+
+
+def test_chunks_build_the_file_and_its_digest(upload, tmp_path):
+    assert send(upload, tmp_path, DATA[:4000]) is None
+    assert send(upload, tmp_path, DATA[4000:9000]) is None
+    assert send(upload, tmp_path, DATA[9000:]) == hashlib.sha256(DATA).hexdigest()
+
+    assert upload.offset == len(DATA)
+    with open(part_path(upload, tmp_path), 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_bytes_past_the_offset_are_discarded(upload, tmp_path):
+    send(upload, tmp_path, DATA[:4000])
+    # A chunk that reached the disk but whose new offset was never stored
+    append_chunk(upload, tmp_path, io.BytesIO(b'garbage'), 7)
+
+    assert send(upload, tmp_path, DATA[4000:]) == hashlib.sha256(DATA).hexdigest()
+    with open(part_path(upload, tmp_path), 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_digest_rebuilt_from_disk_without_running_hash(upload, tmp_path):
+    send(upload, tmp_path, DATA[:5000])
+    forget(upload.id)  # As in another process
+    assert send(upload, tmp_path, DATA[5000:]) == hashlib.sha256(DATA).hexdigest()
+
+
+def test_chunk_matching_its_checksum_is_kept(upload, tmp_path):
+    chunk = DATA[:3000]
+    send(upload, tmp_path, chunk, parse_checksum(sha256_header(chunk)))
+    assert upload.offset == 3000
+
+
+def test_chunk_not_matching_its_checksum_is_discarded(upload, tmp_path):
+    send(upload, tmp_path, DATA[:1000])
+    with pytest.raises(ChecksumMismatch):
+        send(upload, tmp_path, DATA[1000:2000], parse_checksum(sha256_header(b'something else')))
+
+    assert upload.offset == 1000
+    assert os.path.getsize(part_path(upload, tmp_path)) == 1000
+
+
+def test_short_chunk_with_checksum_is_discarded(upload, tmp_path):
+    chunk = DATA[:2000]
+    offset, sha256 = append_chunk(upload, tmp_path, io.BytesIO(chunk[:1500]), len(chunk),
+                                  parse_checksum(sha256_header(chunk)))
+
+    assert (offset, sha256) == (0, None)
+    assert os.path.getsize(part_path(upload, tmp_path)) == 0
+
+
+@pytest.mark.parametrize('header', ['md5 AAAA', 'sha256 not-base64!'])
+def test_parse_checksum_rejects_bad_headers(header):
+    with pytest.raises(ValueError):
+        parse_checksum(header)
+
+
+def test_parse_checksum_without_header():
+    assert parse_checksum(None) is None
+    assert parse_checksum('') is None
+
+
+def create(client, length=len(DATA)):
+    response = client.post('/api/uploads', json={'filename': 'track.wav', 'length': length})
+    assert response.status_code == 201
+    return response.get_json()['upload_id']
+
+
+def patch(client, upload_id, offset, chunk, checksum=None):
+    headers = {'Upload-Offset': str(offset), 'Content-Type': 'application/offset+octet-stream'}
+    if checksum:
+        headers['Upload-Checksum'] = checksum
+    return client.patch(f'/api/uploads/{upload_id}', data=chunk, headers=headers)
+
+
+def test_upload_through_the_api(client):
+    upload_id = create(client)
+
+    assert patch(client, upload_id, 0, DATA[:6000]).status_code == 204
+    response = client.head(f'/api/uploads/{upload_id}')
+    assert response.headers['Upload-Offset'] == '6000'
+
+    response = patch(client, upload_id, 6000, DATA[6000:], sha256_header(DATA[6000:]))
+    assert response.status_code == 204
+    status = client.get(f'/api/uploads/{upload_id}').get_json()
+    assert status['complete']
+    assert status['sha256'] == hashlib.sha256(DATA).hexdigest()
+    with open(os.path.join('temp_uploads', status['filename']), 'rb') as f:
+        assert f.read() == DATA
+
+
+def test_api_rejects_wrong_offset(client):
+    upload_id = create(client)
+    patch(client, upload_id, 0, DATA[:1000])
+
+    response = patch(client, upload_id, 0, DATA[:1000])
+    assert response.status_code == 409
+    assert response.headers['Upload-Offset'] == '1000'
+
+
+def test_api_rejects_chunk_with_wrong_checksum(client):
+    upload_id = create(client)
+
+    response = patch(client, upload_id, 0, DATA[:1000], sha256_header(DATA[1:1001]))
+    assert response.status_code == 460
+    assert response.headers['Upload-Offset'] == '0'
+
+
+def test_api_rejects_chunk_past_the_length(client):
+    upload_id = create(client, length=100)
+    assert patch(client, upload_id, 0, DATA[:101]).status_code == 413
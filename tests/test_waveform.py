@@ -0,0 +1,41 @@
+import os
+
+import numpy as np
+from scipy.io import wavfile
+
+from audio_processing.peaks import peaks_path_for
+from routes import api
+
+
+def write_output(name='track.wav'):
+    os.makedirs(api.PROCESSED_FOLDER, exist_ok=True)
+    path = os.path.join(api.PROCESSED_FOLDER, name)
+    wavfile.write(path, 44100, np.random.default_rng(0).uniform(-0.5, 0.5, (44100, 2)).astype(np.float32))
+    return path
+
+
+def test_revalidation_does_not_read_the_peaks(client, monkeypatch):
+    path = write_output()
+
+    response = client.get('/api/waveform/track.wav?num_points=50')
+    assert response.status_code == 200
+    assert len(response.get_json()['waveform']) == 50
+    assert os.path.exists(peaks_path_for(path))  # Built on first request
+    etag = response.headers['ETag']
+
+    def fail(*args, **kwargs):
+        raise AssertionError('peaks read for a 304')
+    monkeypatch.setattr(api, 'load_peaks', fail)
+    response = client.get('/api/waveform/track.wav?num_points=50', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert response.data == b''
+
+
+def test_etag_changes_with_the_peak_file_and_resolution(client):
+    write_output()
+    etag = client.get('/api/waveform/track.wav?num_points=50').headers['ETag']
+
+    assert client.get('/api/waveform/track.wav?num_points=60').headers['ETag'] != etag
+    write_output('other.wav')
+    assert client.get('/api/waveform/other.wav?num_points=50').headers['ETag'] != etag
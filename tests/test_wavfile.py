@@ -0,0 +1,123 @@
+import struct
+
+import numpy as np
+import pytest
+
+from audio_processing.wavfile import (WAVE_FORMAT_EXTENSIBLE, WAVE_FORMAT_IEEE_FLOAT, WAVE_FORMAT_PCM,
+                                      UnsupportedWav, WavFile, WavReader, is_wav)
+
+SAMPLE_RATE = 8000
+
+
+def wav_bytes(data, channels, bits, format_tag=WAVE_FORMAT_PCM, extensible=False, rf64=False,
+              data_size=None, extra_chunks=b''):
+    """A WAV file around raw sample bytes"""
+    block_align = channels * bits // 8
+    fmt = struct.pack('<HHIIHH', WAVE_FORMAT_EXTENSIBLE if extensible else format_tag, channels,
+                      SAMPLE_RATE, SAMPLE_RATE * block_align, block_align, bits)
+    if extensible:
+        # cbSize, valid bits, channel mask, then the sub-format GUID starting with the format tag
+        fmt += struct.pack('<HHI', 22, bits, 0) + struct.pack('<H', format_tag) + bytes(14)
+    chunks = b'fmt ' + struct.pack('<I', len(fmt)) + fmt + extra_chunks
+    if rf64:
+        ds64 = struct.pack('<QQQI', 0, len(data), len(data) // block_align, 0)
+        chunks = b'ds64' + struct.pack('<I', len(ds64)) + ds64 + chunks
+    size = len(data) if data_size is None else data_size
+    chunks += b'data' + struct.pack('<I', size) + data
+    return (b'RF64' if rf64 else b'RIFF') + struct.pack('<I', 4 + len(chunks)) + b'WAVE' + chunks
+
+
+def write(tmp_path, content, name='test.wav'):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def read_all(path):
+    with WavFile(path) as wav:
+        return wav.read()
+
+
+PCM_CASES = [
+    # bits, stored values, expected floats
+    (8, np.array([0, 128, 255, 64], dtype='u1'), [-1.0, 0.0, 127 / 128, -0.5]),
+    (16, np.array([-32768, 0, 32767, 16384], dtype='<i2'), [-1.0, 0.0, 32767 / 32768, 0.5]),
+    (32, np.array([-2 ** 31, 0, 2 ** 31 - 1, 2 ** 30], dtype='<i4'), [-1.0, 0.0, 1.0, 0.5]),
+]
+
+
+@pytest.mark.parametrize('bits, stored, expected', PCM_CASES)
+def test_pcm_bit_depths(tmp_path, bits, stored, expected):
+    path = write(tmp_path, wav_bytes(stored.tobytes(), 2, bits))
+    samples = read_all(path)
+
+    assert samples.dtype == np.float32
+    assert samples.shape == (2, 2)
+    np.testing.assert_allclose(samples.ravel(), expected, rtol=1e-7)
+
+
+def pack_24(values):
+    return b''.join(struct.pack('<i', value)[:3] for value in values)
+
+
+@pytest.mark.parametrize('extensible', [False, True])
+def test_pcm_24_bit(tmp_path, extensible):
+    values = [-2 ** 23, 0, 2 ** 23 - 1, 2 ** 22, -1, 1]
+    path = write(tmp_path, wav_bytes(pack_24(values), 2, 24, extensible=extensible))
+
+    with WavFile(path) as wav:
+        assert wav.bits == 24 and wav.frames == 3
+        samples = wav.read()
+    np.testing.assert_allclose(samples.ravel(), np.array(values) / 2 ** 23, rtol=1e-7)
+
+
+@pytest.mark.parametrize('bits', [32, 64])
+def test_ieee_float(tmp_path, bits):
+    values = np.array([-1.0, 0.25, 0.5, 1.5], dtype=f'<f{bits // 8}')
+    path = write(tmp_path, wav_bytes(values.tobytes(), 2, bits, WAVE_FORMAT_IEEE_FLOAT))
+    np.testing.assert_array_equal(read_all(path).ravel(), values.astype(np.float32))
+
+
+def test_rf64_size_from_ds64(tmp_path):
+    values = np.arange(-8, 8, dtype='<i2') * 1024
+    path = write(tmp_path, wav_bytes(values.tobytes(), 2, 16, rf64=True, data_size=0xFFFFFFFF))
+
+    with WavFile(path) as wav:
+        assert wav.frames == 8
+        np.testing.assert_allclose(wav.read().ravel(), values / 32768)
+
+
+def test_streamed_file_with_unknown_data_size(tmp_path):
+    values = np.arange(10, dtype='<i2')
+    path = write(tmp_path, wav_bytes(values.tobytes(), 1, 16, data_size=0xFFFFFFFF))
+    with WavFile(path) as wav:
+        assert wav.frames == 10
+
+
+def test_odd_sized_chunk_before_data(tmp_path):
+    values = np.array([100, -100], dtype='<i2')
+    odd_chunk = b'LIST' + struct.pack('<I', 3) + b'abc' + b'\0'
+    path = write(tmp_path, wav_bytes(values.tobytes(), 1, 16, extra_chunks=odd_chunk))
+    np.testing.assert_allclose(read_all(path).ravel(), values / 32768)
+
+
+def test_unsupported_encodings(tmp_path):
+    alaw = write(tmp_path, wav_bytes(bytes(8), 1, 8, format_tag=6), 'alaw.wav')
+    not_wav = write(tmp_path, b'fLaC' + bytes(40), 'audio.wav')
+
+    for path in (alaw, not_wav):
+        assert not is_wav(path)
+        with pytest.raises(UnsupportedWav):
+            WavFile(path)
+    assert is_wav(write(tmp_path, wav_bytes(bytes(4), 1, 16)))
+
+
+def test_reader_blocks_and_window(tmp_path):
+    values = np.arange(SAMPLE_RATE * 2, dtype='<i2')
+    path = write(tmp_path, wav_bytes(values.tobytes(), 1, 16))
+
+    with WavReader(path, block_frames=1000, start=0.5, duration=1.0) as reader:
+        blocks = [block.copy() for block in reader]
+
+    assert [len(block) for block in blocks] == [1000] * 8
+    np.testing.assert_allclose(np.concatenate(blocks).ravel(), values[4000:12000] / 32768)
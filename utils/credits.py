@@ -0,0 +1,53 @@
+"""
+Atomic credit accounting
+
+Credits are reserved when a job is submitted, by one conditional UPDATE
+(credits = credits - n WHERE credits >= n) committed with the job row, so
+two requests of the same user can never both spend the last credit and no
+transaction or row lock is held while the job runs. A job that fails gives
+its credit back (see utils.jobs.finalize_job); the job row records what it
+holds so a refund happens at most once. Studio plans are not charged.
+"""
+from extensions import db
+from models import User
+
+
+def reserve_credits(user, amount=1):
+    """
+    Take credits from a user for a job about to be created (not committed)
+
+    Args:
+        user: User submitting the job
+        amount: Number of credits needed
+
+    Returns:
+        reserved: Credits taken (0 for Studio plans), or None when the user
+            does not have enough
+    """
+    if user.plan == 'studio':
+        return 0
+    taken = db.session.execute(
+        db.update(User)
+        .where(User.id == user.id, User.credits >= amount)
+        .values(credits=User.credits - amount)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not taken:
+        return None
+    db.session.expire(user, ['credits'])
+    return amount
+
+
+def refund_credits(user_id, amount):
+    """Give reserved credits back to a user (not committed)"""
+    if amount <= 0:
+        return
+    db.session.execute(
+        db.update(User)
+        .where(User.id == user_id)
+        .values(credits=User.credits + amount)
+        .execution_options(synchronize_session=False)
+    )
+    user = db.session.get(User, user_id)
+    if user is not None:
+        db.session.expire(user, ['credits'])
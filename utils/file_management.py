@@ -1,5 +1,7 @@
+import hashlib
 import os
 import shutil
+import zipfile
 from datetime import datetime, timedelta
 
 def allowed_file(filename, allowed_extensions):
@@ -33,3 +35,58 @@ def ensure_directory_exists(directory):
     if not os.path.exists(directory):
         os.makedirs(directory)
         print(f"Created directory: {directory}")
+
+def file_digest(file_path, chunk_size=1024 * 1024):
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class _ZipChunks:
+    """Write-only file object collecting what zipfile writes, for streaming"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_zip(files, chunk_size=1024 * 1024):
+    """
+    Generate a zip archive chunk by chunk, without a temporary file
+
+    Entries are stored uncompressed (the audio is compressed already) and
+    written with data descriptors, so nothing is seeked back.
+
+    Args:
+        files: Iterable of (file_path, name in the archive)
+        chunk_size: Bytes read from each file at a time
+
+    Yields:
+        data: Bytes of the archive
+    """
+    output = _ZipChunks()
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for file_path, name in files:
+            with open(file_path, 'rb') as source, archive.open(name, 'w', force_zip64=True) as entry:
+                for chunk in iter(lambda: source.read(chunk_size), b''):
+                    entry.write(chunk)
+                    yield output.take()
+            yield output.take()
+    yield output.take()
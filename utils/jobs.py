@@ -0,0 +1,571 @@
+"""
+Background mastering jobs
+
+/api/process only records a ProcessingJob and returns its id; the DSP runs
+in a pool of worker processes so gunicorn workers are never pinned by a
+master. Two backends are available (JOB_BACKEND setting):
+
+- 'local' (default): a ProcessPoolExecutor owned by the web process. No
+  broker or extra service is needed.
+- 'database': the web process only inserts queued rows and one or more
+  `flask jobs-worker` processes claim them from the jobs table (SQLite or
+  Postgres) with an atomic conditional UPDATE.
+
+Workers report progress straight into the job row. Credits are reserved
+when a job is submitted (utils.credits). The result is recorded
+(MasteredFile or refund, job status) by the process that owns the pool, in
+one transaction, and only once per job even if it is reported twice. A
+result that cannot be recorded fails the job, and the local backend fails
+the jobs a restart left unfinished, so no job holds its credit forever.
+
+Jobs of a ProcessingBatch that share an input run as one pool task, which
+decodes the input once for all their presets. The credits of a batch are
+reserved together when it is submitted.
+
+Workers time every stage of a render (audio_processing.metrics) and send
+the figures back with the result; they are stored on the job and added to
+the /metrics histograms (utils.metrics) when it is recorded. METRICS_FILE
+set to '' turns the instrumentation off.
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from functools import partial
+
+from sqlalchemy import create_engine
+
+from extensions import db
+from models import MasteredFile, MasteredFileExport, ProcessingBatch, ProcessingJob
+from utils.credits import refund_credits
+from utils.metrics import job_metrics
+from utils.profiling import job_profile_path, profile_call
+from utils.result_cache import result_cache
+
+logger = logging.getLogger(__name__)
+
+# Minimum delay between two progress writes from a worker, in seconds
+PROGRESS_INTERVAL = 0.5
+
+_worker_engine = None
+_dsp_workers = 1
+_instrument = True
+
+
+def _init_worker(database_uri, dsp_workers=1, instrument=True):
+    """Pool initializer: one small engine per worker process for progress updates"""
+    global _worker_engine, _dsp_workers, _instrument
+    _worker_engine = create_engine(database_uri)
+    _dsp_workers = dsp_workers
+    _instrument = instrument
+
+
+def _stage_metrics():
+    from audio_processing.metrics import StageMetrics
+
+    return StageMetrics() if _instrument else None
+
+
+def _update_job(job_id, **values):
+    """Update a job row from a worker process"""
+    jobs = ProcessingJob.__table__
+    with _worker_engine.begin() as connection:
+        connection.execute(jobs.update().where(jobs.c.id == job_id).values(**values))
+
+
+def _progress_writer(job_id):
+    """Throttled callback storing a job's progress in its row"""
+    last_write = [0.0]
+
+    def report(fraction):
+        now = time.monotonic()
+        if fraction < 1.0 and now - last_write[0] < PROGRESS_INTERVAL:
+            return
+        last_write[0] = now
+        try:
+            _update_job(job_id, progress=float(fraction))
+        except Exception as e:
+            logger.warning("Could not store progress of job %s: %s", job_id, e)
+
+    return report
+
+
+def _mark_running(job_id):
+    jobs = ProcessingJob.__table__
+    with _worker_engine.begin() as connection:
+        connection.execute(
+            jobs.update()
+            .where(jobs.c.id == job_id, jobs.c.status == 'queued')
+            .values(status='running', started_at=datetime.utcnow())
+        )
+
+
+def run_job(job_id, input_path, output_path, preset, analysis_path=None, exports=None, profile=False):
+    """
+    Executed in a worker process: master one file and return (duration, loudness, stages)
+
+    With profile set, the render runs under cProfile and its collapsed
+    stacks are written next to the output (see utils.profiling).
+    """
+    from audio_processing.peaks import peaks_path_for
+    from audio_processing.processor import process_audio
+
+    _mark_running(job_id)
+    metrics = _stage_metrics()
+    render = partial(process_audio, input_path, output_path, preset, progress=_progress_writer(job_id),
+                     workers=_dsp_workers, peaks_path=peaks_path_for(output_path),
+                     analysis_path=analysis_path, exports=exports, metrics=metrics)
+    if profile:
+        duration, loudness = profile_call(job_profile_path(output_path), render)
+    else:
+        duration, loudness = render()
+    return duration, loudness, metrics.to_dict() if metrics else None
+
+
+def run_job_group(input_path, renders, analysis_path=None):
+    """
+    Executed in a worker process: master one input with several presets
+
+    Args:
+        renders: List of (job_id, output_path, preset, exports)
+
+    Returns:
+        results: List of (job_id, duration, loudness, error message or None,
+            stages)
+    """
+    from audio_processing.peaks import peaks_path_for
+    from audio_processing.processor import process_audio_multi
+
+    for job_id, _, _, _ in renders:
+        _mark_running(job_id)
+
+    metrics = [_stage_metrics() for _ in renders]
+    results = process_audio_multi(input_path, [
+        {
+            'output_path': output_path,
+            'preset': preset,
+            'exports': exports,
+            'progress': _progress_writer(job_id),
+            'peaks_path': peaks_path_for(output_path),
+            'metrics': render_metrics,
+        }
+        for (job_id, output_path, preset, exports), render_metrics in zip(renders, metrics)
+    ], workers=_dsp_workers, analysis_path=analysis_path)
+
+    outcomes = []
+    for (job_id, _, _, _), result, render_metrics in zip(renders, results, metrics):
+        stages = render_metrics.to_dict() if render_metrics else None
+        if isinstance(result, Exception):
+            outcomes.append((job_id, None, None, str(result), stages))
+        else:
+            outcomes.append((job_id, result[0], result[1], None, stages))
+    return outcomes
+
+
+def finalize_job(job_id, duration=None, loudness=None, error=None, stages=None):
+    """
+    Record the outcome of a job (must run inside an app context)
+
+    The status moves from queued/running to succeeded or failed with a
+    conditional update, so a job reported twice is recorded once. On
+    success the MasteredFile (with one MasteredFileExport per extra format)
+    is created in the same commit, then the outputs are added to the
+    result cache; a failed job gets its reserved credits back in the same
+    commit as its status. stages (audio_processing.metrics) are stored on
+    the job and added to the /metrics histograms.
+
+    The outputs are measured before the status is claimed: a job whose
+    output or an export is missing is recorded as failed (and refunded)
+    instead of leaving it running.
+    """
+    job = db.session.get(ProcessingJob, job_id)
+    if job is None:
+        return None
+
+    if error is None:
+        try:
+            file_size = os.path.getsize(job.output_path)
+            export_sizes = [os.path.getsize(export['path']) for export in job.exports]
+        except OSError as e:
+            error = f'Missing output: {e}'
+
+    claimed = db.session.execute(
+        db.update(ProcessingJob)
+        .where(ProcessingJob.id == job_id, ProcessingJob.status.in_(('queued', 'running')))
+        .values(status='failed' if error is not None else 'succeeded', finished_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        return job  # Already recorded
+    db.session.refresh(job)
+
+    job.stage_metrics = stages
+    if error is not None:
+        job.error = f'Processing error: {error}'
+        refund_credits(job.user_id, job.credits_reserved)
+        job.credits_reserved = 0
+        db.session.commit()
+        _record_metrics(job)
+        if job.batch_id:
+            finish_batch(job.batch_id)
+        return job
+
+    mastered = MasteredFile(
+        user_id=job.user_id,
+        original_filename=job.original_filename,
+        processed_filename=job.processed_filename,
+        preset_used=job.preset_used,
+        created_at=datetime.utcnow(),
+        file_path=job.output_path,
+        file_size=file_size,
+        duration=duration
+    )
+    mastered.set_loudness(loudness)
+    db.session.add(mastered)
+    for export, export_size in zip(job.exports, export_sizes):
+        db.session.add(MasteredFileExport(
+            mastered_file=mastered,
+            format=export['format'],
+            bitrate=export.get('bitrate'),
+            processed_filename=export['processed_filename'],
+            file_path=export['path'],
+            file_size=export_size
+        ))
+
+    # Le crédit a été réservé à la soumission : rien à débiter ici
+    job.progress = 1.0
+    job.mastered_file = mastered
+    db.session.commit()
+    _record_metrics(job)
+
+    # Keep the results for the next identical request
+    try:
+        result_cache.store(job.cache_key, job.output_path, duration, loudness)
+        for export in job.exports:
+            result_cache.store(export.get('cache_key'), export['path'], duration, loudness)
+    except OSError as e:
+        logger.warning("Could not cache the result of job %s: %s", job_id, e)
+
+    if job.batch_id:
+        finish_batch(job.batch_id)
+    return job
+
+
+def _record_metrics(job):
+    try:
+        job_metrics.record_job(job.status, job.stage_metrics)
+    except (OSError, ValueError) as e:
+        logger.warning("Could not record the metrics of job %s: %s", job.id, e)
+
+
+def finish_batch(batch_id):
+    """
+    Close a batch once all its jobs are finished (must run inside an app context)
+
+    Records the credits kept by its jobs (failed ones were refunded). The
+    conditional update closes a batch once even when its last jobs finish
+    in different processes.
+    """
+    batch = db.session.get(ProcessingBatch, batch_id)
+    if batch is None or batch.status != 'running' or not all(job.is_finished for job in batch.jobs):
+        return batch
+
+    claimed = db.session.execute(
+        db.update(ProcessingBatch)
+        .where(ProcessingBatch.id == batch_id, ProcessingBatch.status == 'running')
+        .values(status='finished', finished_at=datetime.utcnow(),
+                credits_used=sum(job.credits_reserved for job in batch.jobs))
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        return batch
+    db.session.commit()
+    return batch
+
+
+class JobQueue:
+    """Submits ProcessingJobs to a process pool and records their results"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.backend = 'local'
+        self._executor = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.backend = app.config.setdefault('JOB_BACKEND', 'local')
+        app.config.setdefault('JOB_WORKERS', max(1, (os.cpu_count() or 2) // 2))
+        # Processes each job may split its DSP stages across
+        app.config.setdefault('DSP_WORKERS', 1)
+        app.extensions['job_queue'] = self
+
+        @app.cli.command('jobs-worker')
+        def jobs_worker():
+            """Run queued jobs from the database (JOB_BACKEND=database)"""
+            self.work()
+
+    @property
+    def database_uri(self):
+        with self.app.app_context():
+            return db.engine.url.render_as_string(hide_password=False)
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.app.config['JOB_WORKERS'],
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_worker,
+                    initargs=(self.database_uri, self.app.config['DSP_WORKERS'], job_metrics.enabled),
+                )
+                atexit.register(self._executor.shutdown, wait=False)
+            return self._executor
+
+    def enqueue(self, job, preset):
+        """Start a job already committed to the database"""
+        if self.backend == 'database':
+            return job.id  # Picked up by `flask jobs-worker`
+        self._start(job.id, job.input_path, job.output_path, preset,
+                    result_cache.analysis_path(job.input_hash), job.exports, job.profile)
+        return job.id
+
+    def _start(self, job_id, input_path, output_path, preset, analysis_path=None, exports=None, profile=False):
+        future = self._get_executor().submit(run_job, job_id, input_path, output_path, preset,
+                                             analysis_path, exports, profile)
+        future.add_done_callback(lambda done: self._on_done(job_id, done))
+        return future
+
+    def enqueue_batch(self, batch, presets):
+        """
+        Start the queued jobs of a batch, one pool task per input file
+
+        Args:
+            presets: Dictionary of preset name to preset parameters
+        """
+        if self.backend == 'database':
+            return batch.id  # Grouped when claimed by `flask jobs-worker`
+        for input_path, jobs in _group_by_input(job for job in batch.jobs if job.status == 'queued'):
+            self._start_group(input_path, [
+                (job.id, job.output_path, presets[job.preset_used], job.exports) for job in jobs
+            ], result_cache.analysis_path(jobs[0].input_hash))
+        return batch.id
+
+    def _start_group(self, input_path, renders, analysis_path=None):
+        future = self._get_executor().submit(run_job_group, input_path, renders, analysis_path)
+        job_ids = [render[0] for render in renders]
+        future.add_done_callback(lambda done: self._on_group_done(job_ids, done))
+        return future
+
+    def _on_group_done(self, job_ids, future):
+        error = future.exception()
+        with self.app.app_context():
+            try:
+                if error is not None:
+                    logger.error("Jobs %s failed: %s", ', '.join(job_ids), error)
+                    results = [(job_id, None, None, error, None) for job_id in job_ids]
+                else:
+                    results = future.result()
+                for job_id, duration, loudness, job_error, stages in results:
+                    if job_error is not None and error is None:
+                        logger.error("Job %s failed: %s", job_id, job_error)
+                    self._record(job_id, duration=duration, loudness=loudness, error=job_error, stages=stages)
+            finally:
+                db.session.remove()
+
+    def _on_done(self, job_id, future):
+        error = future.exception()
+        with self.app.app_context():
+            try:
+                if error is not None:
+                    logger.error("Job %s failed: %s", job_id, error)
+                    self._record(job_id, error=error)
+                else:
+                    duration, loudness, stages = future.result()
+                    self._record(job_id, duration=duration, loudness=loudness, stages=stages)
+            finally:
+                db.session.remove()
+
+    def _record(self, job_id, **result):
+        """finalize_job, or fail (and refund) the job when its result cannot be recorded"""
+        try:
+            finalize_job(job_id, **result)
+        except Exception as e:
+            db.session.rollback()
+            logger.exception("Could not record the result of job %s", job_id)
+            try:
+                finalize_job(job_id, error=f'Could not record the result: {e}')
+            except Exception:
+                db.session.rollback()
+                logger.exception("Could not mark job %s as failed", job_id)
+
+    def fail_orphaned_jobs(self):
+        """
+        Fail and refund the jobs left unfinished by a previous run (must run inside an app context)
+
+        With the local backend a job only runs in the pool of the process
+        that submitted it, so queued and running jobs found at startup were
+        lost with a previous process and would otherwise hold their credits
+        forever. This assumes one web process owns the pool (one gunicorn
+        worker); deployments with several use the database backend, whose
+        queued jobs are still picked up and are left alone.
+
+        Returns:
+            count: Number of jobs failed
+        """
+        if self.backend != 'local':
+            return 0
+        job_ids = [job_id for job_id, in db.session.query(ProcessingJob.id)
+                   .filter(ProcessingJob.status.in_(('queued', 'running')))]
+        for job_id in job_ids:
+            logger.warning("Job %s was interrupted by a restart", job_id)
+            self._record(job_id, error='Interrupted by a server restart')
+        return len(job_ids)
+
+    def _claim_next(self):
+        """Atomically move the oldest queued job to 'running' and return it"""
+        job = ProcessingJob.query.filter_by(status='queued').order_by(ProcessingJob.created_at).first()
+        if job is None:
+            return None
+        claimed = db.session.execute(
+            db.update(ProcessingJob)
+            .where(ProcessingJob.id == job.id, ProcessingJob.status == 'queued')
+            .values(status='running', started_at=datetime.utcnow())
+        ).rowcount
+        db.session.commit()
+        return db.session.get(ProcessingJob, job.id) if claimed else None
+
+    def _claim_siblings(self, job):
+        """Claim the queued jobs of the same batch and input as a claimed job"""
+        if not job.batch_id:
+            return []
+        candidates = ProcessingJob.query.filter_by(
+            batch_id=job.batch_id, input_path=job.input_path, status='queued'
+        ).all()
+        siblings = []
+        for candidate in candidates:
+            claimed = db.session.execute(
+                db.update(ProcessingJob)
+                .where(ProcessingJob.id == candidate.id, ProcessingJob.status == 'queued')
+                .values(status='running', started_at=datetime.utcnow())
+            ).rowcount
+            if claimed:
+                siblings.append(candidate)
+        db.session.commit()
+        return siblings
+
+    def work(self, poll_interval=1.0):
+        """Worker loop of the database backend"""
+        from audio_processing.presets import get_preset_by_name
+
+        slots = threading.BoundedSemaphore(self.app.config['JOB_WORKERS'])
+        logger.info("Job worker started with %s processes", self.app.config['JOB_WORKERS'])
+        while True:
+            slots.acquire()
+            with self.app.app_context():
+                job = self._claim_next()
+                if job is None:
+                    slots.release()
+                    db.session.remove()
+                    time.sleep(poll_interval)
+                    continue
+                job_id, input_path, output_path = job.id, job.input_path, job.output_path
+                preset = job.preset_settings or get_preset_by_name(job.preset_used)
+                analysis_path = result_cache.analysis_path(job.input_hash)
+                exports = job.exports
+                profile = job.profile
+                # Presets of the same file in a batch share one decode
+                renders = [(sibling.id, sibling.output_path,
+                            sibling.preset_settings or get_preset_by_name(sibling.preset_used),
+                            sibling.exports) for sibling in self._claim_siblings(job)]
+                db.session.remove()
+
+            if renders:
+                renders.insert(0, (job_id, output_path, preset, exports))
+                future = self._start_group(input_path, renders, analysis_path)
+            else:
+                future = self._start(job_id, input_path, output_path, preset, analysis_path, exports, profile)
+            future.add_done_callback(lambda done: slots.release())
+
+
+job_queue = JobQueue()
+
+
+def _group_by_input(jobs):
+    """(input_path, jobs) pairs, in order of first appearance"""
+    groups = {}
+    for job in jobs:
+        groups.setdefault(job.input_path, []).append(job)
+    return list(groups.items())
+
+
+def create_job(user, input_path, output_path, processed_filename, preset_name, original_filename=None,
+               cache_key=None, input_hash=None, exports=None, credits_reserved=0, idempotency_key=None,
+               preset_settings=None, profile=False):
+    """
+    Insert a queued job for the user
+
+    exports lists the extra formats encoded from the same render, as
+    dictionaries with format, bitrate, path, processed_filename and cache_key.
+    preset_settings is the snapshot of a custom preset (None for built-in
+    presets, which workers look up by name). profile runs the render under
+    cProfile (utils.profiling). The job is committed together with any
+    pending credit reservation.
+    """
+    job = ProcessingJob(
+        preset_settings=preset_settings,
+        profile=profile,
+        credits_reserved=credits_reserved,
+        idempotency_key=idempotency_key,
+        cache_key=cache_key,
+        input_hash=input_hash,
+        exports=exports,
+        user_id=user.id,
+        original_filename=original_filename,
+        input_path=input_path,
+        output_path=output_path,
+        processed_filename=processed_filename,
+        preset_used=preset_name,
+    )
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+
+def create_batch(user, items, credits_per_job=0, idempotency_key=None):
+    """
+    Insert a batch and its queued jobs for the user, in one commit
+
+    Args:
+        items: List of dictionaries with the create_job arguments
+            (input_path, output_path, processed_filename, preset_name,
+            original_filename, cache_key, input_hash, preset_settings)
+        credits_per_job: Credits reserved for each job (committed with them)
+        idempotency_key: Idempotency-Key header of the request, if any
+    """
+    batch = ProcessingBatch(user_id=user.id, idempotency_key=idempotency_key)
+    db.session.add(batch)
+    for item in items:
+        db.session.add(ProcessingJob(
+            batch=batch,
+            user_id=user.id,
+            credits_reserved=credits_per_job,
+            input_path=item['input_path'],
+            output_path=item['output_path'],
+            processed_filename=item['processed_filename'],
+            preset_used=item['preset_name'],
+            original_filename=item.get('original_filename'),
+            cache_key=item.get('cache_key'),
+            input_hash=item.get('input_hash'),
+            preset_settings=item.get('preset_settings'),
+        ))
+    db.session.commit()
+    return batch
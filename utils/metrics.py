@@ -0,0 +1,178 @@
+"""
+Prometheus metrics of the mastering jobs
+
+Every finished job adds its per-stage figures (audio_processing.metrics) to
+histograms and counters kept in one JSON file (METRICS_FILE). The jobs are
+recorded by whichever process owns their pool (a gunicorn worker, or
+`flask jobs-worker` with the database backend) and /metrics may be served
+by any other, so the file is updated under an exclusive lock and read back
+on every scrape rather than held in memory. A job adds one small
+read-modify-write; nothing is recorded while it runs.
+
+Exposed series:
+
+    masterify_jobs_total{status}                     jobs finished
+    masterify_stage_duration_seconds{stage}          wall time of a stage in one job (histogram)
+    masterify_stage_cpu_seconds_total{stage}         CPU time of the job process
+    masterify_stage_samples_total{stage}             samples processed
+    masterify_stage_peak_memory_bytes{stage}         peak memory of a stage in one job (histogram)
+"""
+import fcntl
+import json
+import logging
+import math
+import os
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# Histogram upper bounds (the +Inf bucket is implied)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+MEMORY_BUCKETS = tuple(2 ** power for power in range(20, 34, 2))  # 1 MiB to 8 GiB
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _empty_stage():
+    return {
+        'duration': [0] * (len(DURATION_BUCKETS) + 1), 'duration_sum': 0.0,
+        'memory': [0] * (len(MEMORY_BUCKETS) + 1), 'memory_sum': 0.0,
+        'cpu_s': 0.0, 'samples': 0,
+    }
+
+
+def _bucket(bounds, value):
+    for index, bound in enumerate(bounds):
+        if value <= bound:
+            return index
+    return len(bounds)
+
+
+def _number(value):
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class JobMetrics:
+    """Job and stage metrics shared by the processes of the app"""
+
+    def __init__(self, app=None):
+        self.path = None
+        self.token = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # Empty disables the metrics
+        self.path = app.config.setdefault('METRICS_FILE', 'job_metrics.json')
+        # Bearer token required by /metrics, if set
+        self.token = app.config.setdefault('METRICS_TOKEN', None)
+        app.extensions['job_metrics'] = self
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def load(self):
+        if not self.enabled or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except ValueError:
+            logger.warning("Unreadable metrics file %s, starting over", self.path)
+            return {}
+
+    def record_job(self, status, stages=None):
+        """
+        Add a finished job to the metrics
+
+        Args:
+            status: 'succeeded' or 'failed'
+            stages: StageMetrics.to_dict() of its render, if any
+        """
+        if not self.enabled:
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # The data file is replaced on every write, so the lock lives next to it
+        with open(f'{self.path}.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                data = self.load()
+                jobs = data.setdefault('jobs', {})
+                jobs[status] = jobs.get(status, 0) + 1
+                for name, values in (stages or {}).items():
+                    stage = data.setdefault('stages', {}).setdefault(name, _empty_stage())
+                    stage['duration'][_bucket(DURATION_BUCKETS, values['wall_s'])] += 1
+                    stage['duration_sum'] += values['wall_s']
+                    stage['cpu_s'] += values['cpu_s']
+                    stage['samples'] += values['samples']
+                    if values.get('peak_bytes') is not None:
+                        stage['memory'][_bucket(MEMORY_BUCKETS, values['peak_bytes'])] += 1
+                        stage['memory_sum'] += values['peak_bytes']
+
+                # Replaced atomically: a scrape never reads half a file
+                fd, temp_path = tempfile.mkstemp(dir=directory or '.', prefix='.metrics-')
+                with os.fdopen(fd, 'w') as out:
+                    json.dump(data, out)
+                os.replace(temp_path, self.path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def render(self):
+        """The metrics in the Prometheus text exposition format"""
+        data = self.load()
+        lines = [
+            '# HELP masterify_jobs_total Mastering jobs finished, by status.',
+            '# TYPE masterify_jobs_total counter',
+        ]
+        for status, count in sorted(data.get('jobs', {}).items()):
+            lines.append(f'masterify_jobs_total{{status="{status}"}} {count}')
+
+        stages = sorted(data.get('stages', {}).items())
+        lines += [
+            '# HELP masterify_stage_duration_seconds Wall time of a processing stage in one job.',
+            '# TYPE masterify_stage_duration_seconds histogram',
+        ]
+        for name, stage in stages:
+            lines += _histogram('masterify_stage_duration_seconds', name, DURATION_BUCKETS,
+                                stage['duration'], stage['duration_sum'])
+        lines += [
+            '# HELP masterify_stage_cpu_seconds_total CPU time of the job process in a processing stage.',
+            '# TYPE masterify_stage_cpu_seconds_total counter',
+        ]
+        lines += [f'masterify_stage_cpu_seconds_total{{stage="{name}"}} {_number(stage["cpu_s"])}'
+                  for name, stage in stages]
+        lines += [
+            '# HELP masterify_stage_samples_total Samples (frames x channels) processed by a stage.',
+            '# TYPE masterify_stage_samples_total counter',
+        ]
+        lines += [f'masterify_stage_samples_total{{stage="{name}"}} {stage["samples"]}'
+                  for name, stage in stages]
+        lines += [
+            '# HELP masterify_stage_peak_memory_bytes Peak resident memory growth of a stage in one job.',
+            '# TYPE masterify_stage_peak_memory_bytes histogram',
+        ]
+        for name, stage in stages:
+            if sum(stage['memory']):
+                lines += _histogram('masterify_stage_peak_memory_bytes', name, MEMORY_BUCKETS,
+                                    stage['memory'], stage['memory_sum'])
+        return '\n'.join(lines) + '\n'
+
+
+def _histogram(metric, stage, bounds, counts, total):
+    """Cumulative bucket, sum and count lines of one histogram"""
+    lines = []
+    cumulative = 0
+    for bound, count in zip(bounds + (math.inf,), counts):
+        cumulative += count
+        lines.append(f'{metric}_bucket{{stage="{stage}",le="{_number(float(bound))}"}} {cumulative}')
+    lines.append(f'{metric}_sum{{stage="{stage}"}} {_number(float(total))}')
+    lines.append(f'{metric}_count{{stage="{stage}"}} {cumulative}')
+    return lines
+
+
+job_metrics = JobMetrics()
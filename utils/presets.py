@@ -0,0 +1,109 @@
+"""
+Preset resolution for requests: built-in presets and users' custom presets
+
+A request names its preset either by a built-in name ('trap') or by the
+reference of one of the user's Preset rows ('custom-12'). Resolving a
+custom preset reads only its owner and version from the database; the
+validated settings and their compiled form are kept in an in-process LRU
+keyed by (preset id, version), so the JSON is parsed and checked once per
+version and a repeated preset costs about as much as a built-in one.
+Editing a preset bumps its version, which makes the old entry unreachable
+until it ages out.
+
+Jobs carry a snapshot of a custom preset's settings (ProcessingJob.
+preset_json), so the job workers never look presets up and a preset
+edited or deleted while a job waits does not change that job.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+
+from audio_processing.chain import compile_preset
+from audio_processing.presets import get_preset_by_name
+from extensions import db
+from models import Preset
+
+# Resolved custom presets kept per process
+CACHE_SIZE = 512
+
+# Plans allowed to create and edit custom presets
+CUSTOM_PRESET_PLANS = ('pro', 'studio')
+
+# Custom presets per user
+MAX_PRESETS_PER_USER = 50
+
+ResolvedPreset = namedtuple('ResolvedPreset', 'settings compiled custom')
+
+
+class PresetCache:
+    """Thread-safe LRU of resolved custom presets keyed by (preset id, version)"""
+
+    def __init__(self, max_entries=CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+preset_cache = PresetCache()
+
+
+def custom_preset_id(reference):
+    """Preset id of a 'custom-<id>' reference, or None for any other name"""
+    if not isinstance(reference, str) or not reference.startswith(Preset.REFERENCE_PREFIX):
+        return None
+    suffix = reference[len(Preset.REFERENCE_PREFIX):]
+    return int(suffix) if suffix.isdigit() else None
+
+
+def resolve_preset(reference, user):
+    """
+    Settings of the preset a request refers to
+
+    Args:
+        reference: Built-in preset name or custom preset reference
+        user: User making the request (custom presets are private)
+
+    Returns:
+        ResolvedPreset (settings dict, CompiledPreset, whether it is a
+            custom preset), or None if there is no such preset
+    """
+    preset_id = custom_preset_id(reference)
+    if preset_id is None:
+        settings = get_preset_by_name(reference) if isinstance(reference, str) else None
+        return ResolvedPreset(settings, compile_preset(settings), False) if settings else None
+
+    row = db.session.query(Preset.user_id, Preset.version).filter(Preset.id == preset_id).first()
+    if row is None or row.user_id != user.id:
+        return None
+    resolved = preset_cache.get((preset_id, row.version))
+    if resolved is None:
+        preset = db.session.get(Preset, preset_id)
+        if preset is None:
+            return None  # Deleted meanwhile
+        settings = preset.settings
+        resolved = ResolvedPreset(settings, compile_preset(settings), True)
+        preset_cache.put((preset_id, preset.version), resolved)
+    return resolved
+
+
+def can_edit_presets(user):
+    """Whether the user's plan includes custom presets"""
+    return user.plan in CUSTOM_PRESET_PLANS
+
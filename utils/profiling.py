@@ -0,0 +1,313 @@
+"""
+On-demand profiling of live workers and jobs (admins only, PROFILER_ENABLED)
+
+Two tools, both writing collapsed stacks ("frame;frame;frame count" per
+line, the input of flamegraph.pl, speedscope or inferno) to PROFILE_DIR:
+
+- StackSampler: a daemon thread that records the stacks of every other
+  thread of the process every PROFILER_INTERVAL seconds. It only reads
+  frames, so requests run at full speed, and it shows where a stuck worker
+  is blocked. It is toggled per worker, either with the PROFILER_SIGNAL
+  signal (`kill -USR2 <worker pid>`) or through /api/admin/profiler (which
+  acts on the worker that serves the request), and stops by itself after
+  PROFILER_MAX_SECONDS. Counts are samples.
+- job profiles: when an admin sends the X-Profile header with
+  /api/process, the job's render runs under cProfile in the pool process
+  that executes it (profile_call), since the request itself only queues
+  the job. Counts are microseconds of wall time, spread over call paths
+  from cProfile's caller/callee table (see collapse_stats). The stacks are
+  written next to the job's output (job_profile_path) and served at
+  /api/admin/jobs/<job id>/profile. Stages split across cores
+  (DSP_WORKERS > 1) run in other processes and only show as waits.
+
+With gunicorn --preload the app is imported by the arbiter, which uses
+SIGUSR2 itself; set PROFILER_SIGNAL to another signal (or '') in that case.
+"""
+import cProfile
+import logging
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from flask import current_app, request
+from flask_login import current_user
+
+logger = logging.getLogger(__name__)
+
+# Request header asking for a cProfile capture of the job it submits
+PROFILE_HEADER = 'X-Profile'
+
+PROFILE_SUFFIX = '.folded'
+
+# Frames kept per sampled stack (the innermost ones)
+MAX_STACK_DEPTH = 200
+
+# Smallest share of a cProfile run given its own call path; smaller ones are
+# counted in their caller (a call graph can have exponentially many paths)
+MIN_PATH_SHARE = 0.001
+
+_ROOT = os.getcwd()
+
+
+def _short_path(filename):
+    """Path relative to the app, or from site-packages on, for frame labels"""
+    if filename.startswith(_ROOT + os.sep):
+        return os.path.relpath(filename, _ROOT)
+    marker = filename.rfind('site-packages' + os.sep)
+    if marker >= 0:
+        return filename[marker + len('site-packages') + 1:]
+    return os.path.basename(filename)
+
+
+def _label(filename, function):
+    # ';' separates frames and the last space separates the count
+    return f'{_short_path(filename)}:{function}'.replace(';', ',').replace(' ', '_')
+
+
+def render_collapsed(counts):
+    """Collapsed stack text of a Counter of stack tuples, heaviest first"""
+    return ''.join(f"{';'.join(stack)} {int(count)}\n" for stack, count in counts.most_common() if int(count) > 0)
+
+
+def collapse_stats(stats):
+    """
+    Collapsed stacks of a cProfile run
+
+    cProfile keeps, per function, its own time and the time spent in it from
+    each caller, not whole stacks. Paths are rebuilt from the functions
+    without callers down through their callees, and the time a callee
+    spent under one caller is shared between that caller's paths in
+    proportion to their time, which is exact for trees and a close
+    estimate otherwise. Paths under MIN_PATH_SHARE of the run are merged
+    into their caller, so the totals are kept and the output stays small.
+
+    Args:
+        stats: pstats.Stats of the run
+
+    Returns:
+        Counter of stack tuple to microseconds
+    """
+    entries = stats.stats
+    callees = {}
+    for function, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((function, edge[3]))
+
+    # Built-ins have no file ('~')
+    labels = {function: _label(function[0], function[2]) if function[0] != '~' else function[2].replace(';', ',')
+              for function in entries}
+    roots = [(function, total) for function, (_, _, _, total, callers) in entries.items() if not callers]
+    min_seconds = sum(total for _, total in roots) * MIN_PATH_SHARE
+    counts = Counter()
+
+    def walk(function, path, functions, seconds):
+        _, _, own, total, _ = entries[function]
+        stack = path + (labels[function],)
+        if total <= 0:
+            return
+        share = seconds / total
+        counts[stack] += own * share * 1e6
+        for callee, edge_seconds in callees.get(function, ()):
+            callee_seconds = edge_seconds * share
+            # Recursion is folded into the first occurrence of the function
+            if callee in functions or callee_seconds <= 0:
+                continue
+            if callee_seconds < min_seconds or len(stack) >= MAX_STACK_DEPTH:
+                counts[stack] += callee_seconds * 1e6
+            else:
+                walk(callee, stack, functions | {callee}, callee_seconds)
+
+    for function, total in roots:
+        walk(function, (), frozenset((function,)), total)
+    return counts
+
+
+def job_profile_path(output_path):
+    """Where the collapsed stacks of a profiled job are written"""
+    return f'{output_path}{PROFILE_SUFFIX}'
+
+
+def profile_call(path, function, *args, **kwargs):
+    """Run function under cProfile and write its collapsed stacks to path; returns its result"""
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        profile.disable()
+        # Written even when the function raised: where it failed is worth seeing
+        try:
+            with open(path, 'w') as f:
+                f.write(render_collapsed(collapse_stats(pstats.Stats(profile))))
+        except OSError as e:
+            logger.warning("Could not write the profile %s: %s", path, e)
+
+
+class StackSampler:
+    """Periodic stack sampler of the threads of this process"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.interval = None
+        self._thread = None
+        self._stop = threading.Event()
+        # Reentrant: the toggle signal may interrupt the main thread inside start or stop
+        self._lock = threading.RLock()
+        self._labels = {}
+        self.on_timeout = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self, interval=0.01, max_seconds=300.0):
+        """Start sampling (no-op if already running); returns whether it started"""
+        with self._lock:
+            if self.running:
+                return False
+            self.counts = Counter()
+            self.samples = 0
+            self.interval = interval
+            self.started_at = time.time()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, args=(interval, max_seconds),
+                                            name='stack-sampler', daemon=True)
+            self._thread.start()
+            return True
+
+    def stop(self):
+        """Stop sampling and return the collected Counter (None if it was not running)"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            if thread is None:
+                return None
+            self._stop.set()
+            counts = self.counts
+        # Not joined under the lock: the sampler thread stops itself on timeout
+        if thread is not threading.current_thread():
+            thread.join()
+        return counts
+
+    def _frame_label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = _label(code.co_filename, code.co_name)
+        return label
+
+    def _run(self, interval, max_seconds):
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + max_seconds
+        while not self._stop.wait(interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    stack.append(self._frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)).replace(' ', '_').replace(';', ','))
+                self.counts[tuple(reversed(stack))] += 1
+            self.samples += 1
+            if time.monotonic() >= deadline:
+                logger.warning("Stack sampler of process %s stopped after %s s", os.getpid(), max_seconds)
+                if self.on_timeout:
+                    self.on_timeout()
+                return
+
+
+class Profiler:
+    """Flask extension holding the stack sampler and the profile files of a worker"""
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.directory = None
+        self.sampler = StackSampler()
+        self.sampler.on_timeout = self._sampler_timeout
+        self._app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._app = app
+        self.enabled = app.config.setdefault('PROFILER_ENABLED', False)
+        self.directory = app.config.setdefault('PROFILE_DIR', 'profiles')
+        app.config.setdefault('PROFILER_INTERVAL', 0.01)
+        app.config.setdefault('PROFILER_MAX_SECONDS', 300.0)
+        signal_name = app.config.setdefault('PROFILER_SIGNAL', 'SIGUSR2')
+        app.config.setdefault('ADMIN_EMAILS', ())
+        app.extensions['profiler'] = self
+        if self.enabled and signal_name:
+            try:
+                signal.signal(getattr(signal, signal_name), self._on_signal)
+            except (AttributeError, ValueError, OSError) as e:
+                # Unknown signal, or not imported from the main thread
+                logger.warning("Profiler signal %s not installed: %s", signal_name, e)
+
+    def is_admin(self, user):
+        """Whether a user's email is listed in ADMIN_EMAILS"""
+        if not user or not user.is_authenticated:
+            return False
+        return user.email.lower() in {email.lower() for email in current_app.config['ADMIN_EMAILS']}
+
+    def wants_profile(self):
+        """Whether the current request asks (as an admin) for a profile of the job it submits"""
+        return bool(self.enabled and request.headers.get(PROFILE_HEADER) and self.is_admin(current_user))
+
+    def save(self, kind, text):
+        """Write a collapsed stack profile; returns its file name"""
+        os.makedirs(self.directory, exist_ok=True)
+        name = f"{kind}-{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}-{os.getpid()}{PROFILE_SUFFIX}"
+        with open(os.path.join(self.directory, name), 'w') as f:
+            f.write(text)
+        return name
+
+    def list_profiles(self):
+        if not os.path.isdir(self.directory):
+            return []
+        names = [name for name in os.listdir(self.directory) if name.endswith(PROFILE_SUFFIX)]
+        return sorted(names, reverse=True)
+
+    def profile_path(self, name):
+        """Path of a saved profile, or None for a name that is not one"""
+        if os.path.basename(name) != name or not name.endswith(PROFILE_SUFFIX):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+    def start_sampler(self):
+        config = self._app.config
+        started = self.sampler.start(config['PROFILER_INTERVAL'], config['PROFILER_MAX_SECONDS'])
+        if started:
+            logger.info("Stack sampler started in process %s", os.getpid())
+        return started
+
+    def stop_sampler(self):
+        """Stop the sampler and save its stacks; returns the file name (None if it was not running)"""
+        counts = self.sampler.stop()
+        if counts is None:
+            return None
+        name = self.save('sampler', render_collapsed(counts))
+        logger.info("Stack sampler of process %s stopped: %s samples in %s", os.getpid(),
+                    self.sampler.samples, name)
+        return name
+
+    def _sampler_timeout(self):
+        self.stop_sampler()
+
+    def _on_signal(self, signum, frame):
+        # Toggle: the first signal starts the sampler, the next one saves its stacks
+        if self.sampler.running:
+            self.stop_sampler()
+        else:
+            self.start_sampler()
+
+
+profiler = Profiler()
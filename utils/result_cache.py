@@ -0,0 +1,256 @@
+"""
+Content-addressed cache of mastering results
+
+A result is identified by the SHA-256 of the input bytes, the preset (in a
+canonical form, so key order or 4 vs 4.0 do not matter) and the output
+format and bitrate. Entries live under RESULT_CACHE_DIR as
+
+    <root>/<key[:2]>/<key>.<format>         the encoded output
+    <root>/<key[:2]>/<key>.<format>.peaks   its waveform peak file, if any
+    <root>/<key[:2]>/<key>.json             its metadata (duration, loudness)
+
+and are handed out as hard links (copies when the filesystem refuses), so
+every MasteredFile keeps its own path and evicting an entry never deletes
+a user's file. The metadata file is written last and marks a complete
+entry. Eviction is least recently used, by modification time (refreshed on
+every hit), once the total size exceeds RESULT_CACHE_MAX_BYTES.
+
+The analysis of each input (audio_processing.analysis) and its whole-track
+levels (audio_processing.preview) are kept under <root>/analysis/, keyed by
+the input digest alone. Those files are small and are not evicted.
+Preview clips are ordinary entries whose key includes the excerpt window.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from audio_processing.chain import processing_settings
+from audio_processing.peaks import PEAKS_SUFFIX
+
+logger = logging.getLogger(__name__)
+
+# Bump when the processing chain changes so stale results are not reused
+CACHE_VERSION = 2
+
+# Files stored next to an output (output path + suffix) that travel with it
+SIDECAR_SUFFIXES = (PEAKS_SUFFIX,)
+
+
+def _canonical(value):
+    """Preset value with numbers and containers in a stable form"""
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    return str(value)
+
+
+def canonical_preset(preset):
+    """JSON text identifying a preset's processing parameters (its name and description left out)"""
+    return json.dumps(_canonical(processing_settings(preset)), sort_keys=True, separators=(',', ':'))
+
+
+def _link_or_copy(source, destination):
+    """Hard link source to destination (atomically), copying across filesystems"""
+    directory = os.path.dirname(destination) or '.'
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    os.close(fd)
+    os.remove(temp_path)
+    try:
+        try:
+            os.link(source, temp_path)
+        except OSError:
+            shutil.copyfile(source, temp_path)
+        os.replace(temp_path, destination)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class ResultCache:
+    """Size-bounded LRU store of processed files keyed by input and preset"""
+
+    def __init__(self, app=None):
+        self.root = None
+        self.max_bytes = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.root = app.config.setdefault('RESULT_CACHE_DIR', 'result_cache')
+        # 0 disables the cache
+        self.max_bytes = app.config.setdefault('RESULT_CACHE_MAX_BYTES', 2 * 1024 ** 3)
+        app.extensions['result_cache'] = self
+
+    @property
+    def enabled(self):
+        return bool(self.root) and self.max_bytes > 0
+
+    def key_for(self, input_digest, preset, export_format, bitrate=None, window=None):
+        """
+        Cache key of processing an input with a preset
+
+        Args:
+            input_digest: SHA-256 of the input file (utils.file_management.file_digest)
+            preset: Dictionary containing processing parameters
+            export_format: Output format ('mp3', 'wav', ...)
+            bitrate: Encoder bitrate, when it differs from the preset's
+            window: (start, duration) in seconds of a preview excerpt
+
+        Returns:
+            key: Hex digest, or None when the cache is disabled
+        """
+        if not self.enabled:
+            return None
+        identity = {
+            'version': CACHE_VERSION,
+            'input': input_digest,
+            'preset': canonical_preset(preset),
+            'format': export_format,
+            'bitrate': bitrate or preset.get('bitrate', '320k'),
+        }
+        if window is not None:
+            identity['window'] = [round(float(value), 3) for value in window]
+        return hashlib.sha256(json.dumps(identity, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def analysis_path(self, input_digest, suffix='.json'):
+        """Where the analysis of an input is stored (see audio_processing.analysis)"""
+        if not input_digest or not self.enabled:
+            return None
+        return os.path.join(self.root, 'analysis', input_digest[:2], f'{input_digest}{suffix}')
+
+    def levels_path(self, input_digest):
+        """Where the whole-track levels of an input are stored (see audio_processing.preview)"""
+        return self.analysis_path(input_digest, suffix='.levels.json')
+
+    def _paths(self, key, export_format):
+        directory = os.path.join(self.root, key[:2])
+        return os.path.join(directory, f'{key}.{export_format}'), os.path.join(directory, f'{key}.json')
+
+    def lookup(self, key, export_format):
+        """Path of a complete cached file, or None on a miss"""
+        if not key or not self.enabled:
+            return None
+        data_path, meta_path = self._paths(key, export_format)
+        try:
+            os.utime(meta_path)
+            os.utime(data_path)
+        except OSError:
+            return None
+        return data_path
+
+    def fetch(self, key, output_path):
+        """
+        Materialize a cached result at output_path
+
+        Returns:
+            meta: Dictionary with the duration and loudness of the cached
+                result, or None on a miss
+        """
+        if not key or not self.enabled:
+            return None
+        export_format = os.path.splitext(output_path)[1].lstrip('.').lower()
+        data_path, meta_path = self._paths(key, export_format)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+            _link_or_copy(data_path, output_path)
+            for suffix in SIDECAR_SUFFIXES:
+                if os.path.exists(data_path + suffix):
+                    _link_or_copy(data_path + suffix, output_path + suffix)
+            os.utime(data_path)
+            os.utime(meta_path)
+        except (OSError, ValueError):
+            return None  # Missing, half-written or evicted meanwhile
+        return meta
+
+    def fetch_all(self, entries):
+        """
+        Materialize several cached results, only when every one is cached
+
+        All entries are looked up before any file is linked, so a job with
+        one missing export is rendered once instead of copying the others
+        first.
+
+        Args:
+            entries: List of (key, output_path) tuples
+
+        Returns:
+            metas: One meta dictionary per entry (see fetch), or None if any
+                entry is a miss
+        """
+        for key, output_path in entries:
+            if self.lookup(key, os.path.splitext(output_path)[1].lstrip('.').lower()) is None:
+                return None
+        metas = [self.fetch(key, output_path) for key, output_path in entries]
+        if any(meta is None for meta in metas):
+            return None  # Evicted between the lookup and the fetch
+        return metas
+
+    def store(self, key, output_path, duration=None, loudness=None):
+        """Add a freshly processed file to the cache and evict old entries"""
+        if not key or not self.enabled:
+            return
+        export_format = os.path.splitext(output_path)[1].lstrip('.').lower()
+        data_path, meta_path = self._paths(key, export_format)
+        if os.path.exists(meta_path):
+            return
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        _link_or_copy(output_path, data_path)
+        for suffix in SIDECAR_SUFFIXES:
+            if os.path.exists(output_path + suffix):
+                _link_or_copy(output_path + suffix, data_path + suffix)
+
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(meta_path), prefix='.tmp-')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'duration': duration, 'loudness': loudness, 'format': export_format}, f)
+        os.replace(temp_path, meta_path)
+
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits in max_bytes"""
+        entries = []
+        total = 0
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(('.json',) + SIDECAR_SUFFIXES) or filename.startswith('.tmp-'):
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                # Metadata first so the entry stops being served
+                os.remove(os.path.splitext(path)[0] + '.json')
+            except OSError:
+                pass
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning("Could not evict cached result %s: %s", path, e)
+                continue
+            total -= size
+            for suffix in SIDECAR_SUFFIXES:
+                try:
+                    os.remove(path + suffix)
+                except OSError:
+                    pass
+
+
+result_cache = ResultCache()
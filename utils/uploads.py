@@ -0,0 +1,163 @@
+"""
+Resumable uploads (tus-style offset/patch semantics)
+
+An upload is created with its final length, then its bytes are appended
+by PATCH requests that each carry the offset they start at. Every chunk is
+streamed from the request body to a .part file in small pieces, so neither
+the full body nor the full file is held in memory, and a transfer is
+spread over many short requests instead of holding a worker for its whole
+duration. The offset stored in the Upload row only moves once a chunk is
+on disk, so a client whose connection dropped asks for the offset (HEAD)
+and resumes from there.
+
+The SHA-256 of the file is computed while the chunks arrive. The running
+hash of each upload is kept in memory by the process that received the
+last chunk; another process, or one restarted meanwhile, rebuilds it by
+reading the part already on disk once. The final digest is stored with the
+upload and used as the input hash of the result cache. A chunk can also
+carry its own checksum (Upload-Checksum: sha256 <base64>); a chunk that
+does not match it is discarded.
+"""
+import base64
+import fcntl
+import hashlib
+import os
+import threading
+
+from werkzeug.exceptions import ClientDisconnected
+
+# Bytes read from the request body at a time
+READ_SIZE = 1024 * 1024
+
+_running_hashes = {}
+_running_hashes_lock = threading.Lock()
+
+
+class ChecksumMismatch(ValueError):
+    """The chunk does not match its Upload-Checksum header"""
+
+
+class UploadLocked(RuntimeError):
+    """Another request is already appending to the upload"""
+
+
+def part_path(upload, folder):
+    """Where the bytes of an unfinished upload are written"""
+    return os.path.join(folder, f'{upload.stored_filename}.part')
+
+
+def parse_checksum(header):
+    """
+    (algorithm, digest bytes) of an Upload-Checksum header, or None
+
+    Raises:
+        ValueError: if the header is malformed or the algorithm unsupported
+    """
+    if not header:
+        return None
+    algorithm, _, value = header.strip().partition(' ')
+    if algorithm.lower() != 'sha256':
+        raise ValueError(f"Unsupported checksum algorithm: {algorithm}")
+    return algorithm.lower(), base64.b64decode(value, validate=True)
+
+
+def parse_metadata(header):
+    """Key/value pairs of an Upload-Metadata header (values are base64)"""
+    metadata = {}
+    for pair in (header or '').split(','):
+        key, _, value = pair.strip().partition(' ')
+        if key:
+            try:
+                metadata[key] = base64.b64decode(value, validate=True).decode('utf-8') if value else ''
+            except ValueError:
+                continue
+    return metadata
+
+
+def _running_hash(upload_id, path, offset):
+    """SHA-256 object of the first offset bytes of an upload"""
+    with _running_hashes_lock:
+        entry = _running_hashes.pop(upload_id, None)
+    if entry is not None and entry[0] == offset:
+        return entry[1]
+
+    digest = hashlib.sha256()
+    remaining = offset
+    with open(path, 'rb') as f:
+        while remaining:
+            data = f.read(min(READ_SIZE, remaining))
+            if not data:
+                raise ValueError("The upload is shorter on disk than its offset")
+            digest.update(data)
+            remaining -= len(data)
+    return digest
+
+
+def forget(upload_id):
+    """Drop the running hash of a finished or cancelled upload"""
+    with _running_hashes_lock:
+        _running_hashes.pop(upload_id, None)
+
+
+def append_chunk(upload, folder, stream, length, checksum=None):
+    """
+    Append a request body to an upload
+
+    Args:
+        upload: Upload row (offset and length are read, not modified)
+        folder: Upload folder
+        stream: Request body stream
+        length: Content-Length of the body
+        checksum: Parsed Upload-Checksum header (see parse_checksum), if any
+
+    Returns:
+        (offset, sha256): New offset, and the hex digest of the whole file
+            once the last byte has arrived (else None)
+
+    Raises:
+        UploadLocked: if a request is already writing to this upload
+        ChecksumMismatch: if the chunk does not match checksum (it is
+            discarded)
+    """
+    path = part_path(upload, folder)
+    with open(path, 'ab+') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadLocked(upload.id)
+
+        # Bytes past the stored offset belong to a chunk that was never accepted
+        f.truncate(upload.offset)
+        f.seek(upload.offset)
+        digest = _running_hash(upload.id, path, upload.offset)
+        chunk_digest = hashlib.sha256() if checksum else None
+
+        written = 0
+        try:
+            while written < length:
+                data = stream.read(min(READ_SIZE, length - written))
+                if not data:
+                    break
+                f.write(data)
+                digest.update(data)
+                if chunk_digest:
+                    chunk_digest.update(data)
+                written += len(data)
+        except ClientDisconnected:
+            pass  # Keep what arrived, unless it has to match a checksum
+        f.flush()
+
+        if chunk_digest and (written < length or chunk_digest.digest() != checksum[1]):
+            f.truncate(upload.offset)
+            if written == length:
+                raise ChecksumMismatch(upload.id)
+            return upload.offset, None
+
+        offset = upload.offset + written
+        if offset >= upload.length:
+            forget(upload.id)
+            return offset, digest.hexdigest()
+
+        with _running_hashes_lock:
+            _running_hashes[upload.id] = (offset, digest)
+        return offset, None